@@ -0,0 +1,5 @@
+"""
+بنچمارک‌های ربات؛ همه بدون شبکه و با Bot API جعلی (bot/utils/fake_bot_api.py) اجرا می‌شوند.
+
+    python -m benchmarks.loadtest --groups 2000 --updates 20000
+"""
@@ -0,0 +1,340 @@
+"""
+میکروبنچمارک توابع داغ و خالص ربات، بدون شبکه و با داده ساختگی (دیتابیس موقت و قرآن
+ساختگی ۶۲۳۶ آیه‌ای).
+
+هر بنچمارک چند دور اجرا می‌شود و کمترین زمان هر فراخوانی (میکروثانیه) در دورها با
+benchmarks/baselines.json مقایسه می‌شود؛ اگر کندتر از baseline * (1 + threshold) باشد
+رگرسیون گزارش و کد خروج 1 برگردانده می‌شود. baseline وابسته به ماشین است؛ بعد از تغییر
+عمدی یا روی ماشین جدید با --save دوباره ذخیره کنید.
+
+Usage:
+    python -m benchmarks.micro                      # اجرا و مقایسه با baseline
+    python -m benchmarks.micro -k tag --rounds 9    # فقط بنچمارک‌هایی که نامشان شامل tag است
+    python -m benchmarks.micro --save               # ذخیره نتایج فعلی به عنوان baseline
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+DEFAULT_THRESHOLD = 0.25
+# حداقل زمان هر دور؛ تعداد تکرار هر دور بر این اساس تنظیم می‌شود
+MIN_ROUND_TIME = 0.1
+# بار کاری ثابت پایتونی برای نرمال‌سازی سرعت ماشین؛ نتایج به نسبت آن مقایسه می‌شوند
+CALIBRATION = "_calibration"
+QURAN_VERSES = 6236
+
+# نام -> سازنده‌ای که تابع قابل اندازه‌گیری (sync یا async، بدون آرگومان) برمی‌گرداند
+BENCHMARKS: Dict[str, Callable[[], Callable]] = {}
+
+
+def benchmark(name: str):
+    def register(factory: Callable[[], Callable]) -> Callable[[], Callable]:
+        BENCHMARKS[name] = factory
+        return factory
+    return register
+
+
+# ---------------------------------------------------------------------------
+# داده ساختگی
+# ---------------------------------------------------------------------------
+
+def fake_verses(count: int = QURAN_VERSES) -> List[Dict]:
+    """آیه‌های ساختگی با همان کلیدهای data/quran.json؛ هر سوره ۵۰ آیه."""
+    verses = []
+    for verse_id in range(1, count + 1):
+        surah, ayah = divmod(verse_id - 1, 50)
+        verses.append({
+            "id": verse_id,
+            "surah_number": surah + 1,
+            "ayah_number": ayah + 1,
+            "surah_name": f"سوره {surah + 1}",
+            "juz_number": verse_id * 30 // count + 1,
+            "page_number": verse_id * 604 // count + 1,
+            "text": "بِسْمِ اللَّهِ الرَّحْمَٰنِ الرَّحِيمِ " * 3,
+            "translation": "به نام خداوند بخشنده مهربان " * 4,
+            "bismillah": "بِسْمِ اللَّهِ الرَّحْمَٰنِ الرَّحِيمِ" if ayah == 0 else "",
+            "audio_arabic": f"https://t.me/quran_audio/{surah + 1}",
+            "audio_persian": f"https://t.me/quran_fa/{surah + 1}",
+        })
+    return verses
+
+
+def fake_quran_manager():
+    from bot.utils.quran import QuranManager
+
+    manager = QuranManager(json_path="data/quran.json")
+    manager.verses = fake_verses()
+    manager.verse_by_id = {v["id"]: v for v in manager.verses}
+    manager.verse_by_surah_ayah = {(v["surah_number"], v["ayah_number"]): v for v in manager.verses}
+    return manager
+
+
+def fake_members(count: int) -> List[tuple]:
+    return [(100_000 + i, f"user_{i}" if i % 3 else None, f"Name.{i}!") for i in range(count)]
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+# ---------------------------------------------------------------------------
+# بنچمارک‌ها
+# ---------------------------------------------------------------------------
+
+@benchmark("parse_number/ascii")
+def bench_parse_number_ascii():
+    from bot.utils.helpers import parse_number
+    return lambda: parse_number("125")
+
+
+@benchmark("parse_number/persian_grouped")
+def bench_parse_number_persian():
+    from bot.utils.helpers import parse_number
+    return lambda: parse_number(" ۱,۲۵۰,۰۰۰ ")
+
+
+@benchmark("parse_number/not_a_number")
+def bench_parse_number_text():
+    from bot.utils.helpers import parse_number
+    return lambda: parse_number("التماس دعا")
+
+
+def _format_ghoran(verse_count: int):
+    from bot.utils.helpers import format_khatm_message
+
+    verses = fake_verses(verse_count)
+
+    async def run():
+        return await format_khatm_message(
+            khatm_type="ghoran", previous_total=0, amount=verse_count, new_total=verse_count,
+            sepas_text="التماس دعا", group_id=-100, verses=verses, max_display_verses=verse_count,
+        )
+    return run
+
+
+@benchmark("format_khatm_message/ghoran_1")
+def bench_format_ghoran_1():
+    return _format_ghoran(1)
+
+
+@benchmark("format_khatm_message/ghoran_10")
+def bench_format_ghoran_10():
+    return _format_ghoran(10)
+
+
+@benchmark("format_khatm_message/ghoran_100")
+def bench_format_ghoran_100():
+    return _format_ghoran(100)
+
+
+@benchmark("format_khatm_message/salavat")
+def bench_format_salavat():
+    from bot.utils.helpers import format_khatm_message
+
+    async def run():
+        return await format_khatm_message(
+            khatm_type="salavat", previous_total=1000, amount=14, new_total=1014,
+            sepas_text="التماس دعا", group_id=-100,
+        )
+    return run
+
+
+def _tag_messages(member_count: int):
+    from bot.handlers.tag_handlers import TagManager
+
+    members = fake_members(member_count)
+    manager = TagManager(None)
+
+    async def run():
+        return [message async for message in manager._iter_messages(_aiter(members))]
+    return run
+
+
+@benchmark("tag_messages/1k")
+def bench_tag_messages_1k():
+    return _tag_messages(1_000)
+
+
+@benchmark("tag_messages/10k")
+def bench_tag_messages_10k():
+    return _tag_messages(10_000)
+
+
+@benchmark("quran/get_verses_in_range_10")
+def bench_verses_in_range_10():
+    manager = fake_quran_manager()
+    return lambda: manager.get_verses_in_range(3000, 3009)
+
+
+@benchmark("quran/get_verses_in_range_1000")
+def bench_verses_in_range_1000():
+    manager = fake_quran_manager()
+    return lambda: manager.get_verses_in_range(3000, 3999)
+
+
+@benchmark("clean_hadith_text")
+def bench_clean_hadith_text():
+    from bot.handlers.hadith_handlers import clean_hadith_text
+
+    text = ("امام علی (ع) فرمودند:   دانش   بهتر از ثروت است؛ دانش تو را نگه می‌دارد و تو ثروت را. "
+            "@HadithChannel https://t.me/HadithChannel/1234 t.me/joinchat/abc ") * 3
+    return lambda: clean_hadith_text(text)
+
+
+@benchmark("match_text_command/number")
+def bench_match_number():
+    # مسیر داغ: هر پیام عددی کل جدول دستورات را بدون تطابق پیمایش می‌کند
+    from bot.handlers.admin_handlers import match_text_command
+    return lambda: match_text_command("125")
+
+
+@benchmark("match_text_command/persian_with_args")
+def bench_match_persian_args():
+    from bot.handlers.admin_handlers import match_text_command
+    return lambda: match_text_command("اضافه ذکر سبحان الله")
+
+
+# ---------------------------------------------------------------------------
+# اجرا
+# ---------------------------------------------------------------------------
+
+async def _time_calls(func: Callable, number: int, is_async: bool) -> float:
+    started = time.perf_counter()
+    if is_async:
+        for _ in range(number):
+            await func()
+    else:
+        for _ in range(number):
+            func()
+    return time.perf_counter() - started
+
+
+async def measure(func: Callable, rounds: int) -> Dict[str, float]:
+    """تعداد تکرار را طوری تنظیم می‌کند که هر دور حداقل MIN_ROUND_TIME طول بکشد."""
+    is_async = inspect.iscoroutinefunction(func)
+    await _time_calls(func, 1, is_async)  # گرم کردن (import‌ها، کش کامپایل regex)
+    number = 1
+    while True:
+        elapsed = await _time_calls(func, number, is_async)
+        if elapsed >= MIN_ROUND_TIME:
+            break
+        number = max(number * 2, int(number * MIN_ROUND_TIME / max(elapsed, 1e-9)))
+    per_call = [await _time_calls(func, number, is_async) / number for _ in range(rounds)]
+    return {
+        "median_us": round(statistics.median(per_call) * 1e6, 3),
+        "min_us": round(min(per_call) * 1e6, 3),
+        "calls_per_round": number,
+    }
+
+
+def _calibration_workload():
+    return sorted(str(i * 7919 % 1000) for i in range(200))
+
+
+def compare(results: Dict[str, Dict], baselines: Dict[str, Dict], threshold: float,
+            normalize: bool = False) -> List[str]:
+    # normalize: اگر baseline روی ماشین کندتر/سریع‌تری ذخیره شده، با نسبت بار کالیبراسیون
+    # جبران می‌شود (روی ماشین پرنویز خود کالیبراسیون هم نویز اضافه می‌کند)
+    speed = 1.0
+    if normalize and CALIBRATION in results and CALIBRATION in baselines:
+        speed = results[CALIBRATION]["min_us"] / baselines[CALIBRATION]["min_us"]
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if not baseline or name == CALIBRATION:
+            continue
+        # کمینه دورها کمتر از میانه تحت تاثیر نویز ماشین (پروسه‌های دیگر، GC) است
+        ratio = result["min_us"] / (baseline["min_us"] * speed)
+        result["baseline_us"] = baseline["min_us"]
+        result["ratio"] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+async def run_benchmarks(names: List[str], rounds: int) -> Dict[str, Dict]:
+    from bot.database.db import close_db_connection, init_db
+
+    # format_khatm_message برای درصد پیشرفت ختم قرآن از دیتابیس می‌خواند
+    await init_db()
+    funcs = {name: BENCHMARKS[name]() for name in names}
+    results = {CALIBRATION: await measure(_calibration_workload, rounds)}
+    try:
+        for name, func in funcs.items():
+            results[name] = await measure(func, rounds)
+            print(f"  {name:<42} {results[name]['median_us']:>12.3f} us", flush=True)
+    finally:
+        await close_db_connection()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks with stored baselines.")
+    parser.add_argument("-k", dest="keyword", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown over the baseline (0.25 = 25%%)")
+    parser.add_argument("--baselines", default=BASELINES_PATH)
+    parser.add_argument("--normalize", action="store_true",
+                        help="scale the baselines by the calibration workload (baselines from another machine)")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--json", dest="json_path", default=None, help="also write the results as JSON")
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if not args.keyword or args.keyword in name]
+    if not names:
+        parser.error(f"no benchmark matches {args.keyword!r}")
+
+    # دیتابیس موقت؛ تنظیمات هنگام import خوانده می‌شوند
+    data_dir = tempfile.mkdtemp(prefix="khatm_micro_")
+    os.environ["DATABASE_PATH"] = os.path.join(data_dir, "khatm_bot.db")
+    os.environ["ARCHIVE_DATABASE_PATH"] = ""
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456:benchmark")
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f"running {len(names)} benchmark(s), {args.rounds} rounds each")
+    results = asyncio.run(run_benchmarks(names, args.rounds))
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, encoding="utf-8") as f:
+            baselines = json.load(f)
+    regressions = compare(results, baselines, args.threshold, args.normalize)
+
+    row = "{:<42} {:>12} {:>12} {:>12} {:>8}"
+    print("\n" + row.format("benchmark", "median us", "min us", "baseline us", "ratio"))
+    for name, result in results.items():
+        print(row.format(name, result["median_us"], result["min_us"], result.get("baseline_us", "-"),
+                         result.get("ratio", "-")))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save:
+        baselines.update({
+            name: {"median_us": result["median_us"], "min_us": result["min_us"]} for name, result in results.items()
+        })
+        with open(args.baselines, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+            f.write("\n")
+        print(f"\nbaselines saved to {args.baselines}")
+        return 0
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    print("\nno regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,61 @@
 import aiosqlite
 import logging
 import asyncio
+import os
 import random
-from typing import Any, Dict, List, Optional
-from config.settings import DATABASE_PATH
+import hashlib
+import json
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+from config.settings import DATABASE_PATH, ARCHIVE_DATABASE_PATH, CONTRIBUTION_RETENTION_DAYS, SHARD_DATABASE_PATHS
 from datetime import datetime
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from bot.utils.constants import DEFAULT_SEPAS_TEXTS
+from bot.utils.metrics import (
+    REGISTRY, SQL_SECONDS, QUEUE_REQUEST_SECONDS, QUEUE_REQUEST_RETRIES, QUEUE_REQUEST_FAILURES, sql_label,
+)
+from bot.utils.tracing import attach_to_request, current_trace, span
 
 logger = logging.getLogger(__name__)
 
-write_queue = asyncio.Queue()
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "schema.sql")
+INDEXES_PATH = os.path.join(os.path.dirname(__file__), "indexes.sql")
+
+
+
+class WriteQueue(asyncio.Queue):
+    """صف نوشتن که زمان ورود هر آیتم را نگه می‌دارد تا سن قدیمی‌ترین آیتم قابل اندازه‌گیری باشد."""
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._enqueued_at = deque()
+
+    def _put(self, item):
+        # put_nowait در context فراخواننده اجرا می‌شود، پس trace هندلر همین‌جا در دسترس است
+        if isinstance(item, dict):
+            attach_to_request(item)
+        super()._put(item)
+        self._enqueued_at.append(time.monotonic())
+
+    def _get(self):
+        self._enqueued_at.popleft()
+        return super()._get()
+
+    def oldest_age(self) -> float:
+        return time.monotonic() - self._enqueued_at[0] if self._enqueued_at else 0.0
+
+
+write_queue = WriteQueue()
+REGISTRY.gauge("bot_write_queue_depth", "Requests waiting in write_queue", callback=write_queue.qsize)
+REGISTRY.gauge("bot_write_queue_oldest_age_seconds", "Age of the oldest request in write_queue",
+               callback=write_queue.oldest_age)
 _db_connection = None
+_archive_attached = False
+# همه نوشتن‌ها روی _db_connection مشترک (صف، execute، فشرده‌سازی، persistence) پشت سر هم
+# اجرا می‌شوند تا commit یک فراخوان نیمه‌کار تراکنش دیگری را commit یا rollback نکند
+_write_lock = asyncio.Lock()
 
 class DatabaseError(Exception):
     """Custom exception class for database-related errors."""
@@ -29,23 +74,34 @@ async def init_db_connection():
         _db_connection.row_factory = aiosqlite.Row
         logger.info("Database connection initialized: %s", DATABASE_PATH)
 
+@asynccontextmanager
+async def write_transaction():
+    """تراکنش نوشتن روی اتصال مشترک: commit در پایان بلوک و rollback در صورت خطا."""
+    async with _write_lock:
+        await init_db_connection()
+        try:
+            yield _db_connection
+            await _db_connection.commit()
+        except BaseException:
+            await _db_connection.rollback()
+            raise
+
 async def close_db_connection():
-    global _db_connection
+    global _db_connection, _archive_attached
     if _db_connection:
         await _db_connection.close()
         _db_connection = None
+        _archive_attached = False
         logger.info("Database connection closed")
 
 
 
 
 
-# این کد را در bot/database/db.py جایگزین تابع قبلی check_and_apply_migrations کنید
-
-async def check_and_apply_migrations():
+async def check_and_apply_migrations(conn):
     """
-    (ناهمزمان) هر بار هنگام اجرای ربات، ساختار دیتابیس را چک کرده
-    و ستون‌های گمشده را بدون حذف داده‌ها اضافه می‌کند.
+    (ناهمزمان) ساختار دیتابیس را چک کرده و ستون‌های گمشده را بدون حذف داده‌ها
+    اضافه می‌کند. فقط به‌عنوان مرحله پایه موتور مهاجرت (run_migrations) اجرا می‌شود.
     """
     logger.info("در حال بررسی ساختار دیتابیس و اعمال مهاجرت‌ها (Async)...")
     
@@ -66,79 +122,81 @@ async def check_and_apply_migrations():
             return set() # در صورت بروز خطا، مجموعه خالی برمی‌گردانیم
 
     try:
-        # ما از یک اتصال async جدید برای اجرای مهاجرت استفاده می‌کنیم
-        async with aiosqlite.connect(DATABASE_PATH) as conn:
+        # --- مهاجرت جدول 'contributions' (رفع باگ اصلی) ---
+        contrib_columns = await get_columns(conn, 'contributions')
+        if contrib_columns and 'zekr_id' not in contrib_columns:
+            logger.warning("مهاجرت: ستون 'zekr_id' در 'contributions' یافت نشد. در حال افزودن...")
+            try:
+                await conn.execute("""
+                    ALTER TABLE contributions
+                    ADD COLUMN zekr_id INTEGER
+                    REFERENCES topic_zekrs(id) ON DELETE SET NULL
+                """)
+                logger.info("مهاجرت موفق: ستون 'zekr_id' (با Foreign Key) به 'contributions' اضافه شد.")
+            except aiosqlite.OperationalError as e:
+                logger.warning(f"افزودن Foreign Key برای 'zekr_id' شکست خورد ({e}). در حال افزودن ستون ساده...")
+                await conn.execute("ALTER TABLE contributions ADD COLUMN zekr_id INTEGER")
+                logger.info("مهاجرت موفق: ستون 'zekr_id' (ساده) به 'contributions' اضافه شد.")
+            await conn.commit()
+
+        if contrib_columns and 'reset_epoch' not in contrib_columns:
+            logger.warning("مهاجرت: ستون 'reset_epoch' در 'contributions' یافت نشد. در حال افزودن...")
+            await conn.execute("ALTER TABLE contributions ADD COLUMN reset_epoch INTEGER DEFAULT 0")
+            await conn.commit()
+            logger.info("مهاجرت موفق: ستون 'reset_epoch' به 'contributions' اضافه شد.")
+
+        # --- مهاجرت جدول 'groups' ---
+        groups_columns = await get_columns(conn, 'groups')
+        if groups_columns:
+            migrations_applied = False
+            if 'min_display_verses' not in groups_columns:
+                logger.warning("مهاجرت: ستون 'min_display_verses' در 'groups' یافت نشد. در حال افزودن...")
+                await conn.execute("ALTER TABLE groups ADD COLUMN min_display_verses INTEGER DEFAULT 1")
+                migrations_applied = True
             
-            # !!!!!!!!!!! راه‌حل اینجاست !!!!!!!!!!!
-            # این خط حیاتی، اتصال جدید ما را وادار می‌کند ردیف‌ها را
-            # به صورت دیکشنری برگرداند (مانند اتصال اصلی ربات)
-            conn.row_factory = aiosqlite.Row
-            # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-
-            # --- مهاجرت جدول 'contributions' (رفع باگ اصلی) ---
-            contrib_columns = await get_columns(conn, 'contributions')
-            if contrib_columns and 'zekr_id' not in contrib_columns:
-                logger.warning("مهاجرت: ستون 'zekr_id' در 'contributions' یافت نشد. در حال افزودن...")
-                try:
-                    await conn.execute("""
-                        ALTER TABLE contributions
-                        ADD COLUMN zekr_id INTEGER
-                        REFERENCES topic_zekrs(id) ON DELETE SET NULL
-                    """)
-                    logger.info("مهاجرت موفق: ستون 'zekr_id' (با Foreign Key) به 'contributions' اضافه شد.")
-                except aiosqlite.OperationalError as e:
-                    logger.warning(f"افزودن Foreign Key برای 'zekr_id' شکست خورد ({e}). در حال افزودن ستون ساده...")
-                    await conn.execute("ALTER TABLE contributions ADD COLUMN zekr_id INTEGER")
-                    logger.info("مهاجرت موفق: ستون 'zekr_id' (ساده) به 'contributions' اضافه شد.")
+            if 'invite_link' not in groups_columns:
+                logger.warning("مهاجرت: ستون 'invite_link' در 'groups' یافت نشد. در حال افزودن...")
+                await conn.execute("ALTER TABLE groups ADD COLUMN invite_link TEXT DEFAULT ''")
+                migrations_applied = True
+
+            if 'title' not in groups_columns:
+                logger.warning("مهاجرت: ستون 'title' در 'groups' یافت نشد. در حال افزودن...")
+                await conn.execute("ALTER TABLE groups ADD COLUMN title TEXT DEFAULT ''")
+                migrations_applied = True
+            
+            if migrations_applied:
                 await conn.commit()
+                logger.info("مهاجرت جدول 'groups' با موفقیت انجام شد.")
+
+        # --- مهاجرت جدول 'topics' ---
+        topics_columns = await get_columns(conn, 'topics')
+        if topics_columns:
+            migrations_applied = False
+            if 'is_completed' not in topics_columns:
+                logger.warning("مهاجرت: ستون 'is_completed' در 'topics' یافت نشد. در حال افزودن...")
+                await conn.execute("ALTER TABLE topics ADD COLUMN is_completed INTEGER DEFAULT 0")
+                migrations_applied = True
+            
+            if 'created_at' not in topics_columns:
+                logger.warning("مهاجرت: ستون 'created_at' در 'topics' یافت نشد. در حال افزودن...")
+                await conn.execute("ALTER TABLE topics ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+                migrations_applied = True
+
+            if 'updated_at' not in topics_columns:
+                logger.warning("مهاجرت: ستون 'updated_at' در 'topics' یافت نشد. در حال افزودن...")
+                await conn.execute("ALTER TABLE topics ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+                migrations_applied = True
+
+            if 'reset_epoch' not in topics_columns:
+                logger.warning("مهاجرت: ستون 'reset_epoch' در 'topics' یافت نشد. در حال افزودن...")
+                await conn.execute("ALTER TABLE topics ADD COLUMN reset_epoch INTEGER DEFAULT 0")
+                migrations_applied = True
+            
+            if migrations_applied:
+                await conn.commit()
+                logger.info("مهاجرت جدول 'topics' با موفقیت انجام شد.")
 
-            # --- مهاجرت جدول 'groups' ---
-            groups_columns = await get_columns(conn, 'groups')
-            if groups_columns:
-                migrations_applied = False
-                if 'min_display_verses' not in groups_columns:
-                    logger.warning("مهاجرت: ستون 'min_display_verses' در 'groups' یافت نشد. در حال افزودن...")
-                    await conn.execute("ALTER TABLE groups ADD COLUMN min_display_verses INTEGER DEFAULT 1")
-                    migrations_applied = True
-                
-                if 'invite_link' not in groups_columns:
-                    logger.warning("مهاجرت: ستون 'invite_link' در 'groups' یافت نشد. در حال افزودن...")
-                    await conn.execute("ALTER TABLE groups ADD COLUMN invite_link TEXT DEFAULT ''")
-                    migrations_applied = True
-
-                if 'title' not in groups_columns:
-                    logger.warning("مهاجرت: ستون 'title' در 'groups' یافت نشد. در حال افزودن...")
-                    await conn.execute("ALTER TABLE groups ADD COLUMN title TEXT DEFAULT ''")
-                    migrations_applied = True
-                
-                if migrations_applied:
-                    await conn.commit()
-                    logger.info("مهاجرت جدول 'groups' با موفقیت انجام شد.")
-
-            # --- مهاجرت جدول 'topics' ---
-            topics_columns = await get_columns(conn, 'topics')
-            if topics_columns:
-                migrations_applied = False
-                if 'is_completed' not in topics_columns:
-                    logger.warning("مهاجرت: ستون 'is_completed' در 'topics' یافت نشد. در حال افزودن...")
-                    await conn.execute("ALTER TABLE topics ADD COLUMN is_completed INTEGER DEFAULT 0")
-                    migrations_applied = True
-                
-                if 'created_at' not in topics_columns:
-                    logger.warning("مهاجرت: ستون 'created_at' در 'topics' یافت نشد. در حال افزودن...")
-                    await conn.execute("ALTER TABLE topics ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-                    migrations_applied = True
-
-                if 'updated_at' not in topics_columns:
-                    logger.warning("مهاجرت: ستون 'updated_at' در 'topics' یافت نشد. در حال افزودن...")
-                    await conn.execute("ALTER TABLE topics ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-                    migrations_applied = True
-                
-                if migrations_applied:
-                    await conn.commit()
-                    logger.info("مهاجرت جدول 'topics' با موفقیت انجام شد.")
-
-            logger.info("بررسی مهاجرت دیتابیس با موفقیت کامل شد.")
+        logger.info("بررسی مهاجرت دیتابیس با موفقیت کامل شد.")
 
     except aiosqlite.Error as e:
         logger.error(f"خطای بحرانی در زمان اجرای مهاجرت دیتابیس: {e}", exc_info=True)
@@ -147,26 +205,188 @@ async def check_and_apply_migrations():
 
 
 
-async def init_db():
-    try:
-        async with aiosqlite.connect(DATABASE_PATH) as conn:
-            with open("bot/database/schema.sql", "r", encoding='utf-8') as f:
-                await conn.executescript(f.read())
-            await conn.commit()
-            logger.info("Database schema initialized successfully")
-
+def _read_sql_file(path: str) -> str:
+    with open(path, "r", encoding='utf-8') as f:
+        return f.read()
 
+async def _migration_baseline(conn):
+    """schema.sql + ستون‌های گمشده دیتابیس‌های قدیمی."""
+    # حذف متن‌های سپاس پیش‌فرض تکراری؛ باید قبل از ساخت idx_unique_default_sepas اجرا شود
+    if await (await conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sepas_texts'")).fetchone():
+        await conn.execute(
+            """
+            DELETE FROM sepas_texts
+            WHERE is_default = 1 AND rowid NOT IN (
+                SELECT MIN(rowid)
+                FROM sepas_texts
+                WHERE is_default = 1
+                GROUP BY text
+            )
+            """
+        )
+        await conn.commit()
+    await _apply_schema(conn)
+    await check_and_apply_migrations(conn)
+    # ایندکس‌های مرحله ۲ (indexes.sql) به این ستون‌ها نیاز دارند
+    await _migration_groups_invite_link_state(conn)
+
+async def _apply_schema(conn):
+    """schema.sql فقط شامل CREATE ... IF NOT EXISTS است و اجرای دوباره آن بی‌خطر است."""
+    await conn.executescript(_read_sql_file(SCHEMA_PATH))
+
+async def _migration_tag_jobs(conn):
+    """tag_jobs + بازسازی tag_timestamps بدون کلید خارجی به groups."""
+    await conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS tag_timestamps_new (
+            group_id INTEGER PRIMARY KEY,
+            last_tag_time TEXT NOT NULL
+        );
+        INSERT OR IGNORE INTO tag_timestamps_new (group_id, last_tag_time)
+        SELECT group_id, last_tag_time FROM tag_timestamps;
+        DROP TABLE tag_timestamps;
+        ALTER TABLE tag_timestamps_new RENAME TO tag_timestamps;
+        """
+    )
+    await _apply_schema(conn)
+
+async def _migration_topics_zekr_text(conn):
+    """ستون zekr_text که کدها از آن استفاده می‌کنند ولی در schema.sql دیتابیس‌های تازه نبود."""
+    async with conn.execute("PRAGMA table_info(topics)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if 'zekr_text' not in columns:
+        await conn.execute("ALTER TABLE topics ADD COLUMN zekr_text TEXT DEFAULT ''")
+
+# وضعیت لینک دعوت هر گروه برای بررسی تدریجی (refresh_invite_links در main.py)
+INVITE_LINK_COLUMNS = {
+    "invite_link_created_at": "TIMESTAMP",
+    "invite_link_verified_at": "TIMESTAMP",
+    "invite_link_checked_at": "TIMESTAMP",
+    "invite_link_failures": "INTEGER DEFAULT 0",
+}
+
+async def _migration_groups_invite_link_state(conn):
+    """زمان ساخت، آخرین تأیید، آخرین بررسی و تعداد خطاهای پیاپی لینک دعوت."""
+    async with conn.execute("PRAGMA table_info(groups)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    for name, definition in INVITE_LINK_COLUMNS.items():
+        if name not in columns:
+            await conn.execute(f"ALTER TABLE groups ADD COLUMN {name} {definition}")
+
+async def _apply_tuned_indexes(conn):
+    await conn.executescript(_read_sql_file(INDEXES_PATH))
+
+async def _bulk_seed(conn, name: str, query: str, rows: Sequence[tuple]) -> int:
+    """
+    داده مرجع را با executemany و INSERT OR IGNORE در یک تراکنش وارد می‌کند.
+    اگر هش محتوا با آخرین seed ثبت‌شده یکی باشد هیچ کاری انجام نمی‌شود.
+    """
+    rows = [tuple(row) for row in rows]
+    digest = hashlib.sha256(
+        json.dumps([query, rows], ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+    async with conn.execute("SELECT content_hash FROM reference_seeds WHERE name = ?", (name,)) as cursor:
+        row = await cursor.fetchone()
+    if row and row[0] == digest:
+        logger.debug("Reference data %s unchanged, skipping seed", name)
+        return 0
+    changes_before = conn.total_changes
+    try:
+        await conn.executemany(query, rows)
+        inserted = conn.total_changes - changes_before
+        await conn.execute(
+            "INSERT OR REPLACE INTO reference_seeds (name, content_hash, row_count, seeded_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+            (name, digest, len(rows))
+        )
+        await conn.commit()
+    except aiosqlite.Error:
+        await conn.rollback()
+        raise
+    logger.info("Seeded reference data %s: rows=%s, inserted=%s", name, len(rows), inserted)
+    return inserted
+
+# داده‌های مرجع: نام -> (کوئری INSERT OR IGNORE، تابع تولید ردیف‌ها)
+REFERENCE_DATA = {
+    "default_sepas_texts": (
+        "INSERT OR IGNORE INTO sepas_texts (text, is_default, group_id) VALUES (?, 1, NULL)",
+        lambda: [(text,) for text in DEFAULT_SEPAS_TEXTS],
+    ),
+}
+
+async def seed_reference_data(name: str, query: str, rows: Sequence[tuple]) -> int:
+    """Bulk-seed reference rows on the shared connection, gated on a content hash."""
+    try:
+        await init_db_connection()
+        return await _bulk_seed(_db_connection, name, query, rows)
+    except Exception as e:
+        logger.error("Error seeding reference data %s: %s", name, e, exc_info=True)
+        raise DatabaseError(f"Error seeding reference data {name}: {str(e)}", e)
+
+async def seed_all_reference_data() -> None:
+    for name, (query, build_rows) in REFERENCE_DATA.items():
+        await seed_reference_data(name, query, build_rows())
+
+async def _seed_default_sepas_texts(conn):
+    query, build_rows = REFERENCE_DATA["default_sepas_texts"]
+    await _bulk_seed(conn, "default_sepas_texts", query, build_rows())
+
+# مهاجرت‌های نسخه‌دار؛ نسخه فعلی در PRAGMA user_version ذخیره می‌شود.
+# برای تغییر ساختار یک مرحله جدید با شماره بعدی به انتهای لیست اضافه کنید
+# (جدول جدید: افزودن به schema.sql و یک مرحله _apply_schema).
+MIGRATIONS = [
+    (1, "baseline schema and legacy columns", _migration_baseline),
+    (2, "tuned indexes", _apply_tuned_indexes),
+    (3, "default sepas texts", _seed_default_sepas_texts),
+    (4, "reference_seeds table", _apply_schema),
+    (5, "tag_jobs table", _migration_tag_jobs),
+    (6, "pending_selections table", _apply_schema),
+    (7, "persistence_data table", _apply_schema),
+    (8, "topics.zekr_text column", _migration_topics_zekr_text),
+    (9, "groups invite link state", _migration_groups_invite_link_state),
+    (10, "invite link refresh index", _apply_tuned_indexes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+async def get_schema_version() -> int:
+    await init_db_connection()
+    async with _db_connection.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+async def run_migrations() -> int:
+    """Apply pending migrations in order and return the number of steps applied."""
+    await init_db_connection()
+    current = await get_schema_version()
+    applied = 0
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Applying migration %s: %s", version, description)
+        try:
+            await migrate(_db_connection)
+            # PRAGMA مقدار پارامتری نمی‌پذیرد؛ version یک عدد صحیح ثابت است
+            await _db_connection.execute(f"PRAGMA user_version = {int(version)}")
+            await _db_connection.commit()
+        except Exception:
+            await _db_connection.rollback()
+            raise
+        applied += 1
+    return applied
 
-        await check_and_apply_migrations()
-        
-        logger.info("مقداردهی اولیه دیتابیس و بررسی مهاجرت‌ها با موفقیت کامل شد.")
+async def init_db():
+    started = time.perf_counter()
+    try:
+        current = await get_schema_version()
+        if current >= SCHEMA_VERSION:
+            logger.info("Database is up to date (user_version=%s), skipped migrations in %.1f ms",
+                        current, (time.perf_counter() - started) * 1000)
+            return
+        applied = await run_migrations()
+        logger.info("مقداردهی اولیه دیتابیس با موفقیت کامل شد: %s migration(s) applied (user_version %s -> %s) in %.1f ms",
+                    applied, current, SCHEMA_VERSION, (time.perf_counter() - started) * 1000)
     except aiosqlite.Error as e:
-        error_msg = str(e).lower()
-        if "duplicate column name" in error_msg or "already exists" in error_msg:
-            logger.warning("Schema application skipped due to existing elements: %s", e)
-        else:
-            logger.error("Failed to initialize database: %s", e)
-            raise
+        logger.error("Failed to initialize database: %s", e)
+        raise
     except FileNotFoundError as e:
         logger.error("Schema file not found: %s", e)
         raise
@@ -174,29 +394,72 @@ async def init_db():
 async def fetch_one(query: str, params: tuple = ()) -> Optional[Dict]:
     try:
         await init_db_connection()
-        async with _db_connection.execute(query, params) as cursor:
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+        statement = sql_label(query)
+        with SQL_SECONDS.time(op="fetch_one", statement=statement), span("sql", statement=statement):
+            async with _db_connection.execute(query, params) as cursor:
+                row = await cursor.fetchone()
+        return dict(row) if row else None
     except Exception as e:
         raise DatabaseError(f"Error fetching single record: {str(e)}", e)
 
 async def fetch_all(query: str, params: tuple = ()) -> List[Dict]:
     try:
         await init_db_connection()
-        async with _db_connection.execute(query, params) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        statement = sql_label(query)
+        with SQL_SECONDS.time(op="fetch_all", statement=statement), span("sql", statement=statement):
+            async with _db_connection.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
     except Exception as e:
         raise DatabaseError(f"Error fetching multiple records: {str(e)}", e)
 
+async def fetch_all_shards(query: str, params: tuple = ()) -> List[Dict]:
+    """
+    یک کوئری فقط‌خواندنی را روی دیتابیس همه شاردها اجرا و نتایج را پشت هم برمی‌گرداند.
+    شارد فعلی از اتصال اصلی خوانده می‌شود و بقیه با اتصال read-only موقت؛ فایل شاردی که
+    هنوز ساخته نشده رد می‌شود. بدون شاردینگ همان fetch_all است.
+    """
+    rows = await fetch_all(query, params)
+    for path in SHARD_DATABASE_PATHS:
+        if os.path.abspath(path) == os.path.abspath(DATABASE_PATH):
+            continue
+        if not os.path.exists(path):
+            logger.warning("Shard database %s does not exist yet, skipped", path)
+            continue
+        try:
+            async with aiosqlite.connect(f"file:{path}?mode=ro", uri=True) as conn:
+                conn.row_factory = aiosqlite.Row
+                async with conn.execute(query, params) as cursor:
+                    rows.extend(dict(row) for row in await cursor.fetchall())
+        except Exception as e:
+            raise DatabaseError(f"Error fetching records from shard {path}: {str(e)}", e)
+    return rows
+
+async def fetch_page_shards(query: str, params: tuple, offset: int, limit: int, sort_key: str) -> List[Dict]:
+    """
+    صفحه‌بندی روی همه شاردها؛ query باید با «ORDER BY <sort_key> LIMIT ? OFFSET ?» تمام شود.
+    از هر شارد offset + limit ردیف اول خوانده، ادغام و برش داده می‌شود.
+    """
+    if len(SHARD_DATABASE_PATHS) <= 1:
+        return await fetch_all(query, params + (limit, offset))
+    rows = await fetch_all_shards(query, params + (offset + limit, 0))
+    rows.sort(key=lambda row: row[sort_key])
+    return rows[offset:offset + limit]
+
 async def execute(query: str, params: tuple = ()) -> None:
     try:
-        await init_db_connection()
-        await _db_connection.execute(query, params)
-        await _db_connection.commit()
+        async with write_transaction() as conn:
+            await conn.execute(query, params)
     except aiosqlite.Error as e:
         logger.error("Database error in execute: %s", e)
-        await _db_connection.rollback()
+        raise
+
+async def executemany(query: str, rows: List[tuple]) -> None:
+    try:
+        async with write_transaction() as conn:
+            await conn.executemany(query, rows)
+    except aiosqlite.Error as e:
+        logger.error("Database error in executemany (%s rows): %s", len(rows), e)
         raise
 
 async def handle_update_user(cursor, request):
@@ -224,20 +487,21 @@ async def handle_contribution(cursor, request):
         # First get the current total
         current_topic = await cursor.execute(
             """
-            SELECT current_total FROM topics 
+            SELECT current_total, reset_epoch FROM topics 
             WHERE topic_id = ? AND group_id = ?
             """,
             (request["topic_id"], request["group_id"])
         )
-        current_total = (await current_topic.fetchone())["current_total"]
+        topic_row = await current_topic.fetchone()
+        current_total = topic_row["current_total"]
         logger.debug("Current total before contribution: %d", current_total)
         
         # Insert contribution record
         try:
             await cursor.execute(
                 """
-                INSERT INTO contributions (group_id, topic_id, user_id, amount, verse_id)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO contributions (group_id, topic_id, user_id, amount, verse_id, reset_epoch)
+                VALUES (?, ?, ?, ?, ?, ?)
                 """,
                 (
                     request["group_id"],
@@ -245,6 +509,7 @@ async def handle_contribution(cursor, request):
                     request["user_id"],
                     request["amount"],
                     request.get("verse_id"),
+                    topic_row["reset_epoch"],
                 ),
             )
             logger.debug("Successfully inserted contribution record")
@@ -416,49 +681,32 @@ async def handle_reset_daily(cursor, request):
     )
     logger.info("Processed %s reset_daily for group_id=%s", request["action"], request["group_id"])
 
-async def handle_reset_daily_group(cursor, request):
+async def handle_reset_daily_groups(cursor, request):
+    # ریست روزانه همه تاپیک‌های یک دسته گروه با یک UPDATE. به جای DELETE روی contributions
+    # فقط دوره (epoch) تاپیک جلو می‌رود؛ ردیف‌های دوره قبل توسط compact_contributions
+    # تجمیع و آرشیو می‌شوند. ختم قرآن به ابتدای محدوده‌اش (khatm_ranges) برمی‌گردد.
+    group_ids = request["group_ids"]
+    placeholders = ", ".join("?" for _ in group_ids)
     await cursor.execute(
-        """
-        DELETE FROM contributions WHERE group_id = ? AND topic_id = ?
+        f"""
+        UPDATE topics
+        SET current_total = 0, reset_epoch = reset_epoch + 1,
+            current_verse_id = CASE WHEN khatm_type = 'ghoran' THEN COALESCE(
+                (SELECT kr.start_verse_id FROM khatm_ranges kr
+                 WHERE kr.group_id = topics.group_id AND kr.topic_id = topics.topic_id),
+                current_verse_id) ELSE current_verse_id END
+        WHERE group_id IN ({placeholders})
+          AND group_id IN (SELECT group_id FROM groups WHERE reset_daily = 1 AND is_active = 1)
         """,
-        (request["group_id"], request["topic_id"])
-    )
-    await cursor.execute(
-        """
-        UPDATE topics SET current_total = 0
-        WHERE group_id = ? AND topic_id = ?
-        """,
-        (request["group_id"], request["topic_id"])
+        group_ids
     )
-    if request["khatm_type"] == "ghoran":
-        row = await (await cursor.execute(
-            """
-            SELECT start_verse_id FROM khatm_ranges
-            WHERE group_id = ? AND topic_id = ?
-            """,
-            (request["group_id"], request["topic_id"])
-        )).fetchone()
-        if row:
-            await cursor.execute(
-                """
-                UPDATE topics SET current_verse_id = ?
-                WHERE group_id = ? AND topic_id = ?
-                """,
-                (row["start_verse_id"], request["group_id"], request["topic_id"])
-            )
-    logger.info("Processed reset_daily_group for group_id=%s, topic_id=%s", 
-                request["group_id"], request["topic_id"])
+    logger.info("Processed reset_daily_groups: groups=%s, topics=%s", len(group_ids), cursor.rowcount)
 
 async def handle_reset_periodic_topic(cursor, request):
     await cursor.execute(
         """
-        DELETE FROM contributions WHERE group_id = ? AND topic_id = ?
-        """,
-        (request["group_id"], request["topic_id"])
-    )
-    await cursor.execute(
-        """
-        UPDATE topics SET current_total = 0, completion_count = completion_count + 1
+        UPDATE topics SET current_total = 0, completion_count = completion_count + 1,
+            reset_epoch = reset_epoch + 1
         WHERE group_id = ? AND topic_id = ?
         """,
         (request["group_id"], request["topic_id"])
@@ -622,16 +870,10 @@ async def handle_reset_kol(cursor, request):
                          extra={"group_id": request["group_id"], "topic_id": request["topic_id"]})
             raise DatabaseError("این تاپیک ختم غیرفعال است. لطفاً ابتدا یک ختم را فعال کنید.")
 
-        await cursor.execute(
-            """
-            DELETE FROM contributions WHERE group_id = ? AND topic_id = ?
-            """,
-            (request["group_id"], request["topic_id"])
-        )
         await cursor.execute(
             """
             UPDATE topics 
-            SET current_total = 0, zekr_text = ''
+            SET current_total = 0, zekr_text = '', reset_epoch = reset_epoch + 1
             WHERE group_id = ? AND topic_id = ?
             """,
             (request["group_id"], request["topic_id"])
@@ -1046,15 +1288,63 @@ async def handle_khatm_number(cursor, request):
                 request["group_id"], request["topic_id"], request["khatm_type"], new_total, completed)
 
 async def handle_update_tag_timestamp(cursor, request):
+    # زمان‌ها به UTC ذخیره می‌شوند؛ TagManager کول‌داون را با utcnow مقایسه می‌کند
     await cursor.execute(
         """
         INSERT OR REPLACE INTO tag_timestamps (group_id, last_tag_time)
         VALUES (?, ?)
         """,
-        (request["group_id"], datetime.now().isoformat())
+        (request["group_id"], request.get("last_tag_time") or datetime.utcnow().isoformat())
     )
     logger.info("Processed update_tag_timestamp for group_id=%s", request["group_id"])
 
+async def handle_save_tag_job(cursor, request):
+    """ذخیره پیشرفت /tag بعد از هر پیام ارسال‌شده."""
+    now = datetime.utcnow().isoformat()
+    await cursor.execute(
+        """
+        INSERT INTO tag_jobs (group_id, message_thread_id, reply_to_message_id, last_user_id,
+                              sent_message_ids, started_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(group_id) DO UPDATE SET
+            last_user_id = excluded.last_user_id,
+            sent_message_ids = excluded.sent_message_ids,
+            updated_at = excluded.updated_at
+        """,
+        (request["group_id"], request.get("message_thread_id"), request.get("reply_to_message_id"),
+         request["last_user_id"], json.dumps(request.get("sent_message_ids", [])),
+         request.get("started_at") or now, now)
+    )
+    logger.debug("Processed save_tag_job for group_id=%s, last_user_id=%s", request["group_id"], request["last_user_id"])
+
+async def handle_finish_tag_job(cursor, request):
+    """پایان /tag: حذف پیشرفت و در صورت تکمیل، شروع کول‌داون در یک تراکنش."""
+    await cursor.execute("DELETE FROM tag_jobs WHERE group_id = ?", (request["group_id"],))
+    if request.get("completed", True):
+        await handle_update_tag_timestamp(cursor, request)
+    logger.info("Processed finish_tag_job for group_id=%s, completed=%s",
+                request["group_id"], request.get("completed", True))
+
+async def handle_save_pending_selection(cursor, request):
+    await cursor.execute(
+        """
+        INSERT OR REPLACE INTO pending_selections (kind, chat_id, message_id, payload, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (request["kind"], request["chat_id"], request["message_id"], request["payload"], request["expires_at"])
+    )
+
+async def handle_delete_pending_selection(cursor, request):
+    await cursor.execute(
+        "DELETE FROM pending_selections WHERE kind = ? AND chat_id = ? AND message_id = ?",
+        (request["kind"], request["chat_id"], request["message_id"])
+    )
+
+async def handle_prune_pending_selections(cursor, request):
+    await cursor.execute("DELETE FROM pending_selections WHERE expires_at <= ?", (request["now"],))
+    if cursor.rowcount:
+        logger.info("Pruned %s expired pending selections", cursor.rowcount)
+
 async def handle_set_zekr_text(cursor, request):
     """Handle setting zekr text for a topic."""
     await cursor.execute(
@@ -1098,8 +1388,11 @@ async def handle_zekr_contribution(cursor, request: Dict[str, Any]):
 
     # 2. ثبت مشارکت
     await cursor.execute(
-        "INSERT INTO contributions (user_id, group_id, topic_id, amount, zekr_id) VALUES (?, ?, ?, ?, ?)",
-        (user_id, group_id, topic_id, amount, zekr_id)
+        """
+        INSERT INTO contributions (user_id, group_id, topic_id, amount, zekr_id, reset_epoch)
+        VALUES (?, ?, ?, ?, ?, (SELECT reset_epoch FROM topics WHERE group_id = ? AND topic_id = ?))
+        """,
+        (user_id, group_id, topic_id, amount, zekr_id, group_id, topic_id)
     )
 
     # 3. آپدیت آمار کاربر
@@ -1208,11 +1501,31 @@ async def handle_zekr_contribution(cursor, request: Dict[str, Any]):
 
 
 async def process_queue_request(request: Dict[str, Any]) -> None:
+    trace = request.get("trace")
+    if trace is None:
+        return await _process_queue_request(request)
+    # انتظار در صف و تراکنش در trace آپدیتی که درخواست را ساخته ثبت می‌شوند
+    started = time.perf_counter()
+    trace.add_span("queue_wait", request["trace_enqueued_at"], started)
+    token = current_trace.set(trace)
+    error = None
+    try:
+        await _process_queue_request(request)
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        trace.add_span(f"db:{request.get('type')}", started, time.perf_counter(),
+                       **({"error": error} if error else {}))
+        current_trace.reset(token)
+        trace.release()
+
+async def _process_queue_request(request: Dict[str, Any]) -> None:
     handlers = {
         "update_user": handle_update_user,
         "contribution": handle_contribution,
         "reset_daily": handle_reset_daily,
-        "reset_daily_group": handle_reset_daily_group,
+        "reset_daily_groups": handle_reset_daily_groups,
         "reset_periodic_topic": handle_reset_periodic_topic,
         "start_khatm_ghoran": handle_start_khatm_ghoran,
         "start_khatm_zekr": handle_start_khatm_zekr,
@@ -1249,6 +1562,11 @@ async def process_queue_request(request: Dict[str, Any]) -> None:
         "min_ayat": handle_min_ayat,
         "khatm_number": handle_khatm_number,
         "update_tag_timestamp": handle_update_tag_timestamp,
+        "save_tag_job": handle_save_tag_job,
+        "finish_tag_job": handle_finish_tag_job,
+        "save_pending_selection": handle_save_pending_selection,
+        "delete_pending_selection": handle_delete_pending_selection,
+        "prune_pending_selections": handle_prune_pending_selections,
         "set_zekr_text": handle_set_zekr_text,
         "set_completion_count": handle_set_completion_count,
         "submit_zekr_contribution": handle_zekr_contribution,
@@ -1263,47 +1581,211 @@ async def process_queue_request(request: Dict[str, Any]) -> None:
 
     max_retries = 10
     retry_delay = 0.2
+    started = time.perf_counter()
     for attempt in range(max_retries):
         try:
-            await init_db_connection()
-            async with _db_connection.cursor() as cursor:
-                await handler(cursor, request)
-                await _db_connection.commit()
+            async with write_transaction() as conn:
+                async with conn.cursor() as cursor:
+                    await handler(cursor, request)
+            QUEUE_REQUEST_SECONDS.observe(time.perf_counter() - started, type=req_type)
             return
         except aiosqlite.OperationalError as e:
             if "database is locked" in str(e):
                 logger.warning("Database locked on attempt %d for request type=%s, retrying in %.2f seconds",
                               attempt + 1, req_type, retry_delay)
                 if attempt < max_retries - 1:
+                    QUEUE_REQUEST_RETRIES.inc(type=req_type)
                     await asyncio.sleep(retry_delay + random.uniform(0, 0.2))
                     retry_delay *= 1.5
                     continue
             logger.error("Error processing queue request type=%s: %s", req_type, e)
-            await _db_connection.rollback()
+            QUEUE_REQUEST_FAILURES.inc(type=req_type)
             raise
         except Exception as e:
             logger.error("Unexpected error processing queue request type=%s: %s", req_type, e)
-            await _db_connection.rollback()
+            QUEUE_REQUEST_FAILURES.inc(type=req_type)
             raise
 
+    QUEUE_REQUEST_FAILURES.inc(type=req_type)
     logger.error("Failed to process queue request after %d retries: type=%s, request=%s", 
                 max_retries, req_type, request)
     raise aiosqlite.OperationalError("Failed to process queue request after retries")
 
 
 
-async def is_group_banned(group_id: int) -> bool:
-    """Check if a group is banned."""
+async def _attach_archive_db() -> None:
+    """Attach the contributions archive database to the shared connection once."""
+    global _archive_attached
+    if _archive_attached:
+        return
+    # ATTACH وسط تراکنش باز مجاز نیست
+    async with write_transaction() as conn:
+        if not _archive_attached:
+            await _attach_archive(conn)
+            _archive_attached = True
+    logger.info("Archive database attached: %s", ARCHIVE_DATABASE_PATH)
+
+async def _attach_archive(conn) -> None:
+    await conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DATABASE_PATH,))
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS archive.contributions (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            group_id INTEGER,
+            topic_id INTEGER,
+            amount INTEGER,
+            verse_id INTEGER,
+            zekr_id INTEGER,
+            created_at TIMESTAMP,
+            reset_epoch INTEGER DEFAULT 0,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS archive.idx_archive_contributions_group_topic ON contributions(group_id, topic_id)"
+    )
+    await conn.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS compact_batch (id INTEGER PRIMARY KEY)
+        """
+    )
+
+async def _compact_batch(conn, cutoff: str, batch_size: int) -> int:
+    await conn.execute("DELETE FROM compact_batch")
+    await conn.execute(
+        """
+        INSERT INTO compact_batch (id)
+        SELECT c.id FROM contributions c
+        LEFT JOIN topics t ON t.group_id = c.group_id AND t.topic_id = c.topic_id
+        WHERE c.created_at < datetime('now', ?)
+           OR t.reset_epoch IS NULL
+           OR c.reset_epoch < t.reset_epoch
+        ORDER BY c.id
+        LIMIT ?
+        """,
+        (cutoff, batch_size)
+    )
+    batch = await (await conn.execute("SELECT COUNT(*) AS count FROM compact_batch")).fetchone()
+    if not batch["count"]:
+        return 0
+    await conn.execute(
+        """
+        INSERT INTO contribution_daily
+            (group_id, topic_id, user_id, reset_epoch, day, total_amount, contribution_count, verse_count)
+        SELECT group_id, topic_id, user_id, COALESCE(reset_epoch, 0), date(created_at),
+               SUM(amount), COUNT(*), COUNT(verse_id)
+        FROM contributions
+        WHERE id IN (SELECT id FROM compact_batch)
+        GROUP BY group_id, topic_id, user_id, COALESCE(reset_epoch, 0), date(created_at)
+        ON CONFLICT (group_id, topic_id, user_id, reset_epoch, day) DO UPDATE SET
+            total_amount = total_amount + excluded.total_amount,
+            contribution_count = contribution_count + excluded.contribution_count,
+            verse_count = verse_count + excluded.verse_count
+        """
+    )
+    await conn.execute(
+        """
+        INSERT OR IGNORE INTO archive.contributions
+            (id, user_id, group_id, topic_id, amount, verse_id, zekr_id, created_at, reset_epoch)
+        SELECT id, user_id, group_id, topic_id, amount, verse_id, zekr_id, created_at, reset_epoch
+        FROM contributions
+        WHERE id IN (SELECT id FROM compact_batch)
+        """
+    )
+    await conn.execute("DELETE FROM contributions WHERE id IN (SELECT id FROM compact_batch)")
+    return batch["count"]
+
+async def fetch_user_verse_ids(group_id: int, topic_id: int, user_id: int) -> List[int]:
+    """
+    آیه‌های ثبت‌شده کاربر در دوره فعلی تاپیک؛ ردیف‌های فشرده‌شده (قدیمی‌تر از
+    CONTRIBUTION_RETENTION_DAYS) از دیتابیس آرشیو خوانده می‌شوند.
+    """
+    await _attach_archive_db()
+    rows = await fetch_all(
+        """
+        SELECT c.id, c.verse_id
+        FROM contributions c
+        JOIN topics t ON t.group_id = c.group_id AND t.topic_id = c.topic_id
+        WHERE c.group_id = ? AND c.topic_id = ? AND c.user_id = ?
+          AND c.verse_id IS NOT NULL AND c.reset_epoch = t.reset_epoch
+        UNION
+        SELECT a.id, a.verse_id
+        FROM archive.contributions a
+        JOIN topics t ON t.group_id = a.group_id AND t.topic_id = a.topic_id
+        WHERE a.group_id = ? AND a.topic_id = ? AND a.user_id = ?
+          AND a.verse_id IS NOT NULL AND a.reset_epoch = t.reset_epoch
+        ORDER BY 1
+        """,
+        (group_id, topic_id, user_id, group_id, topic_id, user_id)
+    )
+    return [row["verse_id"] for row in rows]
+
+async def compact_contributions(retention_days: int = CONTRIBUTION_RETENTION_DAYS, batch_size: int = 5000) -> int:
+    """
+    ردیف‌های قدیمی contributions (قدیمی‌تر از retention_days یا متعلق به دوره‌های
+    ریست‌شده) را در contribution_daily تجمیع، در دیتابیس آرشیو کپی و از جدول اصلی حذف می‌کند.
+    هر دسته در یک تراکنش جدا اجرا می‌شود تا قفل دیتابیس طولانی نشود.
+    """
+    try:
+        await _attach_archive_db()
+        cutoff = f"-{int(retention_days)} days"
+        compacted = 0
+        while True:
+            # هر دسته یک تراکنش زیر قفل نوشتن است؛ commit صف وسط دسته اتفاق نمی‌افتد
+            async with write_transaction() as conn:
+                count = await _compact_batch(conn, cutoff, batch_size)
+            if not count:
+                break
+            compacted += count
+            # اجازه بده درخواست‌های دیگر بین دسته‌ها اجرا شوند
+            await asyncio.sleep(0)
+        logger.info("Compacted contributions: rows=%s, retention_days=%s", compacted, retention_days)
+        return compacted
+    except Exception as e:
+        logger.error("Error compacting contributions: %s", e, exc_info=True)
+        raise DatabaseError(f"Error compacting contributions: {str(e)}", e)
+
+
+
+# رجیستری درون‌حافظه‌ای مسدودی‌ها؛ در شروع ربات بارگذاری می‌شود و توابع
+# ban/unban آن را همگام با جداول banned_users و banned_groups نگه می‌دارند.
+_banned_user_ids: Set[int] = set()
+_banned_group_ids: Set[int] = set()
+_ban_registry_loaded = False
+
+async def load_ban_registry() -> None:
+    """Load banned users and groups into memory so ban checks become set lookups."""
+    global _ban_registry_loaded
     try:
         await init_db_connection()
-        result = await fetch_one(
-            "SELECT group_id FROM banned_groups WHERE group_id = ?",
-            (group_id,)
-        )
-        return bool(result)
+        users = await fetch_all("SELECT user_id FROM banned_users")
+        groups = await fetch_all("SELECT group_id FROM banned_groups")
+        _banned_user_ids.clear()
+        _banned_user_ids.update(row["user_id"] for row in users)
+        _banned_group_ids.clear()
+        _banned_group_ids.update(row["group_id"] for row in groups)
+        _ban_registry_loaded = True
+        logger.info("Ban registry loaded: users=%s, groups=%s", len(_banned_user_ids), len(_banned_group_ids))
     except Exception as e:
-        logger.error("Error checking banned group status: %s", e, exc_info=True)
-        raise DatabaseError(f"Error checking banned group: {str(e)}", e)
+        logger.error("Error loading ban registry: %s", e, exc_info=True)
+        raise DatabaseError(f"Error loading ban registry: {str(e)}", e)
+
+async def _ensure_ban_registry() -> None:
+    if not _ban_registry_loaded:
+        await load_ban_registry()
+
+async def banned_among(ids: Iterable[int], groups: bool = False) -> Set[int]:
+    """Return the subset of user ids (or group ids when groups=True) that are banned."""
+    await _ensure_ban_registry()
+    registry = _banned_group_ids if groups else _banned_user_ids
+    return registry.intersection(ids)
+
+async def is_group_banned(group_id: int) -> bool:
+    """Check if a group is banned."""
+    await _ensure_ban_registry()
+    return group_id in _banned_group_ids
 
 async def ban_group(group_id: int) -> None:
     """Ban a group by adding it to banned_groups table."""
@@ -1313,6 +1795,7 @@ async def ban_group(group_id: int) -> None:
             "INSERT OR REPLACE INTO banned_groups (group_id, banned_at) VALUES (?, CURRENT_TIMESTAMP)",
             (group_id,)
         )
+        _banned_group_ids.add(group_id)
         logger.info("Banned group: group_id=%s", group_id)
     except Exception as e:
         logger.error("Error banning group: %s", e, exc_info=True)
@@ -1326,6 +1809,7 @@ async def unban_group(group_id: int) -> None:
             "DELETE FROM banned_groups WHERE group_id = ?",
             (group_id,)
         )
+        _banned_group_ids.discard(group_id)
         logger.info("Unbanned group: group_id=%s", group_id)
     except Exception as e:
         logger.error("Error unbanning group: %s", e, exc_info=True)
@@ -1333,35 +1817,35 @@ async def unban_group(group_id: int) -> None:
     
 
 
+GLOBAL_STATS_QUERIES = {
+    'total_groups': "SELECT COUNT(*) as count FROM groups",
+    'active_groups': "SELECT COUNT(*) as count FROM groups WHERE is_active = 1",
+    'banned_groups': "SELECT COUNT(*) as count FROM banned_groups",
+    'total_contributions': """
+        SELECT (SELECT COUNT(*) FROM contributions)
+             + (SELECT COALESCE(SUM(contribution_count), 0) FROM contribution_daily) as count
+    """,
+    'completed_khatms': "SELECT COUNT(*) as count FROM topics WHERE is_completed = 1",
+}
+
 async def get_global_stats() -> dict:
-    """Fetch global statistics for the dashboard."""
+    """Fetch global statistics for the dashboard, summed over all shards."""
     try:
         await init_db_connection()
         stats = {}
 
-        # Total groups
-        total_groups = await fetch_one("SELECT COUNT(*) as count FROM groups")
-        stats['total_groups'] = total_groups['count'] if total_groups else 0
-
-        # Active groups
-        active_groups = await fetch_one("SELECT COUNT(*) as count FROM groups WHERE is_active = 1")
-        stats['active_groups'] = active_groups['count'] if active_groups else 0
-
-        # Banned groups
-        banned_groups = await fetch_one("SELECT COUNT(*) as count FROM banned_groups")
-        stats['banned_groups'] = banned_groups['count'] if banned_groups else 0
+        # گروه‌ها بین شاردها تقسیم شده‌اند، پس این شمارش‌ها جمع‌پذیرند
+        for name, query in GLOBAL_STATS_QUERIES.items():
+            rows = await fetch_all_shards(query)
+            stats[name] = sum(row['count'] for row in rows)
 
-        # Total users
-        total_users = await fetch_one("SELECT COUNT(DISTINCT user_id) as count FROM users")
-        stats['total_users'] = total_users['count'] if total_users else 0
-
-        # Total contributions
-        total_contributions = await fetch_one("SELECT COUNT(*) as count FROM contributions")
-        stats['total_contributions'] = total_contributions['count'] if total_contributions else 0
-
-        # Completed khatms
-        completed_khatms = await fetch_one("SELECT COUNT(*) as count FROM topics WHERE is_completed = 1")
-        stats['completed_khatms'] = completed_khatms['count'] if completed_khatms else 0
+        # Total users: یک کاربر ممکن است در گروه‌های چند شارد باشد
+        if len(SHARD_DATABASE_PATHS) > 1:
+            users = await fetch_all_shards("SELECT DISTINCT user_id FROM users")
+            stats['total_users'] = len({row['user_id'] for row in users})
+        else:
+            total_users = await fetch_one("SELECT COUNT(DISTINCT user_id) as count FROM users")
+            stats['total_users'] = total_users['count'] if total_users else 0
 
         logger.info("Fetched global stats: %s", stats)
         return stats
@@ -1433,7 +1917,13 @@ async def set_group_invite_link(group_id: int, invite_link: str) -> None:
     try:
         await init_db_connection()
         await execute(
-            "UPDATE groups SET invite_link = ? WHERE group_id = ?",
+            """
+            UPDATE groups
+            SET invite_link = ?, invite_link_created_at = CURRENT_TIMESTAMP,
+                invite_link_verified_at = CURRENT_TIMESTAMP, invite_link_checked_at = CURRENT_TIMESTAMP,
+                invite_link_failures = 0
+            WHERE group_id = ?
+            """,
             (invite_link, group_id)
         )
         logger.info("Set invite link for group: group_id=%s, link=%s", group_id, invite_link)
@@ -1459,13 +1949,72 @@ async def remove_group_invite_link(group_id: int) -> None:
     try:
         await init_db_connection()
         await execute(
-            "UPDATE groups SET invite_link = '' WHERE group_id = ?",
+            # invite_link_created_at پر می‌ماند تا refresh_invite_links لینک را دوباره نسازد
+            """
+            UPDATE groups
+            SET invite_link = '', invite_link_created_at = COALESCE(invite_link_created_at, CURRENT_TIMESTAMP),
+                invite_link_failures = 0
+            WHERE group_id = ?
+            """,
             (group_id,)
         )
         logger.info("Removed invite link for group: group_id=%s", group_id)
     except Exception as e:
         logger.error("Error removing invite link: %s", str(e), exc_info=True)
         raise DatabaseError(f"Error removing invite link: {str(e)}", e)
+
+async def get_invite_links_due(limit: int, verify_days: float, retry_hours: float) -> List[aiosqlite.Row]:
+    """
+    گروه‌هایی که لینک دعوتشان باید بررسی یا ساخته شود، قدیمی‌ترین بررسی اول:
+    لینکی که verify_days از آخرین تأییدش گذشته، گروهی که هرگز لینک نداشته (لینکی که از
+    داشبورد حذف شده دوباره ساخته نمی‌شود) و گروه‌هایی که بررسی قبلیشان ناموفق بوده، با فاصله
+    retry_hours * 2^(failures - 1) (حداکثر ۶۴ برابر).
+    """
+    try:
+        return await fetch_all(
+            """
+            SELECT group_id, COALESCE(invite_link, '') AS invite_link, invite_link_failures
+            FROM groups
+            WHERE (COALESCE(invite_link, '') != '' OR invite_link_created_at IS NULL)
+              AND group_id NOT IN (SELECT group_id FROM banned_groups)
+              AND CASE
+                  WHEN invite_link_failures > 0 THEN
+                      invite_link_checked_at IS NULL
+                      OR julianday('now') - julianday(invite_link_checked_at)
+                         >= ? * (1 << MIN(invite_link_failures - 1, 6)) / 24.0
+                  ELSE invite_link_verified_at IS NULL OR invite_link_verified_at < datetime('now', ?)
+              END
+            ORDER BY invite_link_checked_at
+            LIMIT ?
+            """,
+            (retry_hours, f"-{verify_days} days", limit)
+        )
+    except Exception as e:
+        logger.error("Error fetching invite links due for refresh: %s", str(e), exc_info=True)
+        raise DatabaseError(f"Error fetching invite links due for refresh: {str(e)}", e)
+
+async def mark_invite_link_checked(group_id: int, ok: bool) -> None:
+    """نتیجه بررسی لینک دعوت: تأیید موفق شمارنده خطا را صفر می‌کند، خطا آن را یکی زیاد می‌کند."""
+    try:
+        if ok:
+            query = """
+                UPDATE groups
+                SET invite_link_verified_at = CURRENT_TIMESTAMP, invite_link_checked_at = CURRENT_TIMESTAMP,
+                    invite_link_failures = 0
+                WHERE group_id = ?
+            """
+        else:
+            query = """
+                UPDATE groups
+                SET invite_link_checked_at = CURRENT_TIMESTAMP,
+                    invite_link_failures = COALESCE(invite_link_failures, 0) + 1
+                WHERE group_id = ?
+            """
+        await execute(query, (group_id,))
+    except Exception as e:
+        logger.error("Error recording invite link check for group %s: %s", group_id, str(e), exc_info=True)
+        raise DatabaseError(f"Error recording invite link check: {str(e)}", e)
+
 async def set_group_title(group_id: int, title: str) -> None:
     """Set or update the title for a group."""
     try:
@@ -1487,6 +2036,7 @@ async def ban_user(user_id: int) -> None:
             "INSERT OR REPLACE INTO banned_users (user_id) VALUES (?)",
             (user_id,)
         )
+        _banned_user_ids.add(user_id)
         logger.info("Banned user: user_id=%s", user_id)
     except Exception as e:
         logger.error("Error banning user: %s", str(e), exc_info=True)
@@ -1500,6 +2050,7 @@ async def unban_user(user_id: int) -> None:
             "DELETE FROM banned_users WHERE user_id = ?",
             (user_id,)
         )
+        _banned_user_ids.discard(user_id)
         logger.info("Unbanned user: user_id=%s", user_id)
     except Exception as e:
         logger.error("Error unbanning user: %s", str(e), exc_info=True)
@@ -1507,16 +2058,8 @@ async def unban_user(user_id: int) -> None:
 
 async def is_user_banned(user_id: int) -> bool:
     """Check if a user is banned."""
-    try:
-        await init_db_connection()
-        result = await fetch_one(
-            "SELECT user_id FROM banned_users WHERE user_id = ?",
-            (user_id,)
-        )
-        return bool(result)
-    except Exception as e:
-        logger.error("Error checking banned user: %s", str(e), exc_info=True)
-        raise DatabaseError(f"Error checking banned user: {str(e)}", e)
+    await _ensure_ban_registry()
+    return user_id in _banned_user_ids
 
 async def get_group_users(group_id: int, page: int = 1, per_page: int = 10) -> tuple[list, int]:
     """Fetch paginated list of users in a group."""
@@ -1539,22 +2082,3 @@ async def get_group_users(group_id: int, page: int = 1, per_page: int = 10) -> t
 
 
 
-async def generate_invite_links_for_all_groups(bot) -> None:
-    """Generate invite links for all groups in the database."""
-    try:
-        await init_db_connection()
-        groups = await fetch_all("SELECT group_id FROM groups")
-        for group in groups:
-            group_id = group["group_id"]
-            try:
-                invite_link = await bot.create_chat_invite_link(group_id, member_limit=None)
-                await set_group_invite_link(group_id, invite_link.invite_link)
-                logger.info("Generated invite link for group: group_id=%s, link=%s", group_id, invite_link.invite_link)
-            except Exception as e:
-                logger.error("Error generating invite link for group %s: %s", group_id, str(e), exc_info=True)
-    except Exception as e:
-        logger.error("Error generating invite links for all groups: %s", str(e), exc_info=True)
-        raise DatabaseError(f"Error generating invite links: {str(e)}", e)
-
-
-
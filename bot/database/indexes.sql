@@ -0,0 +1,18 @@
+-- مجموعه ایندکس‌های تنظیم‌شده برای کوئری‌های پرتکرار؛ توسط check_and_apply_migrations اعمال می‌شود.
+-- برای بررسی پلن کوئری‌ها: python -m bot.database.query_plans
+
+-- تکراری با کلید اصلی topics(group_id, topic_id)
+DROP INDEX IF EXISTS idx_topics_group_topic;
+-- جایگزین با idx_contributions_group_topic_user (پیشوند group_id, topic_id را پوشش می‌دهد)
+DROP INDEX IF EXISTS idx_contributions_group_topic;
+
+CREATE INDEX IF NOT EXISTS idx_contributions_group_topic_user ON contributions(group_id, topic_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_group_user ON users(group_id, user_id);
+CREATE INDEX IF NOT EXISTS idx_sepas_texts_group ON sepas_texts(group_id);
+-- به همراه idx_sepas_texts_group شرط "group_id = ? OR is_default = 1" را به MULTI-INDEX OR تبدیل می‌کند
+CREATE INDEX IF NOT EXISTS idx_sepas_texts_default ON sepas_texts(is_default);
+CREATE INDEX IF NOT EXISTS idx_hadith_settings_enabled ON hadith_settings(hadith_enabled);
+CREATE INDEX IF NOT EXISTS idx_groups_reset_daily ON groups(reset_daily);
+-- get_invite_links_due: فقط گروه‌های دارای لینک یا بدون لینک ساخته‌شده، به ترتیب آخرین بررسی
+CREATE INDEX IF NOT EXISTS idx_groups_invite_link_checked ON groups(invite_link_checked_at)
+    WHERE COALESCE(invite_link, '') != '' OR invite_link_created_at IS NULL;
@@ -1,64 +1,397 @@
+"""
+رجیستری یکپارچه اعضای گروه‌ها (members.sqlite).
+
+تنها منبع اعضای گروه‌ها برای تگ و گزارش‌ها: پیام‌ها و رویدادهای عضویت همه گروه‌ها
+اینجا ثبت می‌شوند. داده‌های قدیمی data/users.db (UserStore) و جدول users دیتابیس
+اصلی یک‌بار در مهاجرت وارد می‌شوند. جدول users دیتابیس اصلی فقط آمار مشارکت را نگه می‌دارد.
+"""
 import aiosqlite
+import asyncio
 import logging
-from telegram.error import TelegramError
-from telegram import User
+import os
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from config.settings import DATABASE_PATH as KHATM_DATABASE_PATH, MEMBERS_DATABASE_PATH, LEGACY_USER_STORE_PATH
 
 logger = logging.getLogger(__name__)
 
-DATABASE_PATH = "members.sqlite"
+DATABASE_PATH = MEMBERS_DATABASE_PATH
+
+FLUSH_BATCH_SIZE = 500
+# اندازه هر صفحه هنگام پیمایش اعضای یک گروه (keyset pagination روی user_id)
+MEMBER_PAGE_SIZE = 500
+MAX_FINGERPRINTS = 200_000
+# تعداد دستورات آماده (prepared) که sqlite3 برای این اتصال کش می‌کند
+STATEMENT_CACHE_SIZE = 256
+
+# اتصال دائمی: WAL برای خواندن هم‌زمان با نوشتن، synchronous=NORMAL در WAL امن است
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=15000",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+)
+
+_connection: Optional[aiosqlite.Connection] = None
+_connection_lock: Optional[asyncio.Lock] = None
+
+# کلید: (group_id, user_id) - مقدار: (username, first_name, last_name, is_bot)
+MemberKey = Tuple[int, int]
+Profile = Tuple[Optional[str], Optional[str], Optional[str], int]
+# مقدار بافر برای عضوی که گروه را ترک کرده است
+LEFT = None
+
+UPSERT_MEMBER = """
+    INSERT INTO members (
+        user_id, group_id, username, first_name, last_name,
+        is_bot, is_deleted, scraped_timestamp
+    )
+    VALUES (?, ?, ?, ?, ?, ?, 0, ?)
+    ON CONFLICT (group_id, user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        is_bot = excluded.is_bot,
+        is_deleted = 0,
+        scraped_timestamp = excluded.scraped_timestamp
+"""
+
+MARK_MEMBER_LEFT = """
+    UPDATE members
+    SET is_deleted = 1, scraped_timestamp = ?
+    WHERE user_id = ? AND group_id = ?
+"""
+
+
+async def _migration_members_table(conn):
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS members (
+            user_id INTEGER NOT NULL,
+            group_id INTEGER NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            is_bot INTEGER DEFAULT 0,
+            is_deleted INTEGER DEFAULT 0,
+            scraped_timestamp INTEGER,
+            PRIMARY KEY (group_id, user_id)
+        )
+        """
+    )
+    # جدول‌های قدیمی (ساخته‌شده توسط اسکریپر) ممکن است کلید یکتا نداشته باشند
+    await conn.execute(
+        """
+        DELETE FROM members WHERE rowid NOT IN (
+            SELECT MAX(rowid) FROM members GROUP BY group_id, user_id
+        )
+        """
+    )
+    await conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_members_group_user ON members(group_id, user_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_members_group_active ON members(group_id, is_deleted, is_bot)")
+
+
+async def _import_attached(conn, path: str, alias: str, query: str) -> None:
+    if not path or not os.path.exists(path):
+        logger.info("Legacy member source not found, skipping import: %s", path)
+        return
+    await conn.commit()
+    await conn.execute(f"ATTACH DATABASE ? AS {alias}", (path,))
+    try:
+        cursor = await conn.execute(query)
+        logger.info("Imported %s member rows from %s", cursor.rowcount, path)
+        await conn.commit()
+    except aiosqlite.OperationalError as e:
+        # جدول مبدأ وجود ندارد
+        logger.warning("Could not import members from %s: %s", path, e)
+        await conn.rollback()
+    finally:
+        await conn.execute(f"DETACH DATABASE {alias}")
+
+
+async def _migration_import_user_store(conn):
+    await _import_attached(
+        conn, LEGACY_USER_STORE_PATH, "legacy_users",
+        """
+        INSERT OR IGNORE INTO members (user_id, group_id, username, first_name, last_name, is_bot, is_deleted, scraped_timestamp)
+        SELECT user_id, chat_id, username, COALESCE(first_name, 'User'), last_name, 0, 0, CAST(strftime('%s', join_date) AS INTEGER)
+        FROM legacy_users.chat_users
+        """
+    )
+
+
+async def _migration_import_khatm_users(conn):
+    await _import_attached(
+        conn, KHATM_DATABASE_PATH, "khatm",
+        """
+        INSERT OR IGNORE INTO members (user_id, group_id, username, first_name, last_name, is_bot, is_deleted, scraped_timestamp)
+        SELECT user_id, group_id, NULLIF(MAX(username), ''), COALESCE(MAX(first_name), 'User'), NULL, 0, 0,
+               CAST(strftime('%s', 'now') AS INTEGER)
+        FROM khatm.users
+        GROUP BY group_id, user_id
+        """
+    )
+
+
+# مهاجرت‌های نسخه‌دار members.sqlite (PRAGMA user_version)، مانند دیتابیس اصلی
+MIGRATIONS = [
+    (1, "members table", _migration_members_table),
+    (2, "import legacy data/users.db", _migration_import_user_store),
+    (3, "import main database users", _migration_import_khatm_users),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def _get_connection() -> aiosqlite.Connection:
+    global _connection, _connection_lock
+    if _connection is not None:
+        return _connection
+    if _connection_lock is None:
+        _connection_lock = asyncio.Lock()
+    async with _connection_lock:
+        if _connection is None:
+            conn = await aiosqlite.connect(DATABASE_PATH, cached_statements=STATEMENT_CACHE_SIZE)
+            conn.row_factory = aiosqlite.Row
+            try:
+                for pragma in CONNECTION_PRAGMAS:
+                    await conn.execute(pragma)
+                await _run_migrations(conn)
+            except Exception:
+                await conn.close()
+                raise
+            _connection = conn
+            logger.info("Members database connection initialized: %s", DATABASE_PATH)
+    return _connection
+
+
+async def _run_migrations(conn) -> None:
+    async with conn.execute("PRAGMA user_version") as cursor:
+        current = (await cursor.fetchone())[0]
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info("Applying members migration %s: %s", version, description)
+        try:
+            await migrate(conn)
+            await conn.execute(f"PRAGMA user_version = {int(version)}")
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+
+async def init_members_db() -> None:
+    await _get_connection()
+
+
+async def close_members_db() -> None:
+    global _connection
+    await member_registry.flush()
+    if _connection is not None:
+        await _connection.close()
+        _connection = None
+        logger.info("Members database connection closed")
+
 
 async def execute(query: str, params: tuple = ()):
     """
     Executes a query (INSERT, UPDATE, DELETE) on members.sqlite asynchronously.
     """
+    conn = await _get_connection()
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as conn:
-            await conn.execute(query, params)
-            await conn.commit()
-            logger.debug(f"Successfully executed query on members.sqlite: {query} with params {params}")
+        await conn.execute(query, params)
+        await conn.commit()
     except aiosqlite.Error as e:
-        logger.error(f"aiosqlite error executing query on members.sqlite (query: {query}, params: {params}): {e}", exc_info=True)
+        logger.error("aiosqlite error executing query on members.sqlite: %s", e, exc_info=True)
+        await conn.rollback()
         raise
-    except Exception as e:
-        logger.error(f"Unexpected error executing query on members.sqlite (query: {query}, params: {params}): {e}", exc_info=True)
+
+
+async def executemany(query: str, rows: List[tuple]):
+    """
+    Executes a query for every row in a single transaction on members.sqlite.
+    """
+    await execute_batch([(query, rows)])
+
+
+async def execute_batch(batches: List[Tuple[str, List[tuple]]]):
+    """
+    Executes several (query, rows) batches in a single transaction on members.sqlite.
+    """
+    conn = await _get_connection()
+    try:
+        for query, rows in batches:
+            if rows:
+                await conn.executemany(query, rows)
+        await conn.commit()
+    except aiosqlite.Error as e:
+        logger.error("aiosqlite error executing batch of %s rows on members.sqlite: %s",
+                     sum(len(rows) for _, rows in batches), e, exc_info=True)
+        await conn.rollback()
         raise
 
+
 async def fetch_all(query: str, params: tuple = ()):
     """
     Fetches all rows from a query on members.sqlite asynchronously.
     Results are returned as a list of dictionaries.
     """
+    conn = await _get_connection()
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as conn:
-            conn.row_factory = aiosqlite.Row
-            async with conn.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-                result = [dict(row) for row in rows]
-                logger.debug(f"Fetched {len(result)} rows from members.sqlite for query: {query}")
-                return result
+        async with conn.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+            return [dict(row) for row in rows]
     except aiosqlite.Error as e:
-        logger.error(f"aiosqlite error fetching all from members.sqlite (query: {query}, params: {params}): {e}", exc_info=True)
-        raise
-    except Exception as e:
-        logger.error(f"Unexpected error fetching all from members.sqlite (query: {query}, params: {params}): {e}", exc_info=True)
+        logger.error("aiosqlite error fetching all from members.sqlite: %s", e, exc_info=True)
         raise
 
+
 async def fetch_one(query: str, params: tuple = ()):
     """
     Fetches one row from a query on members.sqlite asynchronously.
     Returns a dictionary or None if no row is found.
     """
+    conn = await _get_connection()
     try:
-        async with aiosqlite.connect(DATABASE_PATH) as conn:
-            conn.row_factory = aiosqlite.Row
-            async with conn.execute(query, params) as cursor:
-                row = await cursor.fetchone()
-                result = dict(row) if row else None
-                logger.debug(f"Fetched one row from members.sqlite for query: {query}")
-                return result
+        async with conn.execute(query, params) as cursor:
+            row = await cursor.fetchone()
+            return dict(row) if row else None
     except aiosqlite.Error as e:
-        logger.error(f"aiosqlite error fetching one from members.sqlite (query: {query}, params: {params}): {e}", exc_info=True)
+        logger.error("aiosqlite error fetching one from members.sqlite: %s", e, exc_info=True)
         raise
-    except Exception as e:
-        logger.error(f"Unexpected error fetching one from members.sqlite (query: {query}, params: {params}): {e}", exc_info=True)
-        raise
\ No newline at end of file
+
+
+class MemberRegistry:
+    """
+    بافر write-behind اعضا.
+
+    add_member و mark_left فقط در حافظه کار می‌کنند: رویدادهای تکراری (group_id, user_id)
+    ادغام می‌شوند (آخرین رویداد برنده است) و پروفایل‌های بدون تغییر با اثر انگشت درون‌حافظه‌ای
+    نادیده گرفته می‌شوند. flush عضویت‌ها و خروج‌ها را در یک تراکنش روی اتصال دائمی
+    (ترد aiosqlite، خارج از event loop) می‌نویسد؛ موج عضویت/خروج هنگام ورود گروه‌های بزرگ
+    به چند تراکنش دسته‌ای تبدیل می‌شود.
+    """
+
+    def __init__(self):
+        self._pending: Dict[MemberKey, Optional[Profile]] = {}
+        self._fingerprints: "OrderedDict[MemberKey, Profile]" = OrderedDict()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def add_member(self, group_id, user_id, username=None, first_name=None, last_name=None, is_bot=False) -> bool:
+        """ثبت یا به‌روزرسانی عضو فعال؛ اگر پروفایل تغییری نکرده باشد False برمی‌گرداند."""
+        key = (group_id, user_id)
+        profile = (username or None, first_name or "User", last_name or None, 1 if is_bot else 0)
+        if self._fingerprints.get(key) == profile:
+            self._fingerprints.move_to_end(key)
+            return False
+        self._fingerprints[key] = profile
+        self._fingerprints.move_to_end(key)
+        if len(self._fingerprints) > MAX_FINGERPRINTS:
+            self._fingerprints.popitem(last=False)
+        self._pending[key] = profile
+        if len(self._pending) >= FLUSH_BATCH_SIZE:
+            self._schedule_flush()
+        return True
+
+    def add_user(self, group_id, user) -> bool:
+        """میان‌بر برای telegram.User"""
+        return self.add_member(group_id, user.id, user.username, user.first_name, user.last_name, user.is_bot)
+
+    def mark_left(self, group_id, user_id) -> None:
+        """عضو را در بافر غیرفعال (is_deleted=1) می‌کند."""
+        key = (group_id, user_id)
+        self._fingerprints.pop(key, None)
+        self._pending[key] = LEFT
+        if len(self._pending) >= FLUSH_BATCH_SIZE:
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task and not self._flush_task.done():
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+        except RuntimeError:
+            pass
+
+    async def flush(self) -> int:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+            now = int(time.time())
+            upserts, leaves = [], []
+            for (group_id, user_id), profile in batch.items():
+                if profile is LEFT:
+                    leaves.append((now, user_id, group_id))
+                else:
+                    username, first_name, last_name, is_bot = profile
+                    upserts.append((user_id, group_id, username, first_name, last_name, is_bot, now))
+            try:
+                await execute_batch([(UPSERT_MEMBER, upserts), (MARK_MEMBER_LEFT, leaves)])
+            except Exception as e:
+                logger.error("Failed to flush %s member events: %s", len(batch), e)
+                # تغییرات جدیدتری که در این فاصله رسیده‌اند بر دسته ناموفق اولویت دارند
+                for key, profile in batch.items():
+                    self._pending.setdefault(key, profile)
+                return 0
+            logger.debug("Flushed member events: joined/updated=%s, left=%s", len(upserts), len(leaves))
+            return len(batch)
+
+    async def fetch_active_members(self, group_id) -> List[Dict]:
+        """اعضای فعال و غیر ربات یک گروه"""
+        await self.flush()
+        return await fetch_all(
+            """
+            SELECT user_id, username, first_name, last_name
+            FROM members
+            WHERE group_id = ? AND is_deleted = 0 AND is_bot = 0
+            ORDER BY user_id
+            """,
+            (group_id,)
+        )
+
+    async def iter_active_members(self, group_id, after_user_id: int = 0,
+                                  page_size: int = MEMBER_PAGE_SIZE) -> AsyncIterator[Dict]:
+        """
+        اعضای فعال و غیر ربات یک گروه را صفحه به صفحه (به ترتیب user_id) برمی‌گرداند.
+        بین صفحات هیچ cursor بازی نگه داشته نمی‌شود، پس مصرف‌کننده می‌تواند بین ردیف‌ها
+        مدت طولانی منتظر بماند؛ after_user_id ادامه پیمایش از یک موقعیت مشخص را ممکن می‌کند.
+        """
+        await self.flush()
+        while True:
+            rows = await fetch_all(
+                """
+                SELECT user_id, username, first_name, last_name
+                FROM members
+                WHERE group_id = ? AND is_deleted = 0 AND is_bot = 0 AND user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+                """,
+                (group_id, after_user_id, page_size)
+            )
+            for row in rows:
+                yield row
+            if len(rows) < page_size:
+                return
+            after_user_id = rows[-1]["user_id"]
+
+    async def count_active_members(self, group_id) -> int:
+        await self.flush()
+        row = await fetch_one(
+            "SELECT COUNT(*) AS count FROM members WHERE group_id = ? AND is_deleted = 0 AND is_bot = 0",
+            (group_id,)
+        )
+        return row["count"] if row else 0
+
+
+member_registry = MemberRegistry()
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import pickle
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from bot.database.db import fetch_all, write_transaction
+
+logger = logging.getLogger(__name__)
+
+# فاصله ادغام نوشتن‌ها: همه update_* های یک دوره update_persistence در یک تراکنش نوشته می‌شوند
+FLUSH_DELAY = 1.0
+
+UPSERT_PERSISTENCE = """
+    INSERT INTO persistence_data (kind, key, data, updated_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+"""
+DELETE_PERSISTENCE = "DELETE FROM persistence_data WHERE kind = ? AND key = ?"
+
+# (kind, key) -> بایت‌های pickle یا None برای حذف
+DirtyKey = Tuple[str, str]
+
+
+def _dumps(kind: str, key: str, data: Any) -> bytes:
+    try:
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:
+        if not isinstance(data, dict):
+            raise
+        # مقادیر غیرقابل ذخیره (مثل Job در chat_data) کنار گذاشته می‌شوند
+        picklable = {}
+        for item_key, value in data.items():
+            try:
+                pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                continue
+            picklable[item_key] = value
+        logger.warning("Skipped %s unpicklable entries of %s[%s]: %s", len(data) - len(picklable), kind, key, e)
+        return pickle.dumps(picklable, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class SQLitePersistence(BasePersistence[Dict, Dict, Dict]):
+    """
+    پیاده‌سازی BasePersistence روی دیتابیس اصلی ربات (جدول persistence_data).
+
+    برخلاف PicklePersistence که در هر flush کل داده‌ها را دوباره pickle می‌کند، هر
+    chat_id/user_id جداگانه ذخیره می‌شود و فقط کلیدهای تغییرکرده (dirty) نوشته می‌شوند.
+    Application هر update_interval ثانیه داده‌های تغییرکرده را به update_* می‌دهد؛ این
+    تغییرات بعد از FLUSH_DELAY در یک تراکنش (upsert و حذف با هم) نوشته می‌شوند و flush() هنگام
+    خاموش شدن باقی‌مانده را می‌نویسد.
+    """
+
+    def __init__(self, update_interval: float = 60, flush_delay: float = FLUSH_DELAY):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.flush_delay = flush_delay
+        self._dirty: Dict[DirtyKey, Optional[bytes]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+
+    async def _load(self, kind: str) -> Dict[str, Any]:
+        rows = await fetch_all("SELECT key, data FROM persistence_data WHERE kind = ?", (kind,))
+        loaded = {}
+        for row in rows:
+            try:
+                loaded[row["key"]] = pickle.loads(row["data"])
+            except Exception as e:
+                logger.error("Could not unpickle %s[%s]: %s", kind, row["key"], e)
+        return loaded
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        return {int(key): data for key, data in (await self._load("user_data")).items()}
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {int(key): data for key, data in (await self._load("chat_data")).items()}
+
+    async def get_bot_data(self) -> Dict:
+        return (await self._load("bot_data")).get("", {})
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple, object]:
+        return {
+            tuple(json.loads(key)): state
+            for key, state in (await self._load(f"conversation:{name}")).items()
+        }
+
+    def _mark(self, kind: str, key: str, data: Any) -> None:
+        self._dirty[(kind, key)] = None if data is None else _dumps(kind, key, data)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        try:
+            await self._write_dirty()
+        except Exception as e:
+            logger.error("Error writing persistence data: %s", e, exc_info=True)
+
+    async def _write_dirty(self) -> int:
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            batch, self._dirty = self._dirty, {}
+            now = int(time.time())
+            upserts = [(kind, key, data, now) for (kind, key), data in batch.items() if data is not None]
+            deletes = [(kind, key) for (kind, key), data in batch.items() if data is None]
+            try:
+                async with write_transaction() as conn:
+                    if upserts:
+                        await conn.executemany(UPSERT_PERSISTENCE, upserts)
+                    if deletes:
+                        await conn.executemany(DELETE_PERSISTENCE, deletes)
+            except Exception:
+                # تغییرات جدیدتر بر دسته ناموفق اولویت دارند
+                for dirty_key, data in batch.items():
+                    self._dirty.setdefault(dirty_key, data)
+                raise
+            logger.debug("Persisted %s changed and %s dropped keys", len(upserts), len(deletes))
+            return len(batch)
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        self._mark("user_data", str(user_id), data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        self._mark("chat_data", str(chat_id), data)
+
+    async def update_bot_data(self, data: Dict) -> None:
+        self._mark("bot_data", "", data)
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        self._mark(f"conversation:{name}", json.dumps(list(key)), new_state)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark("chat_data", str(chat_id), None)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark("user_data", str(user_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    async def flush(self) -> None:
+        # تسک تاخیری لغو نمی‌شود تا نوشتن نیمه‌کاره‌اش قطع نشود؛ بعد از این چیزی برای نوشتن ندارد
+        await self._write_dirty()
+        logger.info("Persistence flushed")
@@ -0,0 +1,184 @@
+"""
+بررسی پلن کوئری‌ها (EXPLAIN QUERY PLAN) برای تمام دستورات SQL موجود در bot/.
+
+دستورات SQL ثابت (رشته‌هایی که با SELECT/INSERT/UPDATE/DELETE/WITH شروع می‌شوند)
+از سورس استخراج شده و روی یک دیتابیس درون‌حافظه‌ای ساخته‌شده از schema.sql و
+indexes.sql بررسی می‌شوند؛ دستورات members_db.py روی دیتابیسی ساخته‌شده از DDL مهاجرت
+members.sqlite. اگر کوئری‌ای که شرط WHERE دارد به اسکن کامل جدول برسد (و در
+ALLOWED_SCANS نباشد) یا دستوری آماده نشود (و در ALLOWED_SKIPS نباشد) خروجی با کد 1
+پایان می‌یابد.
+
+Usage:
+    python -m bot.database.query_plans [--verbose]
+"""
+import argparse
+import ast
+import os
+import re
+import sqlite3
+import sys
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+DATABASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_DIR = os.path.dirname(DATABASE_DIR)
+# دستورات این فایل روی members.sqlite اجرا می‌شوند
+MEMBERS_SOURCE = os.path.join(DATABASE_DIR, "members_db.py")
+MEMBERS_MIGRATION = "_migration_members_table"
+
+SQL_PATTERN = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\s", re.S)
+FILTER_PATTERN = re.compile(r"\bWHERE\b", re.I)
+FULL_SCAN_PATTERN = re.compile(r"^SCAN (\w+)$")
+
+# اسکن‌های کامل مجاز: کوئری‌های سرد (داشبورد، جستجو، جاب‌های روزانه) که ایندکس برایشان ارزش ندارد.
+# کلید: بخشی از متن نرمال‌شده کوئری، مقدار: دلیل.
+ALLOWED_SCANS: Dict[str, str] = {
+    "FROM groups WHERE is_active = 1": "dashboard global stats",
+    "FROM topics WHERE is_completed = 1": "dashboard global stats",
+    "FROM groups WHERE CAST(group_id AS TEXT) LIKE": "dashboard group search (substring match)",
+    "FROM users WHERE user_id = ? OR username LIKE": "dashboard user search (substring match)",
+    "FROM contributions c LEFT JOIN topics t": "compaction job walks the hot table by design",
+    "FROM topics WHERE reset_on_period = 1": "daily period-reset job",
+    "WHERE time_off_start != ''": "unused scheduler job",
+    "FROM sqlite_master": "one-off migration check on the schema catalog",
+    "FROM members WHERE rowid NOT IN": "one-off dedupe in the members.sqlite migration",
+}
+
+# دستوراتی که عمداً آماده نمی‌شوند (جدولشان فقط با ATTACH در زمان مهاجرت وجود دارد).
+# هر SKIP دیگری خطاست تا تغییر schema بررسی را بی‌صدا از کار نیندازد.
+ALLOWED_SKIPS: Dict[str, str] = {
+    "FROM legacy_users.chat_users": "one-off import from the attached legacy data/users.db",
+    "FROM khatm.users": "one-off import from the attached main database",
+}
+
+
+class Statement(NamedTuple):
+    path: str
+    lineno: int
+    sql: str
+
+    @property
+    def normalized(self) -> str:
+        return " ".join(self.sql.split())
+
+
+def iter_statements(root: str = BOT_DIR) -> Iterator[Statement]:
+    """Yield every constant SQL statement found in Python sources under root."""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if not filename.endswith(".py"):
+                continue
+            path = os.path.join(dirpath, filename)
+            with open(path, "r", encoding="utf-8") as f:
+                tree = ast.parse(f.read(), filename=path)
+            # رشته‌های داخل f-string ها قطعه‌ای از کوئری هستند و قابل بررسی نیستند
+            fragments = {
+                id(value)
+                for node in ast.walk(tree) if isinstance(node, ast.JoinedStr)
+                for value in node.values
+            }
+            for node in ast.walk(tree):
+                if (isinstance(node, ast.Constant) and isinstance(node.value, str)
+                        and id(node) not in fragments and SQL_PATTERN.match(node.value)):
+                    yield Statement(os.path.relpath(path), node.lineno, node.value)
+
+
+def build_database() -> sqlite3.Connection:
+    """Create an in-memory database with the production schema and tuned indexes."""
+    conn = sqlite3.connect(":memory:")
+    for script in ("schema.sql", "indexes.sql"):
+        with open(os.path.join(DATABASE_DIR, script), "r", encoding="utf-8") as f:
+            conn.executescript(f.read())
+    conn.execute("ATTACH DATABASE ':memory:' AS archive")
+    conn.execute("CREATE TABLE archive.contributions AS SELECT *, NULL AS archived_at FROM main.contributions WHERE 0")
+    conn.execute("CREATE INDEX archive.idx_archive_contributions_group_topic ON contributions(group_id, topic_id)")
+    conn.execute("CREATE TEMP TABLE compact_batch (id INTEGER PRIMARY KEY)")
+    return conn
+
+
+def members_ddl(path: str = MEMBERS_SOURCE) -> List[str]:
+    """
+    CREATE statements of the members.sqlite migration, read from the source so the
+    checker does not need to import members_db (and config.settings).
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in tree.body:
+        if isinstance(node, ast.AsyncFunctionDef) and node.name == MEMBERS_MIGRATION:
+            constants = sorted(
+                (value for value in ast.walk(node)
+                 if isinstance(value, ast.Constant) and isinstance(value.value, str)
+                 and value.value.lstrip().upper().startswith("CREATE")),
+                key=lambda value: (value.lineno, value.col_offset),
+            )
+            if constants:
+                return [value.value for value in constants]
+    raise RuntimeError(f"No CREATE statements found in {MEMBERS_MIGRATION} of {path}")
+
+
+def build_members_database() -> sqlite3.Connection:
+    """Create an in-memory members.sqlite with the tables and indexes of its migration."""
+    conn = sqlite3.connect(":memory:")
+    for statement in members_ddl():
+        conn.execute(statement)
+    return conn
+
+
+def explain(conn: sqlite3.Connection, statement: Statement) -> List[str]:
+    params = (None,) * statement.sql.count("?")
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement.sql}", params)]
+
+
+def is_allowed_skip(statement: Statement) -> bool:
+    return any(marker in statement.normalized for marker in ALLOWED_SKIPS)
+
+
+def check(verbose: bool = False) -> Tuple[List[Tuple[Statement, List[str]]], List[Tuple[Statement, str]]]:
+    """Return (full-scan regressions, statements that could not be prepared)."""
+    conn = build_database()
+    members_conn = build_members_database()
+    regressions, errors = [], []
+    try:
+        for statement in iter_statements():
+            target = members_conn if os.path.abspath(statement.path) == MEMBERS_SOURCE else conn
+            try:
+                plan = explain(target, statement)
+            except sqlite3.Error as e:
+                # جدول‌های پیوست‌شده در مهاجرت (ALLOWED_SKIPS)، یا schema/SQL نامعتبر
+                errors.append((statement, str(e)))
+                continue
+            if verbose:
+                print(f"{statement.path}:{statement.lineno}: {statement.normalized[:100]}")
+                for detail in plan:
+                    print(f"    {detail}")
+            scans = [detail for detail in plan if FULL_SCAN_PATTERN.match(detail)]
+            if not scans or not FILTER_PATTERN.search(statement.sql):
+                continue
+            if any(marker in statement.normalized for marker in ALLOWED_SCANS):
+                continue
+            regressions.append((statement, scans))
+    finally:
+        conn.close()
+        members_conn.close()
+    return regressions, errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check SQL query plans for full table scans.")
+    parser.add_argument("--verbose", action="store_true", help="print the plan of every statement")
+    args = parser.parse_args()
+
+    regressions, errors = check(verbose=args.verbose)
+    unexpected = [(statement, message) for statement, message in errors if not is_allowed_skip(statement)]
+    for statement, message in errors:
+        label = "ERROR" if (statement, message) in unexpected else "SKIP"
+        print(f"{label} {statement.path}:{statement.lineno}: {message}")
+    for statement, scans in regressions:
+        print(f"FULL SCAN {statement.path}:{statement.lineno}: {', '.join(scans)}")
+        print(f"    {statement.normalized[:160]}")
+    print(f"{len(regressions)} full-scan regression(s), {len(errors) - len(unexpected)} statement(s) skipped, "
+          f"{len(unexpected)} statement(s) could not be prepared")
+    return 1 if regressions or unexpected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
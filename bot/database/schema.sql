@@ -17,7 +17,11 @@ CREATE TABLE IF NOT EXISTS groups (
     max_display_verses INTEGER DEFAULT 10,
     min_display_verses INTEGER DEFAULT 1,
     invite_link TEXT DEFAULT '',
-    title TEXT DEFAULT ''
+    title TEXT DEFAULT '',
+    invite_link_created_at TIMESTAMP,
+    invite_link_verified_at TIMESTAMP,
+    invite_link_checked_at TIMESTAMP,
+    invite_link_failures INTEGER DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS topics (
@@ -40,6 +44,8 @@ CREATE TABLE IF NOT EXISTS topics (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     max_number INTEGER DEFAULT NULL,
     min_number INTEGER DEFAULT NULL,
+    reset_epoch INTEGER DEFAULT 0,
+    zekr_text TEXT DEFAULT '',
     PRIMARY KEY (group_id, topic_id),
     FOREIGN KEY (group_id) REFERENCES groups(group_id)
 );
@@ -84,11 +90,25 @@ CREATE TABLE IF NOT EXISTS contributions (
     verse_id INTEGER,
     zekr_id INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    reset_epoch INTEGER DEFAULT 0,
     FOREIGN KEY (user_id, group_id, topic_id) REFERENCES users(user_id, group_id, topic_id),
     FOREIGN KEY (group_id, topic_id) REFERENCES topics(group_id, topic_id),
     FOREIGN KEY (zekr_id) REFERENCES topic_zekrs(id) ON DELETE SET NULL
 );
 
+-- تجمیع روزانه مشارکت‌های فشرده‌شده (ردیف‌های خام در دیتابیس آرشیو نگه داشته می‌شوند)
+CREATE TABLE IF NOT EXISTS contribution_daily (
+    group_id INTEGER,
+    topic_id INTEGER,
+    user_id INTEGER,
+    reset_epoch INTEGER DEFAULT 0,
+    day TEXT NOT NULL,
+    total_amount INTEGER DEFAULT 0,
+    contribution_count INTEGER DEFAULT 0,
+    verse_count INTEGER DEFAULT 0,
+    PRIMARY KEY (group_id, topic_id, user_id, reset_epoch, day)
+);
+
 CREATE TABLE IF NOT EXISTS sepas_texts (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     group_id INTEGER,
@@ -103,10 +123,41 @@ CREATE TABLE IF NOT EXISTS hadith_settings (
     FOREIGN KEY (group_id) REFERENCES groups(group_id)
 );
 
+-- /tag در هر گروهی کار می‌کند، نه فقط گروه‌های ختم؛ پس به groups وابسته نیست
 CREATE TABLE IF NOT EXISTS tag_timestamps (
     group_id INTEGER PRIMARY KEY,
-    last_tag_time TEXT NOT NULL,
-    FOREIGN KEY (group_id) REFERENCES groups(group_id)
+    last_tag_time TEXT NOT NULL
+);
+
+-- chat_data / user_data / bot_data تلگرام (bot/database/persistence.py)
+CREATE TABLE IF NOT EXISTS persistence_data (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data BLOB NOT NULL,
+    updated_at INTEGER,
+    PRIMARY KEY (kind, key)
+);
+
+-- انتخاب‌های در انتظار کیبوردهای ذکر/دعا (bot/utils/pending_store.py)
+CREATE TABLE IF NOT EXISTS pending_selections (
+    kind TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (kind, chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_pending_selections_expires ON pending_selections(expires_at);
+
+-- پیشرفت عملیات /tag در حال اجرا؛ بعد از ری‌استارت از last_user_id ادامه داده می‌شود
+CREATE TABLE IF NOT EXISTS tag_jobs (
+    group_id INTEGER PRIMARY KEY,
+    message_thread_id INTEGER,
+    reply_to_message_id INTEGER,
+    last_user_id INTEGER NOT NULL DEFAULT 0,
+    sent_message_ids TEXT NOT NULL DEFAULT '[]',
+    started_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
 );
 
 CREATE TABLE IF NOT EXISTS banned_groups (
@@ -118,9 +169,8 @@ CREATE TABLE IF NOT EXISTS banned_users (
     user_id INTEGER PRIMARY KEY,
     banned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
-CREATE INDEX IF NOT EXISTS idx_contributions_group_topic ON contributions(group_id, topic_id);
+-- ایندکس‌های تنظیم‌شده برای کوئری‌های پرتکرار در indexes.sql هستند
 CREATE INDEX IF NOT EXISTS idx_users_group_topic ON users(group_id, topic_id);
-CREATE INDEX IF NOT EXISTS idx_topics_group_topic ON topics(group_id, topic_id);
 CREATE INDEX IF NOT EXISTS idx_khatm_ranges_group_topic ON khatm_ranges(group_id, topic_id);
 CREATE INDEX IF NOT EXISTS idx_topic_zekrs_group_topic ON topic_zekrs(group_id, topic_id);
 
@@ -160,4 +210,12 @@ CREATE TABLE IF NOT EXISTS doa_items (
 CREATE INDEX IF NOT EXISTS idx_doa_items_group_topic ON doa_items(group_id, topic_id);
 
 
-CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_default_sepas ON sepas_texts(text) WHERE is_default = 1;
\ No newline at end of file
+CREATE UNIQUE INDEX IF NOT EXISTS idx_unique_default_sepas ON sepas_texts(text) WHERE is_default = 1;
+
+-- هش محتوای داده‌های مرجع seed شده (متن‌های سپاس پیش‌فرض و ...)
+CREATE TABLE IF NOT EXISTS reference_seeds (
+    name TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    row_count INTEGER DEFAULT 0,
+    seeded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
\ No newline at end of file
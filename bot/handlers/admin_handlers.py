@@ -1,4 +1,5 @@
 import logging
+from functools import wraps
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from bot.database.db import fetch_one, fetch_all, execute, write_queue
@@ -8,18 +9,22 @@ import re
 from telegram import constants
 from bot.utils.quran import QuranManager
 import time
+from typing import Dict, List, Optional, Tuple
 from bot.utils.constants import SUPER_ADMIN_IDS
+from bot.utils.metrics import IS_ADMIN_SECONDS
+from bot.utils.tracing import span
 logger = logging.getLogger(__name__)
 
 def log_function_call(func):
+    @wraps(func)
     async def wrapper(*args, **kwargs):
-        logger.debug(f"Entering function: {func.__name__}")
+        logger.debug("Entering function: %s", func.__name__)
         try:
             result = await func(*args, **kwargs)
-            logger.debug(f"Exiting function: {func.__name__}")
+            logger.debug("Exiting function: %s", func.__name__)
             return result
         except Exception as e:
-            logger.error(f"Error in function {func.__name__}: {e}", exc_info=True)
+            logger.error("Error in function %s: %s", func.__name__, e, exc_info=True)
             raise
     return wrapper
 
@@ -891,7 +896,8 @@ async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
             return True
         
         # Check if user is a group admin
-        admins = await context.bot.get_chat_administrators(chat_id)
+        with IS_ADMIN_SECONDS.time(), span("is_admin"):
+            admins = await context.bot.get_chat_administrators(chat_id)
         is_admin = any(admin.user.id == user_id for admin in admins)
         logger.debug("Group admin check result: user_id=%s, is_admin=%s", user_id, is_admin)
         
@@ -1498,3 +1504,22 @@ TEXT_COMMANDS = {
     "add doa": {"handler": start_add_doa_item, "admin_only": True, "aliases": ["افزودن دعا", "افزودن زیارت", "مدیریت دعا"], "takes_args": False},
     "del doa": {"handler": start_remove_doa_item, "admin_only": True, "aliases": ["حذف دعا", "حذف زیارت"], "takes_args": False},
 }
+
+
+def match_text_command(raw_text: str, commands: Dict = TEXT_COMMANDS) -> Optional[Tuple[str, Dict, List[str]]]:
+    """
+    Match a plain-text command (English name or Persian alias) against TEXT_COMMANDS.
+    Returns (command, info, args) or None; only commands with takes_args accept trailing arguments.
+    """
+    text = raw_text.lower()
+    for command, info in commands.items():
+        if text == command or raw_text in info["aliases"]:
+            return command, info, []
+        if not info.get("takes_args", False):
+            continue
+        if text.startswith(command + " "):
+            return command, info, text[len(command) + 1:].split()
+        for alias in info["aliases"]:
+            if raw_text.startswith(alias + " "):
+                return command, info, raw_text[len(alias) + 1:].split()
+    return None
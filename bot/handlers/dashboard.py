@@ -1,13 +1,17 @@
 import logging
+from functools import wraps
 import re
 import sqlite3
 from typing import List, Tuple
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler, CommandHandler, CallbackQueryHandler, MessageHandler, filters
 from telegram.error import BadRequest, Forbidden
-from bot.database.db import fetch_all, fetch_one, is_group_banned, ban_group, unban_group, get_global_stats, get_group_users, set_group_invite_link, get_group_invite_link, remove_group_invite_link, ban_user, unban_user, is_user_banned
+from bot.database.db import fetch_one, fetch_all_shards, fetch_page_shards, is_group_banned, get_global_stats, get_group_users, get_group_invite_link, banned_among
+from bot.sharding import ShardCommandError, run_on_all_shards, run_on_group_shard
 from bot.utils.constants import SUPER_ADMIN_IDS, MONITOR_CHANNEL_ID
 from bot.utils.helpers import ignore_old_messages
+from bot.utils.metrics import render_summary
+from bot.utils.profiler import profile, is_profiling
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +20,7 @@ MESSAGES = {
     "unauthorized": "❌ دسترسی غیرمجاز. فقط مدیران ارشد می‌توانند به داشبورد دسترسی داشته باشند.",
     "error_generic": "❌ خطا در پردازش درخواست.",
     "error_database": "❌ خطا در دسترسی به پایگاه داده. لطفاً دوباره تلاش کنید.",
+    "error_shard": "❌ تغییر در شارد صاحب داده انجام نشد؛ وضعیت را بررسی و دوباره تلاش کنید.",
     "error_api": "❌ خطا در ارتباط با تلگرام. لطفاً دوباره تلاش کنید.",
     "dashboard_closed": "✅ داشبورد بسته شد.",
     "no_groups": "📋 هیچ گروهی یافت نشد.",
@@ -28,31 +33,43 @@ MESSAGES = {
     "select_users": "👤 کاربران انتخاب‌شده: {}\nلطفاً اقدام را انتخاب کنید:",
     "bulk_action_success": "✅ عملیات با موفقیت برای {} کاربر انجام شد.",
     "invalid_user_id": "❌ شناسه یا نام کاربری نامعتبر است.",
+    "profile_running": "⏳ یک پروفایل در حال اجراست. لطفاً بعد از پایان آن دوباره تلاش کنید.",
+    "profile_started": "⏳ پروفایل به مدت {} ثانیه شروع شد. نتیجه به همین گفتگو ارسال می‌شود.",
 }
 
+# مدت‌های قابل انتخاب پروفایل (ثانیه)
+PROFILE_DURATIONS = (10, 30, 60)
+
 # حالت‌های ConversationHandler
 DASHBOARD_MAIN, MANAGE_BANNED_GROUPS, VIEW_GROUPS_PAGINATED, SEARCH_GROUPS, VIEW_MONITORING, MANAGE_USERS, SET_GROUP_LINK, SEARCH_USERS = range(8)
 
 def log_function_call(func):
+    @wraps(func)
     async def wrapper(*args, **kwargs):
-        logger.debug(f"Entering function: {func.__name__}")
+        logger.debug("Entering function: %s", func.__name__)
         try:
             result = await func(*args, **kwargs)
-            logger.debug(f"Exiting function: {func.__name__}")
+            logger.debug("Exiting function: %s", func.__name__)
             return result
         except Exception as e:
-            logger.error(f"Error in function {func.__name__}: {str(e)}", exc_info=True)
+            logger.error("Error in function %s: %s", func.__name__, e, exc_info=True)
             raise
     return wrapper
 
+async def _group_exists(group_id: int) -> bool:
+    # گروه ممکن است در شارد دیگری باشد؛ نوشتن با run_on_group_shard به شارد صاحبش می‌رود
+    return bool(await fetch_all_shards("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)))
+
 def create_main_menu() -> InlineKeyboardMarkup:
     keyboard = [
         [InlineKeyboardButton("📋 لیست گروه‌ها", callback_data="view_groups")],
         [InlineKeyboardButton("🚫 گروه‌های مسدود", callback_data="manage_banned_groups")],
         [InlineKeyboardButton("📊 آمار کلی", callback_data="view_stats")],
+        [InlineKeyboardButton("🔬 پروفایل پردازش", callback_data="profile_menu")],
         [InlineKeyboardButton("🔍 جستجوی گروه", callback_data="search_groups")],
         [InlineKeyboardButton("🔍 جستجوی کاربر", callback_data="search_users")],
         [InlineKeyboardButton("📩 پیام‌های نظارتی", callback_data="view_monitoring")],
+        [InlineKeyboardButton("📈 متریک‌ها", callback_data="view_metrics")],
         [InlineKeyboardButton("👤 مدیریت کاربران", callback_data="manage_users")],
         [InlineKeyboardButton("❌ بستن", callback_data="close_dashboard")]
     ]
@@ -115,6 +132,14 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
         elif query.data == "view_monitoring":
             context.user_data['previous_state'] = DASHBOARD_MAIN
             return await view_monitoring(update, context)
+        elif query.data == "profile_menu":
+            context.user_data['previous_state'] = DASHBOARD_MAIN
+            return await profile_menu(update, context)
+        elif query.data.startswith("profile_run_"):
+            return await start_profile(update, context, int(query.data.split("_")[-1]))
+        elif query.data == "view_metrics":
+            context.user_data['previous_state'] = DASHBOARD_MAIN
+            return await view_metrics(update, context)
         elif query.data == "manage_users":
             context.user_data['previous_state'] = DASHBOARD_MAIN
             await query.message.edit_text("🔍 شناسه گروه را برای مدیریت کاربران وارد کنید:")
@@ -125,18 +150,18 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return SEARCH_USERS
         elif query.data.startswith("ban_group_"):
             group_id = int(query.data.split("_")[-1])
-            if not await fetch_one("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)):
+            if not await _group_exists(group_id):
                 await query.message.edit_text(MESSAGES["group_not_found"])
                 return await manage_banned_groups(update, context)
-            await ban_group(group_id)
+            await run_on_group_shard(group_id, "ban_group")
             await query.message.edit_text(f"✅ گروه {group_id} با موفقیت مسدود شد.")
             return await manage_banned_groups(update, context)
         elif query.data.startswith("unban_group_"):
             group_id = int(query.data.split("_")[-1])
-            if not await fetch_one("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)):
+            if not await _group_exists(group_id):
                 await query.message.edit_text(MESSAGES["group_not_found"])
                 return await manage_banned_groups(update, context)
-            await unban_group(group_id)
+            await run_on_group_shard(group_id, "unban_group")
             await query.message.edit_text(f"✅ گروه {group_id} با موفقیت رفع مسدودیت شد.")
             return await manage_banned_groups(update, context)
         elif query.data.startswith("page_"):
@@ -145,7 +170,7 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return await view_groups(update, context)
         elif query.data.startswith("set_link_"):
             group_id = int(query.data.split("_")[-1])
-            if not await fetch_one("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)):
+            if not await _group_exists(group_id):
                 await query.message.edit_text(MESSAGES["group_not_found"])
                 return await view_groups(update, context)
             context.user_data['link_group_id'] = group_id
@@ -154,15 +179,15 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return SET_GROUP_LINK
         elif query.data.startswith("remove_link_"):
             group_id = int(query.data.split("_")[-1])
-            if not await fetch_one("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)):
+            if not await _group_exists(group_id):
                 await query.message.edit_text(MESSAGES["group_not_found"])
                 return await view_groups(update, context)
-            await remove_group_invite_link(group_id)
+            await run_on_group_shard(group_id, "remove_group_invite_link")
             await query.message.edit_text(f"✅ لینک گروه {group_id} حذف شد.")
             return await view_groups(update, context)
         elif query.data.startswith("generate_link_"):
             group_id = int(query.data.split("_")[-1])
-            if not await fetch_one("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)):
+            if not await _group_exists(group_id):
                 await query.message.edit_text(MESSAGES["group_not_found"])
                 return await view_groups(update, context)
             try:
@@ -171,7 +196,7 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
                     await query.message.edit_text(f"❌ ربات اجازه ایجاد لینک دعوت برای گروه {group_id} را ندارد.")
                     return await view_groups(update, context)
                 invite_link = await context.bot.create_chat_invite_link(group_id, member_limit=None)
-                await set_group_invite_link(group_id, invite_link.invite_link)
+                await run_on_group_shard(group_id, "set_group_invite_link", invite_link.invite_link)
                 await query.message.edit_text(f"✅ لینک گروه {group_id} با موفقیت ایجاد شد.")
             except Exception as e:
                 logger.error("Error generating link for group %s: %s", group_id, str(e), exc_info=True)
@@ -179,12 +204,12 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return await view_groups(update, context)
         elif query.data.startswith("ban_user_"):
             user_id = int(query.data.split("_")[-1])
-            await ban_user(user_id)
+            await run_on_all_shards("ban_user", user_id)
             await query.message.edit_text(f"✅ کاربر {user_id} با موفقیت مسدود شد.")
             return await manage_users(update, context)
         elif query.data.startswith("unban_user_"):
             user_id = int(query.data.split("_")[-1])
-            await unban_user(user_id)
+            await run_on_all_shards("unban_user", user_id)
             await query.message.edit_text(f"✅ کاربر {user_id} با موفقیت رفع مسدودیت شد.")
             return await manage_users(update, context)
         elif query.data.startswith("user_page_"):
@@ -211,7 +236,7 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 await query.message.edit_text("❌ هیچ کاربری انتخاب نشده است.")
                 return await manage_users(update, context)
             for user_id in selected_users:
-                await ban_user(user_id)
+                await run_on_all_shards("ban_user", user_id)
             count = len(selected_users)
             context.user_data['selected_users'] = set()
             await query.message.edit_text(MESSAGES["bulk_action_success"].format(count))
@@ -222,7 +247,7 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 await query.message.edit_text("❌ هیچ کاربری انتخاب نشده است.")
                 return await manage_users(update, context)
             for user_id in selected_users:
-                await unban_user(user_id)
+                await run_on_all_shards("unban_user", user_id)
             count = len(selected_users)
             context.user_data['selected_users'] = set()
             await query.message.edit_text(MESSAGES["bulk_action_success"].format(count))
@@ -254,6 +279,11 @@ async def dashboard_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
             context.user_data['selected_users'] = set()
             return await back_to_main(update, context)
         return DASHBOARD_MAIN
+    except ShardCommandError as e:
+        logger.error(f"Shard command failed in dashboard_callback: {str(e)}")
+        await query.message.reply_text(MESSAGES["error_shard"])
+        context.user_data.clear()
+        return DASHBOARD_MAIN
     except Exception as e:
         logger.error(f"Error in dashboard_callback: {str(e)}", exc_info=True)
         try:
@@ -280,11 +310,13 @@ async def view_groups(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
             LEFT JOIN users u ON g.group_id = u.group_id
             LEFT JOIN topics t ON g.group_id = t.group_id AND t.is_active = 1
             GROUP BY g.group_id
+            ORDER BY g.group_id
             LIMIT ? OFFSET ?
         """
         try:
-            groups: List[dict] = await fetch_all(query_str, (per_page, (page - 1) * per_page))
-            total_groups: int = (await fetch_one("SELECT COUNT(*) FROM groups"))["COUNT(*)"]
+            # در حالت شاردینگ گروه‌ها از دیتابیس همه شاردها خوانده می‌شوند
+            groups: List[dict] = await fetch_page_shards(query_str, (), (page - 1) * per_page, per_page, "group_id")
+            total_groups: int = sum(row["count"] for row in await fetch_all_shards("SELECT COUNT(*) AS count FROM groups"))
         except sqlite3.OperationalError as db_error:
             logger.error(f"Database error in view_groups: {str(db_error)}")
             try:
@@ -385,8 +417,8 @@ async def manage_banned_groups(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     try:
         logger.info("Fetching banned groups for dashboard")
-        banned_groups = await fetch_all("SELECT g.group_id, g.title, g.invite_link FROM banned_groups bg JOIN groups g ON bg.group_id = g.group_id")
-        all_groups = await fetch_all("SELECT group_id, is_active, title, invite_link FROM groups")
+        banned_groups = await fetch_all_shards("SELECT g.group_id, g.title, g.invite_link FROM banned_groups bg JOIN groups g ON bg.group_id = g.group_id")
+        all_groups = await fetch_all_shards("SELECT group_id, is_active, title, invite_link FROM groups")
         message = "<b>🚫 مدیریت گروه‌های مسدود</b>\n\n<b>گروه‌های مسدود:</b>\n"
         if banned_groups:
             for group in banned_groups:
@@ -397,8 +429,10 @@ async def manage_banned_groups(update: Update, context: ContextTypes.DEFAULT_TYP
             message += "هیچ گروه مسدودی وجود ندارد.\n"
         message += "\n<b>همه گروه‌ها:</b>\n"
         keyboard = []
+        # فهرست مسدودها از دیتابیس همه شاردها آمده است
+        banned_ids = {group["group_id"] for group in banned_groups}
         for group in all_groups:
-            banned = await is_group_banned(group["group_id"])
+            banned = group["group_id"] in banned_ids
             status = "✅ فعال" if group["is_active"] else "❌ غیرفعال"
             title = group["title"] or f"شناسه {group['group_id']}"
             title_display = f'<a href="{group["invite_link"]}">{title}</a>' if group["invite_link"] else title
@@ -456,6 +490,124 @@ async def view_monitoring(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data.clear()
         return DASHBOARD_MAIN
 
+def metrics_text() -> str:
+    # سقف طول پیام تلگرام ۴۰۹۶ کاراکتر است
+    text = render_summary()
+    return text if len(text) <= 4000 else text[:4000].rsplit("\n", 1)[0]
+
+@log_function_call
+async def view_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    try:
+        message = metrics_text()
+        keyboard = [
+            [InlineKeyboardButton("🔄 بروزرسانی", callback_data="view_metrics")],
+            [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_previous")],
+        ]
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        try:
+            await query.message.edit_text(message, reply_markup=reply_markup, parse_mode="HTML")
+        except (BadRequest, Forbidden) as api_error:
+            # BadRequest "message is not modified" هم وقتی متریک‌ها تغییری نکرده‌اند
+            logger.warning(f"Failed to edit message: {str(api_error)}. Sending new message.")
+            await query.message.reply_text(message, reply_markup=reply_markup, parse_mode="HTML")
+        logger.info("Metrics summary sent to dashboard")
+        return VIEW_MONITORING
+    except Exception as e:
+        logger.error(f"Error in view_metrics: {str(e)}", exc_info=True)
+        try:
+            await query.message.edit_text(MESSAGES["error_generic"])
+        except (BadRequest, Forbidden) as api_error:
+            logger.warning(f"Failed to edit message: {str(api_error)}. Sending new message.")
+            await query.message.reply_text(MESSAGES["error_generic"])
+        context.user_data.clear()
+        return DASHBOARD_MAIN
+
+@log_function_call
+async def profile_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    message = (
+        "<b>🔬 پروفایل پردازش</b>\n\n"
+        "از همه thread ها (event loop و aiosqlite) نمونه پشته گرفته می‌شود و توقف‌های event loop "
+        "همراه کوروتین مسئول ثبت می‌شوند. خروجی collapsed برای flamegraph ارسال می‌شود.\n"
+        "مدت را انتخاب کنید:"
+    )
+    keyboard = [
+        [InlineKeyboardButton(f"{seconds} ثانیه", callback_data=f"profile_run_{seconds}") for seconds in PROFILE_DURATIONS],
+        [InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_previous")],
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    try:
+        await query.message.edit_text(message, reply_markup=reply_markup, parse_mode="HTML")
+    except (BadRequest, Forbidden) as api_error:
+        logger.warning(f"Failed to edit message: {str(api_error)}. Sending new message.")
+        await query.message.reply_text(message, reply_markup=reply_markup, parse_mode="HTML")
+    return VIEW_MONITORING
+
+def format_profile_result(result: dict) -> str:
+    from html import escape
+
+    total = max(result["samples"], 1)
+    lines = [
+        "<b>🔬 نتیجه پروفایل</b>",
+        f"مدت: {result['seconds']} ثانیه | نمونه‌ها: {result['samples']}",
+        f"فایل: <code>{escape(result['collapsed_path'])}</code>",
+        "",
+        "<b>event loop (self time)</b>",
+    ]
+    lines += [f"• {count * 100 / total:.1f}% {escape(frame)}" for frame, count in result["top_loop_frames"]] or ["—"]
+    lines += ["", "<b>aiosqlite</b>"]
+    lines += [f"• {count * 100 / total:.1f}% {escape(frame)}" for frame, count in result["top_db_frames"]] or ["—"]
+    stalls = sorted(result["stalls"], key=lambda stall: stall["lag_ms"], reverse=True)
+    lines += ["", f"<b>توقف‌های event loop: {len(stalls)}</b>"]
+    for stall in stalls[:5]:
+        where = stall["stack"][-1] if stall["stack"] else "?"
+        lines.append(f"• {stall['lag_ms']:.0f}ms {escape(str(stall['task']))} @ {escape(where)}")
+    text = "\n".join(lines)
+    return text if len(text) <= 4000 else text[:4000].rsplit("\n", 1)[0]
+
+async def _run_profile(bot, chat_id: int, seconds: int) -> None:
+    try:
+        result = await profile(seconds)
+        await bot.send_message(chat_id, format_profile_result(result), parse_mode="HTML")
+        with open(result["collapsed_path"], "rb") as f:
+            await bot.send_document(chat_id, f, filename=result["collapsed_path"].rsplit("/", 1)[-1])
+    except Exception as e:
+        logger.error("Error running profile: %s", e, exc_info=True)
+        try:
+            await bot.send_message(chat_id, MESSAGES["error_generic"])
+        except Exception:
+            pass
+
+@log_function_call
+async def start_profile(update: Update, context: ContextTypes.DEFAULT_TYPE, seconds: int) -> int:
+    query = update.callback_query
+    if seconds not in PROFILE_DURATIONS:
+        return VIEW_MONITORING
+    if is_profiling():
+        await query.message.reply_text(MESSAGES["profile_running"])
+        return VIEW_MONITORING
+    # پروفایل در پس‌زمینه اجرا می‌شود تا هندلر (و ترتیب آپدیت‌های این چت) منتظر نماند
+    context.application.create_task(_run_profile(context.bot, query.message.chat_id, seconds))
+    logger.info("Profiling started for %s seconds by user_id=%s", seconds, update.effective_user.id)
+    keyboard = [[InlineKeyboardButton("🔙 بازگشت", callback_data="back_to_previous")]]
+    try:
+        await query.message.edit_text(MESSAGES["profile_started"].format(seconds), reply_markup=InlineKeyboardMarkup(keyboard))
+    except (BadRequest, Forbidden) as api_error:
+        logger.warning(f"Failed to edit message: {str(api_error)}. Sending new message.")
+        await query.message.reply_text(MESSAGES["profile_started"].format(seconds), reply_markup=InlineKeyboardMarkup(keyboard))
+    return VIEW_MONITORING
+
+@ignore_old_messages()
+@log_function_call
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/metrics: خلاصه متریک‌ها برای مدیران ارشد، بدون باز کردن داشبورد."""
+    if update.effective_user.id not in SUPER_ADMIN_IDS:
+        logger.warning("Unauthorized metrics access attempt: user_id=%s", update.effective_user.id)
+        await update.message.reply_text(MESSAGES['unauthorized'])
+        return
+    await update.message.reply_text(metrics_text(), parse_mode="HTML")
+
 @log_function_call
 async def search_groups_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
@@ -474,7 +626,7 @@ async def search_groups_handler(update: Update, context: ContextTypes.DEFAULT_TY
             WHERE g.group_id = ?
             GROUP BY g.group_id
         """
-        groups = await fetch_all(query_str, (int(search_id),))
+        groups = await fetch_all_shards(query_str, (int(search_id),))
         logger.info("Searching groups: search_id=%s", search_id)
         if not groups:
             await update.message.reply_text("🔍 هیچ گروهی با این شناسه یافت نشد.")
@@ -513,17 +665,22 @@ async def set_group_link_handler(update: Update, context: ContextTypes.DEFAULT_T
     try:
         invite_link = update.message.text.strip()
         group_id = context.user_data.get('link_group_id')
-        if not group_id or not await fetch_one("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)):
+        if not group_id or not await _group_exists(group_id):
             await update.message.reply_text(MESSAGES["group_not_found"])
             context.user_data.clear()
             return DASHBOARD_MAIN
         if not invite_link.startswith("https://t.me/"):
             await update.message.reply_text(MESSAGES["invalid_link"])
             return SET_GROUP_LINK
-        await set_group_invite_link(group_id, invite_link)
+        await run_on_group_shard(group_id, "set_group_invite_link", invite_link)
         await update.message.reply_text(f"✅ لینک گروه {group_id} با موفقیت تنظیم شد.")
         context.user_data.clear()
         return await view_groups(update, context)
+    except ShardCommandError as e:
+        logger.error(f"Shard command failed in set_group_link_handler: {str(e)}")
+        await update.message.reply_text(MESSAGES["error_shard"])
+        context.user_data.clear()
+        return DASHBOARD_MAIN
     except sqlite3.OperationalError as db_error:
         logger.error(f"Database error in set_group_link_handler: {str(db_error)}")
         await update.message.reply_text(MESSAGES["error_database"])
@@ -551,7 +708,7 @@ async def manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         if 'user_group_id' not in context.user_data and query.data == "manage_users":
             return MANAGE_USERS
         group_id = context.user_data.get('user_group_id')
-        if not group_id or not await fetch_one("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)):
+        if not group_id or not await _group_exists(group_id):
             try:
                 await query.message.edit_text(MESSAGES["group_not_found"])
             except (BadRequest, Forbidden) as api_error:
@@ -564,10 +721,11 @@ async def manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         user_filter = context.user_data.get('user_filter', 'all')
         logger.info("Fetching users for group: group_id=%s, page=%s, filter=%s", group_id, page, user_filter)
         users, total_pages = await get_group_users(group_id, page, per_page)
+        banned_ids = await banned_among(user["user_id"] for user in users)
         if user_filter == "banned":
-            users = [user for user in users if await is_user_banned(user["user_id"])]
+            users = [user for user in users if user["user_id"] in banned_ids]
         elif user_filter == "unbanned":
-            users = [user for user in users if not await is_user_banned(user["user_id"])]
+            users = [user for user in users if user["user_id"] not in banned_ids]
         total_users = await fetch_one("SELECT COUNT(DISTINCT user_id) AS count FROM users WHERE group_id = ?", (group_id,))
         total_users = total_users["count"] if total_users else 0
         group_info = await fetch_one("SELECT title, is_active FROM groups WHERE group_id = ?", (group_id,))
@@ -586,7 +744,7 @@ async def manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         else:
             for user in users:
                 user_id = user["user_id"]
-                banned = await is_user_banned(user_id)
+                banned = user_id in banned_ids
                 banned_status = "🚫 مسدود" if banned else "✅ فعال"
                 username = user.get("username", "بدون نام کاربری")
                 first_name = user.get("first_name", "بدون نام")
@@ -601,7 +759,7 @@ async def manage_users(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         keyboard = []
         for user in users:
             user_id = user["user_id"]
-            banned = await is_user_banned(user_id)
+            banned = user_id in banned_ids
             action_button = InlineKeyboardButton(
                 "رفع مسدودیت" if banned else "مسدود کردن",
                 callback_data=f"{'unban' if banned else 'ban'}_user_{user_id}"
@@ -661,7 +819,7 @@ async def select_group_for_users(update: Update, context: ContextTypes.DEFAULT_T
             await update.message.reply_text(MESSAGES["invalid_group_id"])
             return MANAGE_USERS
         group_id = int(text)
-        if not await fetch_one("SELECT 1 FROM groups WHERE group_id = ?", (group_id,)):
+        if not await _group_exists(group_id):
             await update.message.reply_text(MESSAGES["group_not_found"])
             return MANAGE_USERS
         context.user_data['user_group_id'] = group_id
@@ -692,7 +850,7 @@ async def search_users_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             WHERE user_id = ? OR username LIKE ?
         """
         try:
-            users = await fetch_all(query_str, (search_term if search_term.isdigit() else 0, f"%{search_term}%"))
+            users = await fetch_all_shards(query_str, (search_term if search_term.isdigit() else 0, f"%{search_term}%"))
         except sqlite3.OperationalError as db_error:
             logger.error(f"Database error in search_users_handler: {str(db_error)}")
             await update.message.reply_text(MESSAGES["error_database"])
@@ -703,9 +861,10 @@ async def search_users_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             return await back_to_previous(update, context)
         message = "<b>🔍 نتایج جستجوی کاربران</b>\n\n"
         keyboard = []
+        banned_ids = await banned_among(user["user_id"] for user in users)
         for user in users:
             user_id = user["user_id"]
-            banned = await is_user_banned(user_id)
+            banned = user_id in banned_ids
             banned_status = "🚫 مسدود" if banned else "✅ فعال"
             username = user.get("username", "بدون نام کاربری")
             first_name = user.get("first_name", "بدون نام")
@@ -842,7 +1001,10 @@ def setup_dashboard_handlers():
                         MessageHandler(filters.TEXT & ~filters.COMMAND, search_groups_handler),
                         CallbackQueryHandler(back_to_previous, pattern="^back_to_previous$")
                     ],
-                    VIEW_MONITORING: [CallbackQueryHandler(back_to_previous, pattern="^back_to_previous$")],
+                    VIEW_MONITORING: [
+                        CallbackQueryHandler(dashboard_callback, pattern="^(view_metrics|profile_run_\\d+)$"),
+                        CallbackQueryHandler(back_to_previous, pattern="^back_to_previous$")
+                    ],
                     MANAGE_USERS: [
                         CallbackQueryHandler(dashboard_callback, pattern="^(ban_user_|unban_user_|user_page_|select_user_|bulk_ban|bulk_unban|clear_selection|filter_)"),
                         MessageHandler(filters.TEXT & ~filters.COMMAND, select_group_for_users),
@@ -863,7 +1025,8 @@ def setup_dashboard_handlers():
                     CommandHandler("dashboard", dashboard_command)
                 ],
                 per_message=False,
-            )
+            ),
+            CommandHandler("metrics", metrics_command),
         ]
     except Exception as e:
         logger.error(f"Error setting up dashboard handlers: {str(e)}", exc_info=True)
@@ -1,6 +1,7 @@
 import asyncio
 import datetime
 import logging
+from functools import wraps
 import time
 from datetime import timezone
 from pytz import timezone
@@ -11,19 +12,22 @@ from telegram.error import TimedOut
 from bot.database.db import fetch_one, write_queue, fetch_all, execute
 from bot.utils.helpers import parse_number, format_khatm_message, get_random_sepas, reply_text_and_schedule_deletion, ignore_old_messages
 from bot.utils.quran import QuranManager
-from bot.handlers.admin_handlers import is_admin, TEXT_COMMANDS,process_doa_setup,process_doa_removal
+from bot.utils.pending_store import pending_zekr, pending_doa
+from bot.utils.metrics import KHATM_STAGE_SECONDS, StageTimer
+from bot.handlers.admin_handlers import is_admin, match_text_command,process_doa_setup,process_doa_removal
 from telegram.constants import ParseMode
 logger = logging.getLogger(__name__)
 
 def log_function_call(func):
+    @wraps(func)
     async def wrapper(*args, **kwargs):
-        logger.debug(f"Entering function: {func.__name__}")
+        logger.debug("Entering function: %s", func.__name__)
         try:
             result = await func(*args, **kwargs)
-            logger.debug(f"Exiting function: {func.__name__}")
+            logger.debug("Exiting function: %s", func.__name__)
             return result
         except Exception as e:
-            logger.error(f"Error in function {func.__name__}: {e}", exc_info=True)
+            logger.error("Error in function %s: %s", func.__name__, e, exc_info=True)
             raise
     return wrapper
 
@@ -33,16 +37,19 @@ def log_function_call(func):
 @log_function_call
 async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle khatm-related messages for salavat, zekr, or Quran contributions."""
+    stages = StageTimer(KHATM_STAGE_SECONDS)
     try:
         if await process_doa_removal(update, context):
             return
         if await process_doa_setup(update, context):
             return
+        stages.mark("doa_setup")
 
         is_admin_user = await is_admin(update, context)
+        stages.mark("is_admin")
 
 
-        logger.info("Starting handle_khatm_message: user_id=%s, chat_id=%s, message_id=%s", 
+        logger.debug("Starting handle_khatm_message: user_id=%s, chat_id=%s, message_id=%s", 
                    update.effective_user.id, update.effective_chat.id, update.message.message_id)
 
         if not update.effective_chat or update.effective_chat.type not in ["group", "supergroup"]:
@@ -56,55 +63,37 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
         raw_text = update.message.text.strip()
         text = raw_text.lower()
 
-        logger.info("Processing message: group_id=%s, topic_id=%s, text=%s, user=%s", 
+        logger.debug("Processing message: group_id=%s, topic_id=%s, text=%s, user=%s", 
                    group_id, topic_id, raw_text, update.effective_user.username or update.effective_user.first_name)
 
         # Step 1: Check if the message is a command (English or Persian)
         # and if the user is an admin. If so, execute and return.
         is_admin_user = await is_admin(update, context) # Check admin status once
 
-        command_found_and_executed = False
-        for command, info in TEXT_COMMANDS.items():
-            is_command_match = False
-            args = []
-
-            if info.get("takes_args", False):
-                if (text == command or 
-                    raw_text in info["aliases"] or 
-                    text.startswith(command + " ") or 
-                    any(raw_text.startswith(alias + " ") for alias in info["aliases"])):
-                    is_command_match = True
-                    if text.startswith(command + " "):
-                        args = text[len(command)+1:].split()
-                    elif any(raw_text.startswith(alias + " ") for alias in info["aliases"]):
-                        matching_alias = next(alias for alias in info["aliases"] if raw_text.startswith(alias + " "))
-                        args = raw_text[len(matching_alias)+1:].split()
-            else: # Commands that must be exact
-                if text == command or raw_text in info["aliases"]:
-                    is_command_match = True
-            
-            if is_command_match:
-                logger.info("Command matched: command=%s, text='%s', user=%s, is_admin=%s", 
-                            command, raw_text, update.effective_user.id, is_admin_user)
-                if info["admin_only"] and not is_admin_user:
-                    logger.warning("Non-admin user %s attempted admin command '%s'. Ignoring.", 
-                                   update.effective_user.id, command)
-                    return 
-
-                context.args = args
-                logger.info("Executing command handler: command=%s, args=%s, user=%s", 
-                            command, args, update.effective_user.id)
-                try:
-                    await info["handler"](update, context)
-                    command_found_and_executed = True 
-                except Exception as e_handler:
-                    logger.error(f"Error executing handler for command {command}: {e_handler}", exc_info=True)
-                    try:
-                        await update.message.reply_text("خطایی در اجرای دستور رخ داد.")
-                    except:
-                        pass 
+        matched = match_text_command(raw_text)
+        stages.mark("match_command")
+        if matched:
+            command, info, args = matched
+            logger.info("Command matched: command=%s, text='%s', user=%s, is_admin=%s", 
+                        command, raw_text, update.effective_user.id, is_admin_user)
+            if info["admin_only"] and not is_admin_user:
+                logger.warning("Non-admin user %s attempted admin command '%s'. Ignoring.", 
+                               update.effective_user.id, command)
                 return 
 
+            context.args = args
+            logger.info("Executing command handler: command=%s, args=%s, user=%s", 
+                        command, args, update.effective_user.id)
+            try:
+                await info["handler"](update, context)
+            except Exception as e_handler:
+                logger.error(f"Error executing handler for command {command}: {e_handler}", exc_info=True)
+                try:
+                    await update.message.reply_text("خطایی در اجرای دستور رخ داد.")
+                except:
+                    pass 
+            return 
+
         # Step 2: Check time-off for non-admins
         if not is_admin_user: 
             group_settings = await fetch_one(
@@ -127,10 +116,8 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     time_off_end_naive = datetime.time(end_hour, end_minute)
                     
                     logger.debug(
-                        f"Checking time_off for non-admin in group {group_id}: \\n"
-                        f"  Current datetime (Tehran): {now_dt_tehran}\\n"
-                        f"  DB start_time_str: {start_time_str}, DB end_time_str: {end_time_str}\\n"
-                        f"  Parsed naive start_time: {time_off_start_naive}, Parsed naive end_time: {time_off_end_naive}"
+                        "Checking time_off for non-admin in group %s: now (Tehran)=%s, start=%s, end=%s",
+                        group_id, now_dt_tehran, time_off_start_naive, time_off_end_naive
                     )
 
                     is_currently_off = False
@@ -140,18 +127,22 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     else:
                         if now_dt_tehran.time() >= time_off_start_naive or now_dt_tehran.time() < time_off_end_naive:
                             is_currently_off = True
-                            logger.debug(f"  Time_off spans midnight and current time {now_dt_tehran.time()} is within {time_off_start_naive} or {time_off_end_naive} }}.")
+                            logger.debug("Time_off spans midnight and current time %s is within %s-%s",
+                                         now_dt_tehran.time(), time_off_start_naive, time_off_end_naive)
                         else:
-                            logger.debug(f"  Time_off spans midnight but current time {now_dt_tehran.time()} is NOT within {time_off_start_naive} }} or before {time_off_end_naive} .")
+                            logger.debug("Time_off spans midnight but current time %s is NOT within %s-%s",
+                                         now_dt_tehran.time(), time_off_start_naive, time_off_end_naive)
 
                     if is_currently_off:
-                        logger.info(f"Group {group_id} is currently in time_off_period: {start_time_str} - {end_time_str}}}. Ignoring non-admin message from user {update.effective_user.id}.")
+                        logger.debug("Group %s is currently in time_off_period: %s - %s. Ignoring non-admin message from user %s.",
+                                     group_id, start_time_str, end_time_str, update.effective_user.id)
                         return 
                 except ValueError as ve:
                     logger.error(f"Error parsing time_off times for group_id {group_id} }}: {ve}. Start: {group_settings['time_off_start']}, End: {group_settings['time_off_end']}")
                 except Exception as e:
                     logger.error(f"Unexpected error during time_off check for group_id {group_id} }}: {e}", exc_info=True)
 
+        stages.mark("time_off")
         # Step 3: Fetch group settings
         group = await fetch_one(
             """
@@ -160,6 +151,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
             """,
             (group_id,)
         )
+        stages.mark("fetch_group")
         if not group:
             logger.warning("Group not found: group_id=%s, user=%s", 
                           group_id, update.effective_user.username or update.effective_user.first_name)
@@ -189,6 +181,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
             """,
             (topic_id, group_id)
         )
+        stages.mark("fetch_topic")
         if not topic:
             logger.warning("Topic not found: group_id=%s, topic_id=%s, user=%s", 
                           group_id, topic_id, update.effective_user.username or update.effective_user.first_name)
@@ -209,14 +202,15 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
         username = update.effective_user.username or update.effective_user.first_name
         first_name = update.effective_user.first_name
 
-        logger.info("Processing message for active topic: group_id=%s, topic_id=%s, khatm_type=%s, user=%s, current_total=%d", 
+        logger.debug("Processing message for active topic: group_id=%s, topic_id=%s, khatm_type=%s, user=%s, current_total=%d", 
                    group_id, topic_id, topic["khatm_type"], username, topic["current_total"])
 
 
         if group["lock_enabled"] and not is_admin_user:  
 
             if parse_number(raw_text) is None:
-                logger.info(f"Lock mode ON for group {group_id}. Non-numeric message '{raw_text}' from non-admin user {update.effective_user.username or update.effective_user.first_name} will be deleted.")
+                logger.debug("Lock mode ON for group %s. Non-numeric message from non-admin user %s will be deleted.",
+                             group_id, username)
                 try:
                     await update.message.delete()
                     
@@ -226,16 +220,17 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
         # Step 5: Handle awaiting states for zekr
 
 
+        stages.mark("lock_check")
         # Step 6: Process number input for contributions
         number = parse_number(raw_text)
         if number is None:
             logger.debug("Message is not a number: text=%s, user=%s", raw_text, username)
             if topic["khatm_type"] == "ghoran":
-                logger.info("Informed user about numeric input for Quran khatm: group_id=%s, user=%s", group_id, username)
+                logger.debug("Informed user about numeric input for Quran khatm: group_id=%s, user=%s", group_id, username)
                 return
             return
         amount = number
-        logger.info("Parsed number from message: number=%d, user=%s", number, username)
+        logger.debug("Parsed number from message: number=%d, user=%s", number, username)
 
 # Step 7: Validate number range
         is_admin_user = await is_admin(update, context)
@@ -261,12 +256,14 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 min_limit_to_apply = topic.get("min_ayat", 1) #
                 max_limit_to_apply = topic.get("max_ayat", 100) #
                 limit_source_description = f"تاپیک (min_ayat: {min_limit_to_apply}, max_ayat: {max_limit_to_apply})"
-                logger.info(f"Using TOPIC limits for salavat/zekr in topic {topic_id}: min={min_limit_to_apply}, max={max_limit_to_apply}")
+                logger.debug("Using TOPIC limits for salavat/zekr in topic %s: min=%s, max=%s",
+                             topic_id, min_limit_to_apply, max_limit_to_apply)
             elif group: 
                 min_limit_to_apply = group.get("min_number", 0) #
                 max_limit_to_apply = group.get("max_number", 100000000000) #
                 limit_source_description = f"گروه (min_number: {min_limit_to_apply}, max_number: {max_limit_to_apply})"
-                logger.info(f"Using GROUP limits for salavat/zekr in group {group_id}: min={min_limit_to_apply}, max={max_limit_to_apply}")
+                logger.debug("Using GROUP limits for salavat/zekr in group %s: min=%s, max=%s",
+                             group_id, min_limit_to_apply, max_limit_to_apply)
             else:
                 logger.error("Could not determine limits: group or topic info missing.")
                 await update.message.reply_text("خطا در تعیین محدودیت‌ها.")
@@ -295,7 +292,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 await reply_text_and_schedule_deletion(update, context, msg)
                 return
             
-            logger.info("Handling zekr contribution, fetching zekr list: group_id=%s, topic_id=%s", group_id, topic_id)
+            logger.debug("Handling zekr contribution, fetching zekr list: group_id=%s, topic_id=%s", group_id, topic_id)
             zekrs = await fetch_all(
                 "SELECT id, zekr_text FROM topic_zekrs WHERE group_id = ? AND topic_id = ?",
                 (group_id, topic_id)
@@ -308,10 +305,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 return
 
             user_msg_id = update.message.message_id
-            if 'pending_zekr' not in context.chat_data:
-                context.chat_data['pending_zekr'] = {}
-            
-            context.chat_data['pending_zekr'][user_msg_id] = {
+            await pending_zekr.put(update.effective_chat.id, user_msg_id, {
                 "user_id": user_id,
                 "amount": amount,
                 "timestamp": time.time(),
@@ -319,8 +313,8 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 "topic_id": topic_id,
                 "username": username,
                 "first_name": first_name
-            }
-            logger.info("Stored pending zekr: msg_id=%s, user_id=%s, amount=%s", user_msg_id, user_id, amount)
+            })
+            logger.debug("Stored pending zekr: msg_id=%s, user_id=%s, amount=%s", user_msg_id, user_id, amount)
 
             keyboard = []
             row = []
@@ -347,6 +341,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
             	reply_markup=reply_markup,
             	reply_parameters=ReplyParameters(message_id=user_msg_id)
             )
+            stages.mark("selection_keyboard")
             return
         # ---------------------------------------------------------------------
         # بخش جدید: مدیریت ادعیه و زیارات (نمایش دکمه‌های دو ستونه)
@@ -364,15 +359,12 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
 
             # 2. ذخیره موقت اطلاعات (عدد ارسالی کاربر)
             user_msg_id = update.message.message_id
-            if 'pending_doa' not in context.chat_data:
-                context.chat_data['pending_doa'] = {}
-                
-            context.chat_data['pending_doa'][user_msg_id] = {
+            await pending_doa.put(update.effective_chat.id, user_msg_id, {
                 "user_id": user_id,
                 "amount": amount, # عددی که کاربر فرستاده
                 "username": username,
                 "first_name": first_name
-            }
+            })
 
             # 3. ساخت کیبورد دو ستونه (زیارت: چپ | دعا: راست)
             ziyarats = [x for x in items if x['category'] == 'ziyarat']
@@ -410,6 +402,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 reply_to_message_id=user_msg_id,
                 parse_mode=ParseMode.MARKDOWN
             )
+            stages.mark("selection_keyboard")
             return # خروج از تابع (تا پیام تایید پیش‌فرض ارسال نشود)
         # ---------------------------------------------------------------------
 
@@ -423,6 +416,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 return
             
             
+        stages.mark("validate")
         # Step 8: Ensure user exists in users table
         user_exists = await fetch_one(
             "SELECT 1 FROM users WHERE user_id = ? AND group_id = ? AND topic_id = ?",
@@ -432,13 +426,14 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     user_id, group_id, topic_id, bool(user_exists))
         
         if not user_exists:
-            logger.info("Creating new user record: user_id=%s, username=%s, group_id=%s, topic_id=%s",
+            logger.debug("Creating new user record: user_id=%s, username=%s, group_id=%s, topic_id=%s",
                       user_id, username, group_id, topic_id)
             await fetch_one(
                 "INSERT INTO users (user_id, group_id, topic_id, username, first_name, total_salavat, total_zekr, total_ayat) VALUES (?, ?, ?, ?, ?, 0, 0, 0)",
                 (user_id, group_id, topic_id, username, first_name)
             )
 
+        stages.mark("ensure_user")
         # Step 9: Process contribution
         request = {
             "type": "contribution",
@@ -520,7 +515,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     request["current_total"] = current_topic_total_before_contribution + displayed_amount
                     request["khatm_type_display"] = "قرآن"
 
-            logger.info("Quran khatm request update: to_store_topic_current_verse_id=%d, completed=%s, displayed_amount=%d, user_amount=%d",
+            logger.debug("Quran khatm request update: to_store_topic_current_verse_id=%d, completed=%s, displayed_amount=%d, user_amount=%d",
                         topic_verse_id_for_db_update, is_quran_khatm_completed, displayed_amount, number)
         else: 
             if number < 0:
@@ -542,8 +537,12 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                         request["khatm_type_display"] = "صلوات" if topic["khatm_type"] == "salavat" else "ذکر"
             request["displayed_amount"] = number
 
+        stages.mark("build_request")
         await write_queue.put(request)
-        logger.info("Queued contribution: %s", request)
+        stages.mark("enqueue")
+        # نه کل request: شامل شیء bot هم می‌شود
+        logger.debug("Queued contribution: group_id=%s, topic_id=%s, user_id=%s, amount=%s, completed=%s",
+                     group_id, topic_id, user_id, number, request["completed"])
         # --- شروع کدهای جدید برای ادعیه ---
         if topic["khatm_type"] == "doa":
             # 1. خواندن اطلاعات دعا (لینک و نام)
@@ -577,10 +576,12 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 response_text, 
                 parse_mode=ParseMode.HTML
             )
+            stages.mark("reply")
             return
     # --- پایان کدهای جدید ---
 
         sepas_text = await get_random_sepas(group_id)
+        stages.mark("sepas")
         
         verses_for_display = []
         if topic["khatm_type"] == "ghoran":
@@ -595,7 +596,9 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
             else:
                 num_verses_to_fetch_for_display = min(displayed_amount, group["max_display_verses"])
 
-            logger.debug(f"Verse display pre-fetch: topic_id={topic_id}, group_id={group_id}, current_verse_id_for_display_fetch={current_verse_id_for_display_fetch}, num_verses_to_fetch_for_display={num_verses_to_fetch_for_display}, user_input_number={displayed_amount}, group_max_display={group['max_display_verses']}")
+            logger.debug("Verse display pre-fetch: topic_id=%s, group_id=%s, from_verse_id=%s, count=%s, user_input_number=%s, group_max_display=%s",
+                         topic_id, group_id, current_verse_id_for_display_fetch, num_verses_to_fetch_for_display,
+                         displayed_amount, group["max_display_verses"])
 
             for i in range(num_verses_to_fetch_for_display):
                 verse = quran.get_verse_by_id(current_verse_id_for_display_fetch + i)
@@ -606,6 +609,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                     break
             logger.debug("Retrieved %d verses for display list", len(verses_for_display))
         
+        stages.mark("verses")
         new_total_for_display = current_topic_total_before_contribution
         if topic["khatm_type"] == "ghoran":
             new_total_for_display += displayed_amount
@@ -623,6 +627,7 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
             max_display_verses=group["max_display_verses"],
             completion_count=topic["completion_count"]
         )
+        stages.mark("format_message")
         logger.debug("Formatted khatm message for user - expecting tuple now")
 
         messages_to_send: List[str]
@@ -653,7 +658,8 @@ async def handle_khatm_message(update: Update, context: ContextTypes.DEFAULT_TYP
                 if idx < len(messages_to_send) - 1:
                     await asyncio.sleep(0.5)
             
-            logger.info("Sent contribution confirmation message: group_id=%s, topic_id=%s, user=%s", 
+            stages.mark("reply")
+            logger.debug("Sent contribution confirmation message: group_id=%s, topic_id=%s, user=%s", 
                       group_id, topic_id, username)
         except TimedOut:
             logger.warning(
@@ -791,16 +797,13 @@ async def subtract_khatm(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
             # ب) ذخیره اطلاعات در حافظه (amount را منفی ذخیره می‌کنیم)
             user_msg_id = update.message.message_id
-            if 'pending_doa' not in context.chat_data:
-                context.chat_data['pending_doa'] = {}
-                
-            context.chat_data['pending_doa'][user_msg_id] = {
+            await pending_doa.put(update.effective_chat.id, user_msg_id, {
                 "user_id": update.effective_user.id,
                 "amount": -number,  # <--- نکته کلیدی: عدد منفی ذخیره می‌شود
                 "username": update.effective_user.username,
                 "first_name": update.effective_user.first_name,
                 "is_subtraction": True # برای اطمینان بیشتر
-            }
+            })
 
             # ج) ساخت دکمه‌های شیشه‌ای (دو ستونه: زیارت | دعا)
             ziyarats = [i for i in items if i['category'] == 'ziyarat']
@@ -1197,10 +1200,11 @@ async def handle_zekr_selection(update: Update, context: ContextTypes.DEFAULT_TY
         action = parts[1] # sel یا cancel
         user_msg_id = int(parts[2])
         
-        logger.info("Processing zekr selection: action=%s, user_msg_id=%s, user_id=%s", action, user_msg_id, user_id)
+        logger.debug("Processing zekr selection: action=%s, user_msg_id=%s, user_id=%s", action, user_msg_id, user_id)
 
         # بازیابی اطلاعات موقت
-        pending_data = context.chat_data.get('pending_zekr', {}).get(user_msg_id)
+        chat_id = query.message.chat.id
+        pending_data = pending_zekr.get(chat_id, user_msg_id)
 
         if not pending_data:
             try:
@@ -1216,8 +1220,7 @@ async def handle_zekr_selection(update: Update, context: ContextTypes.DEFAULT_TY
 
         if action == "cancel":
             # حذف اطلاعات موقت و پیام
-            if 'pending_zekr' in context.chat_data and user_msg_id in context.chat_data['pending_zekr']:
-                del context.chat_data['pending_zekr'][user_msg_id]
+            await pending_zekr.pop(chat_id, user_msg_id)
             await query.message.delete()
             return
 
@@ -1246,11 +1249,10 @@ async def handle_zekr_selection(update: Update, context: ContextTypes.DEFAULT_TY
             }
 
             await write_queue.put(request)
-            logger.info("Queued zekr contribution: user_id=%s, zekr_id=%s, amount=%s", user_id, zekr_id, amount)
+            logger.debug("Queued zekr contribution: user_id=%s, zekr_id=%s, amount=%s", user_id, zekr_id, amount)
 
             # پاکسازی
-            if 'pending_zekr' in context.chat_data and user_msg_id in context.chat_data['pending_zekr']:
-                del context.chat_data['pending_zekr'][user_msg_id]
+            await pending_zekr.pop(chat_id, user_msg_id)
             
             # حذف پیام دکمه‌ها
             await query.message.delete()
@@ -1285,9 +1287,9 @@ async def handle_doa_selection(update: Update, context: ContextTypes.DEFAULT_TYP
     msg_id = int(parts[2])
     
     # --- حالت لغو ---
+    chat_id = query.message.chat.id
     if action == 'cancel':
-        if 'pending_doa' in context.chat_data:
-            context.chat_data['pending_doa'].pop(msg_id, None)
+        await pending_doa.pop(chat_id, msg_id)
         await query.message.delete()
         return
 
@@ -1296,7 +1298,7 @@ async def handle_doa_selection(update: Update, context: ContextTypes.DEFAULT_TYP
         return
     item_id = int(parts[3])
     
-    pending_data = context.chat_data.get('pending_doa', {}).get(msg_id)
+    pending_data = pending_doa.get(chat_id, msg_id)
     
     if not pending_data:
         try:
@@ -1367,4 +1369,4 @@ async def handle_doa_selection(update: Update, context: ContextTypes.DEFAULT_TYP
         disable_web_page_preview=True
     )
     
-    context.chat_data['pending_doa'].pop(msg_id, None)
\ No newline at end of file
+    await pending_doa.pop(chat_id, msg_id)
\ No newline at end of file
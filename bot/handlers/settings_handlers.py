@@ -9,6 +9,7 @@ from telegram.error import BadRequest, Forbidden, TimedOut
 from bot.database.db import fetch_one, fetch_all, execute, write_queue
 from bot.utils.helpers import parse_number, schedule_message_deletion, reply_text_and_schedule_deletion, send_message_and_schedule_deletion, ignore_old_messages
 from bot.handlers.admin_handlers import is_admin
+from bot.utils.broadcast import broadcast
 import asyncio
 
 logger = logging.getLogger(__name__)
@@ -587,53 +588,31 @@ async def reset_off(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error("Error in reset_off: %s, group_id=%s", e, group_id)
         await update.message.reply_text("خطایی رخ داد. لطفاً دوباره تلاش کنید.")
 
+# تعداد گروه‌های هر درخواست reset_daily_groups و فاصله گذاشتن درخواست‌ها در صف (یک دور
+# process_queue_periodically) تا نوشتن‌های دیگر بین دسته‌ها انجام شوند
+DAILY_RESET_CHUNK_SIZE = 500
+DAILY_RESET_CHUNK_DELAY = 1.0
+
 async def reset_daily_groups(context: ContextTypes.DEFAULT_TYPE):
     """Reset contributions for groups with daily reset enabled."""
     try:
-        groups = await fetch_all("SELECT group_id FROM groups WHERE reset_daily = 1")
+        groups = await fetch_all("SELECT group_id FROM groups WHERE reset_daily = 1 AND is_active = 1 ORDER BY group_id")
         if not groups:
             logger.debug("No groups with daily reset enabled")
             return
 
-        for group_row in groups:
-            group_id = group_row["group_id"]
-            try:
-                group = await fetch_one("SELECT is_active FROM groups WHERE group_id = ?", (group_id,))
-                if not group or not group["is_active"]:
-                    logger.debug("Group not found or inactive during reset: group_id=%s", group_id)
-                    continue
-
-                topics = await fetch_all(
-                    "SELECT topic_id, khatm_type FROM topics WHERE group_id = ?",
-                    (group_id,)
-                )
-                for topic in topics:
-                    topic_id = topic["topic_id"]
-                    request = {
-                        "type": "reset_daily_group",
-                        "group_id": group_id,
-                        "topic_id": topic_id,
-                        "khatm_type": topic["khatm_type"]
-                    }
-                    await write_queue.put(request)
-                    logger.debug("Queued daily reset: group_id=%s, topic_id=%s", group_id, topic_id)
-
-                for attempt in range(2):
-                    try:
-                        await context.bot.send_message(
-                            chat_id=group_id,
-                            text="آمار روزانه گروه صفر شد."
-                        )
-                        logger.info("Daily reset completed and message sent: group_id=%s", group_id)
-                        break
-                    except (BadRequest, Forbidden, TimedOut) as e:
-                        if attempt == 0 and isinstance(e, TimedOut):
-                            await asyncio.sleep(2)
-                        else:
-                            logger.error("Failed to send reset message to group_id=%s: %s", group_id, e)
+        group_ids = [row["group_id"] for row in groups]
+        for start in range(0, len(group_ids), DAILY_RESET_CHUNK_SIZE):
+            if start:
+                await asyncio.sleep(DAILY_RESET_CHUNK_DELAY)
+            await write_queue.put({
+                "type": "reset_daily_groups",
+                "group_ids": group_ids[start:start + DAILY_RESET_CHUNK_SIZE],
+            })
+        logger.info("Queued daily reset: groups=%s, chunks=%s",
+                    len(group_ids), (len(group_ids) + DAILY_RESET_CHUNK_SIZE - 1) // DAILY_RESET_CHUNK_SIZE)
 
-            except Exception as e:
-                logger.error("Error resetting group_id=%s: %s", group_id, e)
+        await broadcast(context.bot, group_ids, "آمار روزانه گروه صفر شد.", name="daily_reset")
 
     except Exception as e:
         logger.error("Error in reset_daily_groups: %s", e)
@@ -95,15 +95,22 @@ async def show_total_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("خطا در دسترسی به آیات. دوباره تلاش کنید.")
                 return
 
-            verses = await fetch_all(
+            # آیات دوره فعلی: ردیف‌های جدول اصلی به‌علاوه ردیف‌های فشرده‌شده در contribution_daily
+            verses = await fetch_one(
                 """
-                SELECT verse_id 
-                FROM contributions 
-                WHERE group_id = ? AND topic_id = ?
+                SELECT
+                    (SELECT COUNT(verse_id) FROM contributions c
+                     WHERE c.group_id = t.group_id AND c.topic_id = t.topic_id
+                       AND c.reset_epoch = t.reset_epoch)
+                  + (SELECT COALESCE(SUM(verse_count), 0) FROM contribution_daily d
+                     WHERE d.group_id = t.group_id AND d.topic_id = t.topic_id
+                       AND d.reset_epoch = t.reset_epoch) AS count
+                FROM topics t
+                WHERE t.group_id = ? AND t.topic_id = ?
                 """,
                 (group_id, topic_id)
             )
-            total_verses = len(verses)
+            total_verses = verses["count"] if verses else 0
             message = (
                 f"<b>آمار ختم {khatm_type_persian}</b>🌱\n"
                 f"➖➖➖➖➖➖➖➖➖➖➖\n"
@@ -1,23 +1,16 @@
 import asyncio
+import json
 import logging
 import time
 from datetime import datetime, timedelta
-from telegram import Update, ChatMember, User
+from typing import AsyncIterator, Dict, Optional, Tuple
+from telegram import Update, ChatMember
 from telegram.ext import ContextTypes, CommandHandler
 from telegram.error import TelegramError
 from telegram.constants import ParseMode
-from bot.database.members_db import fetch_all
-from bot.utils.constants import MAIN_GROUP_ID
-
-# تنظیم لاگ‌گذاری
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('tag_bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+from bot.database.db import fetch_all, fetch_one, write_queue
+from bot.database.members_db import member_registry
+
 logger = logging.getLogger(__name__)
 
 # تنظیمات
@@ -25,6 +18,17 @@ TAG_COOLDOWN_HOURS = 1  # کول‌داون 1 ساعته
 USERS_PER_MESSAGE = 100  # حداکثر 100 کاربر در هر پیام
 TAG_MESSAGE_DELAY = 0.2  # تأخیر 1.5 ثانیه بین پیام‌ها
 MAX_MESSAGE_LENGTH = 4096  # حداکثر طول پیام تلگرام
+TAG_HEADER = "شما برای دیدن محتوای ریپلای شده تگ شده اید لطفا این را ببینید 👆\n➖➖➖➖➖➖➖➖➖➖\n"
+TAG_SEPARATOR = " • "
+
+# جدول ترجمه از پیش ساخته‌شده برای escape کاراکترهای ویژه MarkdownV2
+MARKDOWN_V2_ESCAPE = str.maketrans({char: f"\\{char}" for char in "\\_*[]()~`>#+-=|{}.!"})
+
+# (user_id, username, first_name)
+TagTarget = Tuple[int, Optional[str], Optional[str]]
+
+# عملیات /tag در حال اجرا به ازای هر گروه؛ پیشرفت آن‌ها در جدول tag_jobs ذخیره می‌شود
+_running_tags: Dict[int, "TagManager"] = {}
 
 class TagManager:
     def __init__(self, context):
@@ -32,11 +36,11 @@ class TagManager:
         self.is_cancelled = False
 
     async def tag_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle /tag command to tag group members, using members.sqlite for main group and API for others."""
-        start_time = time.time()
+        """Handle /tag command to tag group members from the member registry (API fallback for unknown groups)."""
         chat = update.effective_chat
         user = update.effective_user
         message_thread_id = update.message.message_thread_id if getattr(chat, 'is_forum', False) else None
+        reply_to_target_message_id = None
         if update.message.reply_to_message:
             reply_to_target_message_id = update.message.reply_to_message.message_id
             logger.info(
@@ -77,7 +81,7 @@ class TagManager:
 
         # بررسی کول‌داون
         try:
-            if not await self._check_cooldown(chat.id, context):
+            if not await self._check_cooldown(chat.id):
                 logger.warning("Cooldown active for group %s", chat.id)
                 await self._safe_send_message(
                     update.message, f"لطفاً {TAG_COOLDOWN_HOURS} ساعت صبر کنید تا دوباره از این دستور استفاده کنید.", message_thread_id
@@ -90,60 +94,106 @@ class TagManager:
             )
             return
 
-        context.chat_data["tag_task"] = self
-        
+        if chat.id in _running_tags:
+            logger.warning("Tag operation already running in chat %s", chat.id)
+            await self._safe_send_message(
+                update.message, "یک عملیات تگ در این گروه در حال اجراست.", message_thread_id
+            )
+            return
+
+        job = {
+            "group_id": chat.id,
+            "message_thread_id": message_thread_id,
+            "reply_to_message_id": reply_to_target_message_id,
+            "last_user_id": 0,
+            "sent_message_ids": [],
+            "started_at": datetime.utcnow().isoformat(),
+        }
+        # عملیات تگ در پس‌زمینه اجرا می‌شود تا هندلر زود برگردد و /cancel_tag پشت آن صف نکشد؛
+        # ثبت در _running_tags همین‌جا انجام می‌شود تا /tag دوم قبل از شروع تسک رد شود
+        _running_tags[chat.id] = self
+        context.application.create_task(
+            self._run_tag_command(job, update.message, message_thread_id), update=update
+        )
+
+    async def _run_tag_command(self, job, message, message_thread_id) -> None:
+        chat_id = job["group_id"]
         try:
-            logger.debug("Starting tag operation for chat %s", chat.id)
-            members = await self._fetch_members(chat.id)
-            if not members:
-                logger.warning("No members to tag in chat %s", chat.id)
+            chunks = await self.run_job(job)
+            if chunks == 0:
+                logger.warning("No members to tag in chat %s", chat_id)
                 await self._safe_send_message(
-                    update.message, "هیچ عضوی برای تگ کردن یافت نشد...", message_thread_id
+                    message, "هیچ عضوی برای تگ کردن یافت نشد...", message_thread_id
                 )
-                return
-                
-            messages = self._prepare_messages(members)
-            sent_messages = 0
-            
-            for i, message_text in enumerate(messages):
+        except Exception as e:
+            logger.error("Error during tagging in chat %s: %s", chat_id, e, exc_info=True)
+            await self._safe_send_message(
+                message, "خطایی در عملیات تگ رخ داد.", message_thread_id
+            )
+        finally:
+            if _running_tags.get(chat_id) is self:
+                del _running_tags[chat_id]
+
+    async def run_job(self, job) -> Optional[int]:
+        """
+        Send the tag messages of a job, starting after job["last_user_id"].
+        Progress is persisted in tag_jobs after every message; returns the number of
+        messages built, or None if the job was cancelled.
+        """
+        chat_id = job["group_id"]
+        resumed = job["last_user_id"] > 0
+        start_time = time.time()
+        chunks = 0
+        sent_messages = 0
+        _running_tags[chat_id] = self
+        try:
+            logger.debug("Starting tag operation for chat %s (resumed: %s)", chat_id, resumed)
+            # اعضا از دیتابیس استریم می‌شوند و هر پیام فقط وقتی ساخته می‌شود که نوبت ارسالش برسد
+            members = self._iter_members(chat_id, after_user_id=job["last_user_id"])
+            async for last_user_id, message_text in self._iter_messages(members):
                 if self.is_cancelled:
-                    logger.info("Tag operation cancelled during message %d in chat %s", i, chat.id)
-                    return
-                    
+                    break
+                chunks += 1
                 try:
-                    header = f"شما برای دیدن محتوای ریپلای شده تگ شده اید لطفا این را ببینید 👆\n➖➖➖➖➖➖➖➖➖➖\n" #
-                    full_message = header + message_text #
-                    
                     send_params = {
-                        'chat_id': chat.id, #
-                        'text': full_message, #
+                        'chat_id': chat_id, #
+                        'text': TAG_HEADER + message_text, #
                         'parse_mode': ParseMode.MARKDOWN_V2, #
                         'disable_web_page_preview': True #
                     }
-                    if reply_to_target_message_id:
-                        send_params['reply_to_message_id'] = reply_to_target_message_id
+                    if job["reply_to_message_id"]:
+                        send_params['reply_to_message_id'] = job["reply_to_message_id"]
                     # اگر به پیام خاصی ریپلای نمی‌شود و دستور در یک تاپیک بوده، تگ‌ها به آن تاپیک ارسال می‌شوند
-                    elif message_thread_id: 
-                        send_params['message_thread_id'] = message_thread_id #
-                    
-                    await context.bot.send_message(**send_params) #
+                    elif job["message_thread_id"]:
+                        send_params['message_thread_id'] = job["message_thread_id"] #
+
+                    sent = await self.context.bot.send_message(**send_params) #
                     sent_messages += 1 #
-                    await asyncio.sleep(TAG_MESSAGE_DELAY) #
+                    job["sent_message_ids"].append(sent.message_id)
                 except Exception as e:
-                    logger.error("Error sending tag message %d: %s", i+1, str(e)) #
-            
-            context.chat_data["last_tag_time"] = datetime.utcnow().isoformat() #
-            logger.info("Tag operation completed for chat %s: sent %d messages in %.2f seconds", 
-                        chat.id, sent_messages, time.time() - start_time)
-                        
-        except Exception as e:
-            logger.error("Error during tagging in chat %s: %s", chat.id, e, exc_info=True)
-            await self._safe_send_message(
-                update.message, "خطایی در عملیات تگ رخ داد.", message_thread_id
-            )
+                    logger.error("Error sending tag message %d: %s", chunks, str(e)) #
+
+                # موقعیت حتی برای پیام ناموفق جلو می‌رود تا بعد از ری‌استارت دوباره ارسال نشود
+                job["last_user_id"] = last_user_id
+                if self.is_cancelled:
+                    break
+                await write_queue.put(dict(job, type="save_tag_job", sent_message_ids=list(job["sent_message_ids"])))
+                await asyncio.sleep(TAG_MESSAGE_DELAY) #
+
+            if self.is_cancelled:
+                await write_queue.put({"type": "finish_tag_job", "group_id": chat_id, "completed": False})
+                logger.info("Tag operation cancelled after %d messages in chat %s", chunks, chat_id)
+                return None
+
+            # نبودن عضو کول‌داون را شروع نمی‌کند؛ عملیات ادامه‌داده‌شده همیشه کامل حساب می‌شود
+            await write_queue.put({"type": "finish_tag_job", "group_id": chat_id, "completed": chunks > 0 or resumed})
+            logger.info("Tag operation completed for chat %s: sent %d messages in %.2f seconds",
+                        chat_id, sent_messages, time.time() - start_time)
+            return chunks
         finally:
-            context.chat_data.pop("tag_task", None)
-            logger.debug("Cleaned up tag_task from chat_data for chat %s", chat.id)
+            if _running_tags.get(chat_id) is self:
+                del _running_tags[chat_id]
+            logger.debug("Cleaned up running tag job for chat %s", chat_id)
 
     async def cancel_tag(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle /cancel_tag command to stop tagging."""
@@ -167,15 +217,16 @@ class TagManager:
             )
             return
 
-        if "tag_task" not in context.chat_data:
+        running_task = _running_tags.get(chat.id)
+        if running_task is None:
             logger.debug("No active tag task to cancel in chat %s", chat.id)
             await self._safe_send_message(
                 update.message, "هیچ عملیات تگی در حال اجرا نیست.", message_thread_id
             )
             return
 
-        self.is_cancelled = True
-        context.chat_data.pop("tag_task", None)
+        # پرچم روی TagManager در حال اجرا تنظیم می‌شود و بین دو پیام بررسی می‌شود
+        running_task.is_cancelled = True
         logger.info("Tag operation cancelled for chat %s", chat.id)
         await self._safe_send_message(
             update.message, "عملیات تگ متوقف شد.", message_thread_id
@@ -197,12 +248,12 @@ class TagManager:
                          chat_id, user_id, e, exc_info=True)
             raise
 
-    async def _check_cooldown(self, chat_id, context):
-        """Check if tagging cooldown has expired."""
+    async def _check_cooldown(self, chat_id):
+        """Check if tagging cooldown (tag_timestamps) has expired."""
         try:
-            last_tag_time = context.chat_data.get("last_tag_time")
-            if last_tag_time:
-                last_tag_time = datetime.fromisoformat(last_tag_time)
+            row = await fetch_one("SELECT last_tag_time FROM tag_timestamps WHERE group_id = ?", (chat_id,))
+            if row:
+                last_tag_time = datetime.fromisoformat(row["last_tag_time"])
                 cooldown_end = last_tag_time + timedelta(hours=TAG_COOLDOWN_HOURS)
                 is_cooldown_expired = datetime.utcnow() >= cooldown_end
                 logger.debug("Cooldown check for chat %s: last_tag=%s, cooldown_end=%s, expired=%s", 
@@ -214,97 +265,66 @@ class TagManager:
             logger.error("Error checking cooldown for chat %s: %s", chat_id, e, exc_info=True)
             raise
 
-    async def _fetch_members(self, chat_id):
-        """Fetch active members from members.sqlite for main group, or from Telegram API for other groups."""
-        members = []
+    async def _iter_members(self, chat_id, after_user_id: int = 0) -> AsyncIterator[TagTarget]:
+        """
+        Stream active members (ordered by user_id, after after_user_id) from the member registry,
+        or from Telegram API for groups it does not know yet.
+        """
+        found = 0
         try:
-            if chat_id == MAIN_GROUP_ID:
-                # برای گروه اصلی از members.sqlite استفاده می‌کنیم
-                logger.info(f"Fetching active users from members.sqlite for main group_id: {chat_id}")
-                db_users = await fetch_all(
-                    """
-                        SELECT user_id, username, first_name, last_name
-                        FROM members
-                        WHERE is_deleted = 0 AND is_bot = 0
-                    """,
-                    ()
-                )
-                
-                for user_data in db_users:
-                    user_id = user_data["user_id"]
-                    username = user_data["username"]
-                    first_name = user_data["first_name"] or "User"
-                    last_name = user_data["last_name"]
-                    user = User(
-                        id=user_id,
-                        first_name=first_name,
-                        last_name=last_name,
-                        is_bot=False,
-                        username=username
-                    )
-                    members.append(user)
-                    logger.debug(f"Added user {user_id} ({username or first_name}) from members.sqlite to tag list")
-                
-                logger.info(f"Total {len(members)} active members found for tagging in main group {chat_id}")
-            else:
-                # برای گروه‌های دیگر از API تلگرام استفاده می‌کنیم
-                logger.info(f"Fetching members from Telegram API for group_id: {chat_id}")
-                try:
-                    async for member in self.context.bot.get_chat_members(chat_id):
-                        if not member.user.is_bot:
-                            members.append(member.user)
-                            logger.debug(f"Added user {member.user.id} ({member.user.username or member.user.first_name}) from API to tag list")
-                except TelegramError as e:
-                    logger.error(f"Telegram API error fetching members for group {chat_id}: {e}", exc_info=True)
-                    return []
-                
-                logger.info(f"Total {len(members)} members found for tagging in group {chat_id}")
-            
-            return members
-            
+            # رجیستری اعضا (members.sqlite) برای همه گروه‌ها
+            logger.info("Streaming active users from member registry for group_id: %s", chat_id)
+            async for row in member_registry.iter_active_members(chat_id, after_user_id=after_user_id):
+                found += 1
+                yield row["user_id"], row["username"], row["first_name"]
         except Exception as e:
-            logger.error(f"Failed to fetch members for group {chat_id}: {e}", exc_info=True)
-            return []
-
-    def _prepare_messages(self, members):
-        """Prepare messages with user tags, up to 100 users per message, with optimized formatting."""
-        messages = []
-        current_message = ""
-        separator = " • "
-
-        for i, user in enumerate(members):  # بدون محدودیت، برای پشتیبانی از 1300 نفر
-            tag = self._format_tag(user)
-            if len(current_message) + len(tag) + len(separator) > MAX_MESSAGE_LENGTH - 50:  # 50 کاراکتر برای هدر
-                messages.append(current_message.rstrip(separator))
-                current_message = ""
-                logger.debug("Split message at index %d due to length limit", i)
-            if i % USERS_PER_MESSAGE == 0 and i != 0:
-                messages.append(current_message.rstrip(separator))
-                current_message = ""
-                logger.debug("Split message at index %d due to user limit (%d)", i, USERS_PER_MESSAGE)
-            current_message += tag + separator
-
-        if current_message:
-            messages.append(current_message.rstrip(separator))
-
-        logger.debug("Prepared %d messages with %d total tags", len(messages), len(members))
-        return messages
-
-    def _format_tag(self, user):
-        """Format user tag for MarkdownV2, escaping special characters."""
+            logger.error("Failed to fetch members for group %s: %s", chat_id, e, exc_info=True)
+            return
+
+        if found or after_user_id:
+            # ترتیب اعضای API ثابت نیست، پس ادامه عملیات فقط از رجیستری ممکن است
+            logger.info("Total %s active members streamed for tagging in group %s", found, chat_id)
+            return
+
+        # گروهی که هنوز عضوی از آن ثبت نشده: از API تلگرام استفاده می‌کنیم
+        logger.info("Fetching members from Telegram API for group_id: %s", chat_id)
         try:
-            name = user.first_name or str(user.id)
-            if user.username:
-                name = user.username
-            special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-            for char in special_chars:
-                name = name.replace(char, f"\\{char}")
-            tag = f"[{name}](tg://user?id={user.id})"
-            logger.debug("Formatted tag for user %s: %s", user.id, tag)
-            return tag
+            async for member in self.context.bot.get_chat_members(chat_id):
+                if not member.user.is_bot:
+                    found += 1
+                    yield member.user.id, member.user.username, member.user.first_name
         except Exception as e:
-            logger.error("Error formatting tag for user %s: %s", user.id, e, exc_info=True)
-            return f"[User\\_{user.id}](tg://user?id={user.id})"
+            logger.error("Telegram API error fetching members for group %s: %s", chat_id, e, exc_info=True)
+            return
+        logger.info("Total %s members found for tagging in group %s", found, chat_id)
+
+    async def _iter_messages(self, members: AsyncIterator[TagTarget]) -> AsyncIterator[Tuple[int, str]]:
+        """
+        Lazily build tag messages, up to USERS_PER_MESSAGE users and MAX_MESSAGE_LENGTH characters each.
+        Yields (user_id of the last tagged member, message text).
+        """
+        tags = []
+        length = 0
+        last_user_id = 0
+        limit = MAX_MESSAGE_LENGTH - len(TAG_HEADER)
+        async for user_id, username, first_name in members:
+            tag = self._format_tag(user_id, username, first_name)
+            added = len(tag) + (len(TAG_SEPARATOR) if tags else 0)
+            if tags and (len(tags) >= USERS_PER_MESSAGE or length + added > limit):
+                yield last_user_id, TAG_SEPARATOR.join(tags)
+                tags, length = [], 0
+                added = len(tag)
+            tags.append(tag)
+            length += added
+            last_user_id = user_id
+        if tags:
+            yield last_user_id, TAG_SEPARATOR.join(tags)
+
+    @staticmethod
+    def _format_tag(user_id, username=None, first_name=None):
+        """Format user tag for MarkdownV2, escaping special characters."""
+        name = (username or first_name or str(user_id)).translate(MARKDOWN_V2_ESCAPE)
+        return f"[{name}](tg://user?id={user_id})"
 
     async def _safe_send_message(self, message, text, message_thread_id=None, parse_mode=None):
         """Safely send a message with error handling."""
@@ -335,6 +355,27 @@ class TagManager:
                 except Exception as e2:
                     logger.error("Failed to send error message: %s", e2)
 
+async def _resume_job(application, job) -> None:
+    try:
+        await TagManager(application).run_job(job)
+    except Exception as e:
+        logger.error("Error resuming tag job for chat %s: %s", job["group_id"], e, exc_info=True)
+
+async def resume_tag_jobs(application) -> int:
+    """Resume /tag jobs interrupted by a restart from their persisted position in tag_jobs."""
+    rows = await fetch_all(
+        """
+        SELECT group_id, message_thread_id, reply_to_message_id, last_user_id, sent_message_ids, started_at
+        FROM tag_jobs
+        """
+    )
+    for row in rows:
+        job = dict(row, sent_message_ids=json.loads(row["sent_message_ids"] or "[]"))
+        logger.info("Resuming tag job for chat %s after user %s (%d messages already sent)",
+                    job["group_id"], job["last_user_id"], len(job["sent_message_ids"]))
+        application.create_task(_resume_job(application, job))
+    return len(rows)
+
 def setup_handlers():
     """Set up tag command handlers."""
     logger.info("Setting up command handlers")
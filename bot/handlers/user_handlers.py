@@ -2,7 +2,7 @@ import logging
 from telegram import Update, ChatMemberUpdated
 from telegram.ext import ContextTypes
 from telegram.constants import ChatMemberStatus
-from bot.utils.user_store import UserStore
+from bot.database.members_db import member_registry
 
 logger = logging.getLogger(__name__)
 
@@ -16,23 +16,14 @@ async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     # اگر کاربر جدید عضو شده است
     if chat_member.new_chat_member.status == ChatMemberStatus.MEMBER:
         try:
-            user_store = UserStore()
             user = chat_member.new_chat_member.user
             chat_id = update.effective_chat.id
             
             # ذخیره اطلاعات کاربر جدید
-            result = user_store.add_user(
-                chat_id=chat_id,
-                user_id=user.id,
-                username=user.username,
-                first_name=user.first_name,
-                last_name=user.last_name
-            )
+            result = member_registry.add_user(chat_id, user)
             
             if result:
-                logger.info(f"New user {user.id} joined and saved to database for chat {chat_id}")
-            else:
-                logger.error(f"Failed to save new user {user.id} to database for chat {chat_id}")
+                logger.info("New user %s joined and queued for saving in chat %s", user.id, chat_id)
                 
         except Exception as e:
             logger.error(f"Error processing chat member update: {e}", exc_info=True)
@@ -51,23 +42,22 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if update.effective_chat.type == "private":
             return
             
-        user_store = UserStore()
-        
-        # ذخیره اطلاعات کاربر
-        result = user_store.add_user(
-            chat_id=chat_id,
-            user_id=user.id,
-            username=user.username,
-            first_name=user.first_name,
-            last_name=user.last_name
-        )
+        # ذخیره اطلاعات کاربر در رجیستری اعضا
+        result = member_registry.add_user(chat_id, user)
         
         if result:
-            logger.debug(f"User {user.id} saved/updated in database for chat {chat_id}")
+            logger.debug("User %s queued for saving in chat %s", user.id, chat_id)
             
     except Exception as e:
         logger.error(f"Error saving user info from message: {e}", exc_info=True)
 
+async def flush_member_registry(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """جاب دوره‌ای: نوشتن بافر رجیستری اعضا در دیتابیس."""
+    try:
+        await member_registry.flush()
+    except Exception as e:
+        logger.error("Error flushing member registry: %s", e, exc_info=True)
+
 def setup_handlers():
     """هندلرهای مرتبط با مدیریت کاربران را برمی‌گرداند."""
     # این هندلرها در main.py استفاده می‌شوند
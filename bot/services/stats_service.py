@@ -1,11 +1,9 @@
 import logging
-from bot.database.db import fetch_one, fetch_all
+from bot.database.db import fetch_one, fetch_all, fetch_user_verse_ids
 from bot.utils.quran import QuranManager
 
 logger = logging.getLogger(__name__)
 
-quran = QuranManager()
-
 async def get_group_stats(group_id, topic_id):
     try:
         result = await fetch_one(
@@ -45,21 +43,15 @@ async def get_ranking(group_id, topic_id):
         for user_data in rankings:
             user_data = dict(user_data)
             if user_data["total_ayat"] > 0:
-                verses = await fetch_all(
-                    """
-                    SELECT verse_id
-                    FROM contributions
-                    WHERE group_id = ? AND topic_id = ? AND user_id = ? AND verse_id IS NOT NULL
-                    """,
-                    (group_id, topic_id, user_data["user_id"])
-                )
+                quran = await QuranManager.get_instance()
+                verse_ids = await fetch_user_verse_ids(group_id, topic_id, user_data["user_id"])
                 user_data["verses"] = [
                     {
-                        "surah_name": quran.get_verse_by_id(row["verse_id"])["surah_name"],
-                        "ayah_number": quran.get_verse_by_id(row["verse_id"])["ayah_number"],
-                        "text": quran.get_verse_by_id(row["verse_id"])["text"]
+                        "surah_name": quran.get_verse_by_id(verse_id)["surah_name"],
+                        "ayah_number": quran.get_verse_by_id(verse_id)["ayah_number"],
+                        "text": quran.get_verse_by_id(verse_id)["text"]
                     }
-                    for row in verses if quran.get_verse_by_id(row["verse_id"])
+                    for verse_id in verse_ids if quran.get_verse_by_id(verse_id)
                 ]
             else:
                 user_data["verses"] = []
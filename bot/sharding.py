@@ -0,0 +1,336 @@
+"""
+حالت شاردینگ: یک پروسه جلویی آپدیت‌ها را دریافت و بر اساس هش group_id بین N پروسه ورکر
+پخش می‌کند. هر ورکر main.run_shard_worker را با SHARD_INDEX خودش اجرا می‌کند، پس
+دیتابیس (<base>_shard<i>.db)، members.sqlite و write_queue خودش را دارد. آمار کلی و
+فهرست‌های داشبورد با fetch_all_shards از همه شاردها خوانده می‌شوند؛ نوشتن‌های داشبورد
+(بن، لینک دعوت) با run_on_group_shard / run_on_all_shards به ورکر صاحب داده فرستاده
+می‌شوند و تا رسیدن پاسخ آن ورکر (یا SHARD_COMMAND_TIMEOUT) منتظر می‌مانند.
+
+Usage:
+    # پروسه جلویی با webhook یا polling (طبق UPDATE_MODE) و ۴ ورکر
+    python -m bot.sharding --shards 4
+
+    # شبیه‌سازی محلی بدون شبکه: آپدیت‌های ساختگی + Bot API جعلی در ورکرها
+    python -m bot.sharding --shards 4 --simulate --updates 2000 --groups 40
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import signal
+import sys
+import time
+import uuid
+import zlib
+from typing import Dict, Iterator, List, Optional
+
+from bot.utils.fake_bot_api import FAKE_ADMIN_ID
+
+logger = logging.getLogger(__name__)
+
+# فیلدهایی از آپدیت که chat دارند
+CHAT_FIELDS = ("message", "edited_message", "channel_post", "my_chat_member", "chat_member", "chat_join_request")
+
+# پیام‌های inbox با این کلید آپدیت نیستند بلکه دستوری برای همان ورکر هستند (SHARD_COMMANDS)
+SHARD_COMMAND = "shard_command"
+# دستورهایی که بعد از اجرا رجیستری مسدودی‌های ورکر را دوباره بارگذاری می‌کنند
+BAN_COMMANDS = frozenset({"ban_group", "unban_group", "ban_user", "unban_user"})
+SHARD_COMMANDS = BAN_COMMANDS | {"set_group_invite_link", "remove_group_invite_link"}
+
+# حداکثر انتظار برای پاسخ ورکر صاحب شارد و فاصله بررسی صف پاسخ
+SHARD_COMMAND_TIMEOUT = 10.0
+SHARD_REPLY_POLL_INTERVAL = 0.02
+
+# inbox و صف پاسخ همه ورکرها، برای فرستادن دستور از یک ورکر به ورکر دیگر و گرفتن نتیجه آن
+_shard_inboxes: List = []
+_shard_replies: List = []
+# request_id های منتظر پاسخ -> پاسخ رسیده (None یعنی هنوز نرسیده)
+_pending_replies: Dict[str, Optional[Dict]] = {}
+
+
+class ShardCommandError(Exception):
+    """دستور روی شارد صاحب داده اجرا نشد یا پاسخ آن به موقع نرسید."""
+
+
+def shard_for(chat_id: int, shard_count: int) -> int:
+    """شارد ثابت یک چت؛ crc32 برخلاف hash() بین پروسه‌ها و اجراها یکسان است."""
+    return zlib.crc32(str(chat_id).encode("ascii")) % shard_count
+
+
+def update_chat_id(data: Dict) -> Optional[int]:
+    for field in CHAT_FIELDS:
+        if field in data:
+            return data[field]["chat"]["id"]
+    callback = data.get("callback_query")
+    if callback and callback.get("message"):
+        return callback["message"]["chat"]["id"]
+    return None
+
+
+def set_shard_inboxes(inboxes: List, replies: List) -> None:
+    _shard_inboxes[:] = inboxes
+    _shard_replies[:] = replies
+
+
+def reply_to_command(data: Dict, error: Optional[str] = None) -> None:
+    """نتیجه دستوری که از ورکر دیگری رسیده در صف پاسخ همان ورکر گذاشته می‌شود."""
+    if data.get("reply_to") is not None:
+        _shard_replies[data["reply_to"]].put({"request_id": data["request_id"], "error": error})
+
+
+def _collect_replies(reply_queue) -> None:
+    while True:
+        try:
+            reply = reply_queue.get_nowait()
+        except queue.Empty:
+            return
+        # پاسخ دیررس دستوری که منتظرش تمام شده دور ریخته می‌شود
+        if reply["request_id"] in _pending_replies:
+            _pending_replies[reply["request_id"]] = reply
+
+
+async def run_shard_command(command: str, args: List) -> None:
+    """اجرای یک دستور SHARD_COMMANDS روی دیتابیس همین پروسه."""
+    from bot.database import db
+    if command not in SHARD_COMMANDS:
+        raise ValueError(f"Unknown shard command: {command}")
+    await getattr(db, command)(*args)
+    if command in BAN_COMMANDS:
+        await db.load_ban_registry()
+
+
+async def run_on_shard(index: int, command: str, *args, timeout: float = SHARD_COMMAND_TIMEOUT) -> None:
+    """
+    command را روی شارد index اجرا می‌کند: مستقیم اگر همین پروسه صاحب شارد است (یا
+    شاردینگ فعال نیست)، وگرنه با گذاشتن دستور در inbox ورکر آن شارد و انتظار برای پاسخ
+    آن. خطای ورکر مقصد یا نرسیدن پاسخ در timeout ثانیه ShardCommandError می‌دهد.
+    """
+    from config.settings import SHARD_INDEX
+    if SHARD_INDEX is None or index == SHARD_INDEX or not _shard_inboxes:
+        await run_shard_command(command, list(args))
+        return
+    request_id = uuid.uuid4().hex
+    _pending_replies[request_id] = None
+    try:
+        _shard_inboxes[index].put({SHARD_COMMAND: command, "args": list(args),
+                                   "request_id": request_id, "reply_to": SHARD_INDEX})
+        deadline = time.monotonic() + timeout
+        # صف پاسخ با get_nowait خوانده می‌شود تا هیچ thread ای روی get() بلاک نماند
+        while _pending_replies[request_id] is None:
+            _collect_replies(_shard_replies[SHARD_INDEX])
+            if _pending_replies[request_id] is not None:
+                break
+            if time.monotonic() >= deadline:
+                raise ShardCommandError(f"{command} on shard {index} did not answer within {timeout:g}s")
+            await asyncio.sleep(SHARD_REPLY_POLL_INTERVAL)
+        reply = _pending_replies[request_id]
+    finally:
+        _pending_replies.pop(request_id, None)
+    if reply["error"] is not None:
+        raise ShardCommandError(f"{command} failed on shard {index}: {reply['error']}")
+    logger.info("Ran %s%s on shard %s", command, args, index)
+
+
+async def run_on_group_shard(group_id: int, command: str, *args) -> None:
+    """دستوری که داده‌اش مال یک گروه است روی شارد crc32(group_id) % SHARD_COUNT اجرا می‌شود."""
+    from config.settings import SHARD_COUNT, SHARD_INDEX
+    index = shard_for(group_id, SHARD_COUNT) if SHARD_INDEX is not None else 0
+    await run_on_shard(index, command, group_id, *args)
+
+
+async def run_on_all_shards(command: str, *args) -> None:
+    """دستوری مثل بن کاربر که باید در دیتابیس همه شاردها اعمال شود."""
+    from config.settings import SHARD_COUNT, SHARD_INDEX
+    for index in (range(SHARD_COUNT) if SHARD_INDEX is not None else (0,)):
+        await run_on_shard(index, command, *args)
+
+
+class ShardRouter:
+    """آپدیت‌ها (به صورت dict) را در inbox ورکر صاحب group_id می‌گذارد."""
+
+    def __init__(self, inboxes: List[multiprocessing.Queue], replies: Optional[List[multiprocessing.Queue]] = None):
+        self.inboxes = inboxes
+        # صف‌های پاسخ باید در پروسه جلویی زنده بمانند تا ورکرهای spawn شده بتوانند بازسازی‌شان کنند
+        self.replies = replies or []
+        self.routed = [0] * len(inboxes)
+
+    def route(self, data: Dict) -> int:
+        chat_id = update_chat_id(data)
+        # آپدیت‌های بدون چت (مثل inline query) به شارد صفر می‌روند
+        index = 0 if chat_id is None else shard_for(chat_id, len(self.inboxes))
+        self.inboxes[index].put(data)
+        self.routed[index] += 1
+        return index
+
+    def close(self) -> None:
+        for inbox in self.inboxes:
+            inbox.put(None)
+
+
+def _worker_entry(index: int, count: int, inboxes, replies, simulate: bool) -> None:
+    # تنظیمات هنگام import خوانده می‌شوند، پس محیط باید قبل از import main آماده باشد
+    os.environ["SHARD_INDEX"] = str(index)
+    os.environ["SHARD_COUNT"] = str(count)
+    if simulate:
+        os.environ["SHARD_SIMULATE"] = "1"
+    import main as bot_main
+    set_shard_inboxes(inboxes, replies)
+    asyncio.run(bot_main.run_shard_worker(inboxes[index]))
+
+
+def start_workers(count: int, simulate: bool):
+    context = multiprocessing.get_context("spawn")
+    inboxes = [context.Queue() for _ in range(count)]
+    replies = [context.Queue() for _ in range(count)]
+    processes = [
+        context.Process(target=_worker_entry, args=(index, count, inboxes, replies, simulate),
+                        name=f"shard-{index}", daemon=False)
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    return processes, ShardRouter(inboxes, replies)
+
+
+def stop_workers(processes, router: ShardRouter, timeout: float = 120) -> None:
+    router.close()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning("Shard worker %s did not stop in time, terminating", process.name)
+            process.terminate()
+
+
+def _command_update(update_id: int, chat: Dict, command: str, now: int) -> Dict:
+    admin = {"id": FAKE_ADMIN_ID, "is_bot": False, "first_name": "admin"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": now, "chat": chat, "from": admin, "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+def fake_updates(count: int, groups: int, users: int, seed: int = 0) -> Iterator[Dict]:
+    """
+    آپدیت‌های ساختگی: ابتدا /start و /khatm_salavat توسط ادمین جعلی در هر گروه، سپس
+    پیام‌های عددی (صلوات) و گاهی عضویت کاربر جدید.
+    """
+    rng = random.Random(seed)
+    group_ids = [-1001000000000 - i for i in range(groups)]
+    now = int(time.time())
+    update_ids = iter(range(1, sys.maxsize))
+    for group_id in group_ids:
+        chat = {"id": group_id, "type": "supergroup", "title": "fake group"}
+        yield _command_update(next(update_ids), chat, "/start", now)
+        yield _command_update(next(update_ids), chat, "/khatm_salavat", now)
+    for _ in range(count):
+        update_id = next(update_ids)
+        chat = {"id": rng.choice(group_ids), "type": "supergroup", "title": "fake group"}
+        user = {"id": 10_000 + rng.randrange(users), "is_bot": False, "first_name": "user"}
+        if rng.random() < 0.05:
+            yield {
+                "update_id": update_id,
+                "chat_member": {
+                    "chat": chat, "from": user, "date": now,
+                    "old_chat_member": {"status": "left", "user": user},
+                    "new_chat_member": {"status": "member", "user": user},
+                },
+            }
+            continue
+        yield {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id, "date": now, "chat": chat, "from": user,
+                "text": str(rng.randint(1, 50)),
+            },
+        }
+
+
+def run_simulation(args) -> int:
+    processes, router = start_workers(args.shards, simulate=True)
+    started = time.perf_counter()
+    total = 0
+    for data in fake_updates(args.updates, args.groups, args.users, args.seed):
+        router.route(data)
+        total += 1
+    stop_workers(processes, router)
+    elapsed = time.perf_counter() - started
+
+    print(f"{total} updates routed to {args.shards} shards and processed in {elapsed:.2f}s")
+    for index, routed in enumerate(router.routed):
+        print(f"  shard {index}: {routed} updates, exit code {processes[index].exitcode}")
+
+    # آمار کلی از دید یک پروسه شارد: خواندن از همه فایل‌های شارد
+    os.environ["SHARD_INDEX"] = "0"
+    os.environ["SHARD_COUNT"] = str(args.shards)
+    from bot.database.db import close_db_connection, get_global_stats
+
+    async def aggregate():
+        try:
+            return await get_global_stats()
+        finally:
+            await close_db_connection()
+
+    print("global stats:", asyncio.run(aggregate()))
+    return 0 if all(process.exitcode == 0 for process in processes) else 1
+
+
+async def _run_front(router: ShardRouter) -> None:
+    from telegram import Update
+    from telegram.ext import Application, TypeHandler
+    from config.settings import TELEGRAM_TOKEN
+    from main import start_updates
+
+    async def forward(update: Update, context) -> None:
+        router.route(update.to_dict())
+
+    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    app.add_handler(TypeHandler(Update, forward))
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await app.initialize()
+    await start_updates(app)
+    await app.start()
+    logger.info("Shard front started with %s workers", len(router.inboxes))
+    try:
+        await stop_event.wait()
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+
+
+def run_front(args) -> int:
+    processes, router = start_workers(args.shards, simulate=False)
+    try:
+        asyncio.run(_run_front(router))
+    finally:
+        stop_workers(processes, router)
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the bot as a front process plus N shard workers.")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("SHARD_COUNT", "2")))
+    parser.add_argument("--simulate", action="store_true", help="route fake updates, no network")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    return run_simulation(args) if args.simulate else run_front(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
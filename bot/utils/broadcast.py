@@ -0,0 +1,84 @@
+"""
+ارسال یک پیام به تعداد زیادی گروه با سقف نرخ (BROADCAST_RATE پیام در ثانیه).
+
+چند ارسال هم‌زمان انجام می‌شود ولی شروع آن‌ها با فاصله ثابت 1/rate است، پس تأخیر شبکه
+نرخ را پایین نمی‌آورد و از محدودیت سراسری تلگرام (حدود ۳۰ پیام در ثانیه) هم بالاتر نمی‌رود.
+با RetryAfter همه ارسال‌ها به اندازه retry_after متوقف می‌شوند و همان پیام دوباره فرستاده می‌شود.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional
+
+from telegram.error import RetryAfter, TelegramError, TimedOut
+
+from bot.utils.metrics import BROADCAST_MESSAGES
+from config.settings import BROADCAST_RATE
+
+logger = logging.getLogger(__name__)
+
+# ارسال‌های هم‌زمان و تعداد تلاش دوباره هر پیام بعد از TimedOut/RetryAfter
+BROADCAST_CONCURRENCY = 8
+MAX_ATTEMPTS = 3
+
+
+class RateLimiter:
+    """شروع فراخوانی‌ها با فاصله حداقل 1/rate ثانیه؛ pause همه را برای مدتی عقب می‌اندازد."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = max(self._next, loop.time()) + self.interval
+
+    def pause(self, seconds: float) -> None:
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+async def _send(bot, limiter: RateLimiter, name: str, chat_id: int, text: str) -> str:
+    for attempt in range(MAX_ATTEMPTS):
+        await limiter.wait()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return "sent"
+        except RetryAfter as e:
+            logger.warning("Broadcast %s hit flood control, pausing %s s", name, e.retry_after)
+            limiter.pause(e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds())
+        except TimedOut:
+            await asyncio.sleep(2)
+        except TelegramError as e:
+            # BadRequest، Forbidden، ChatMigrated، NetworkError و ...: فقط همین گروه ناموفق است
+            logger.error("Failed to send %s message to group_id=%s: %s", name, chat_id, e)
+            return "failed"
+        except Exception as e:
+            logger.error("Unexpected error sending %s message to group_id=%s: %s", name, chat_id, e, exc_info=True)
+            return "failed"
+    logger.error("Failed to send %s message to group_id=%s after %s attempts", name, chat_id, MAX_ATTEMPTS)
+    return "failed"
+
+
+async def broadcast(bot, chat_ids: Iterable[int], text: str, name: str,
+                    rate: Optional[float] = None) -> Dict[str, int]:
+    """
+    text را به همه chat_ids می‌فرستد و تعداد ارسال‌های موفق/ناموفق را برمی‌گرداند.
+    name برچسب متریک bot_broadcast_messages_total و لاگ‌هاست (مثلاً "daily_reset").
+    """
+    limiter = RateLimiter(BROADCAST_RATE if rate is None else rate)
+    pending = iter(chat_ids)
+    results = {"sent": 0, "failed": 0}
+
+    async def worker():
+        for chat_id in pending:
+            result = await _send(bot, limiter, name, chat_id, text)
+            results[result] += 1
+            BROADCAST_MESSAGES.inc(name=name, result=result)
+
+    await asyncio.gather(*(worker() for _ in range(BROADCAST_CONCURRENCY)))
+    logger.info("Broadcast %s finished: sent=%s, failed=%s", name, results["sent"], results["failed"])
+    return results
@@ -244,6 +244,7 @@ DEFAULT_MAX_NUMBER = 100000000000
 DAILY_HADITH_TIME = time(hour=8, minute=0)
 DAILY_RESET_TIME = time(hour=0, minute=0)
 DAILY_PERIOD_RESET_TIME = time(hour=0, minute=5)
+DAILY_COMPACTION_TIME = time(hour=3, minute=30)
 MIN_DELETE_MINUTES = 1
 MAX_DELETE_MINUTES = 1440
 HADITH_CLEAN_PATTERNS = [
@@ -0,0 +1,111 @@
+"""
+Bot API جعلی و بدون شبکه برای شبیه‌سازی و بنچمارک.
+
+FakeBotRequest به جای HTTPXRequest به ApplicationBuilder داده می‌شود و به متدهای پرکاربرد
+ربات (getMe، sendMessage، getChat، getChatMember، getChatMemberCount، لینک دعوت و ...) پاسخ ساختگی معتبر
+برمی‌گرداند؛ بقیه متدها True می‌گیرند. تعداد فراخوانی هر متد در calls شمرده می‌شود.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+FAKE_BOT_ID = 1
+# کاربری که در همه گروه‌های جعلی ادمین است
+FAKE_ADMIN_ID = 2
+FAKE_BOT_USER = {
+    "id": FAKE_BOT_ID,
+    "is_bot": True,
+    "first_name": "FakeBot",
+    "username": "fake_khatm_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": True,
+    "supports_inline_queries": False,
+}
+
+
+class FakeBotRequest(BaseRequest):
+    def __init__(self, latency: float = 0.0, admin_user_ids: Tuple[int, ...] = (FAKE_ADMIN_ID,),
+                 member_count: int = 50):
+        self.latency = latency
+        self.member_count = member_count
+        self.admin_user_ids = set(admin_user_ids)
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        result = self.respond(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+    def respond(self, api_method: str, params: Dict[str, Any]) -> Any:
+        chat_id = _int(params.get("chat_id"), 0)
+        if api_method == "getMe":
+            return FAKE_BOT_USER
+        if api_method in ("sendMessage", "editMessageText", "copyMessage", "forwardMessage"):
+            return self._message(chat_id, params)
+        if api_method == "getChat":
+            return {"id": chat_id, "type": "supergroup", "title": f"fake group {chat_id}",
+                    "accent_color_id": 0, "max_reaction_count": 11}
+        if api_method == "getChatMember":
+            user_id = _int(params.get("user_id"), 0)
+            user = {"id": user_id, "is_bot": user_id == FAKE_BOT_ID, "first_name": f"user{user_id}"}
+            if user_id in self.admin_user_ids or user_id == FAKE_BOT_ID:
+                return {"status": "creator", "user": user, "is_anonymous": False}
+            return {"status": "member", "user": user}
+        if api_method == "getChatAdministrators":
+            admins = [FAKE_BOT_USER] + [
+                {"id": user_id, "is_bot": False, "first_name": f"admin{user_id}"} for user_id in sorted(self.admin_user_ids)
+            ]
+            return [{"status": "creator", "user": user, "is_anonymous": False} for user in admins]
+        if api_method == "getChatMemberCount":
+            return self.member_count
+        if api_method == "exportChatInviteLink":
+            return f"https://t.me/+fake{abs(chat_id)}"
+        if api_method in ("createChatInviteLink", "getChatInviteLink", "editChatInviteLink"):
+            return {"invite_link": params.get("invite_link") or f"https://t.me/+fake{abs(chat_id)}",
+                    "creator": FAKE_BOT_USER, "creates_join_request": False,
+                    "is_primary": False, "is_revoked": False}
+        if api_method == "getUpdates":
+            return []
+        return True
+
+    def _message(self, chat_id: int, params: Dict[str, Any]) -> Dict[str, Any]:
+        message = {
+            "message_id": _int(params.get("message_id"), 0) or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup"},
+            "from": FAKE_BOT_USER,
+            "text": params.get("text", ""),
+        }
+        if params.get("message_thread_id"):
+            message["message_thread_id"] = _int(params["message_thread_id"], 0)
+            message["is_topic_message"] = True
+        return message
+
+
+def _int(value: Any, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
@@ -16,9 +16,6 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
-quran = QuranManager()
-
-    
 
 
 async def format_khatm_message(
@@ -68,11 +65,11 @@ async def format_khatm_message(
 
                 if arabic_audio_url:
                     parsed_url_info = parse_telegram_message_url(arabic_audio_url)
-                    logger.debug(f"آدرس صوت فارسی Parse شده '{arabic_audio_url}': نتیجه {parsed_url_info}")
+                    logger.debug("آدرس صوت فارسی Parse شده '%s': نتیجه %s", arabic_audio_url, parsed_url_info)
                     if parsed_url_info:
                         channel_id_or_username, msg_id = parsed_url_info
                         target_chat_id = f"@{channel_id_or_username}" if not channel_id_or_username.isdigit() else int(channel_id_or_username)
-                        logger.debug(f"آماده‌سازی ReplyParameters با chat_id='{target_chat_id}' و message_id={msg_id}") 
+                        logger.debug("آماده‌سازی ReplyParameters با chat_id='%s' و message_id=%s", target_chat_id, msg_id)
                         persian_audio_reply_params = ReplyParameters(chat_id=target_chat_id, message_id=msg_id)
 
                 if last_verse_page_obj is not None:
@@ -178,8 +175,8 @@ async def format_khatm_message(
                     current_message_parts.append("توجه: آیات ارسالی شما از محدوده تعیین‌شده بیشتر است.")
                 # --- AUDIO SECTION ---
                 # verses_to_display حاوی آیاتی است که نمایش داده شده‌اند.
-                # quran نمونه QuranManager است. (باید به درستی مقداردهی اولیه شده باشد)
-                audio_section_text = await generate_audio_links_section(verses_to_display, quran)
+                # نمونه مشترک QuranManager (با اولین درخواست بارگذاری می‌شود، نه هنگام ایمپورت)
+                audio_section_text = await generate_audio_links_section(verses_to_display, await QuranManager.get_instance())
 
                 if audio_section_text:
                     current_message_parts.append(audio_section_text) # این رشته شامل جداکننده بالایی خودش است
@@ -270,7 +267,7 @@ async def _delete_bot_message_job(context: "ContextTypes.DEFAULT_TYPE"):
         
     try:
         await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-        logger.info(f"Successfully deleted bot message {message_id} from chat {chat_id}")
+        logger.debug("Successfully deleted bot message %s from chat %s", message_id, chat_id)
     except Exception as e:
         logger.error(f"Failed to delete bot message {message_id} from chat {chat_id}: {e}", exc_info=True)
 
@@ -287,7 +284,7 @@ async def schedule_message_deletion(context: "ContextTypes.DEFAULT_TYPE", chat_i
             delay_minutes = group_settings["delete_after"]
             job_data = {"chat_id": chat_id, "message_id": message_id}
             context.job_queue.run_once(_delete_bot_message_job, delay_minutes * 60, data=job_data, name=f"delete_msg_{chat_id}_{message_id}")
-            logger.info(f"Scheduled deletion for message {message_id} in chat {chat_id} after {delay_minutes} minutes.")
+            logger.debug("Scheduled deletion for message %s in chat %s after %s minutes.", message_id, chat_id, delay_minutes)
     except Exception as e:
         logger.error(f"Error scheduling message deletion for chat {chat_id}, message {message_id}: {e}", exc_info=True)
 
@@ -399,8 +396,8 @@ def ignore_old_messages(max_age_minutes=2):
             
             if message_age > datetime.timedelta(minutes=max_age_minutes):
                 logger.info(
-                    f"Ignoring old message/command in handler {func.__name__} from {update.effective_user.id} "
-                    f"(age: {message_age.total_seconds() / 60:.2f} minutes)"
+                    "Ignoring old message/command in handler %s from %s (age: %.2f minutes)",
+                    func.__name__, update.effective_user.id, message_age.total_seconds() / 60
                 )
                 return None
             
@@ -0,0 +1,53 @@
+"""
+پوشش BaseRequest برای اندازه‌گیری فراخوانی‌های Bot API.
+
+InstrumentedRequest هر درخواست را به request داخلی (HTTPXRequest یا FakeBotRequest) می‌سپارد و
+زمان پاسخ هر متد، کد وضعیت HTTP و پاسخ‌های 429 (که PTB به RetryAfter تبدیل می‌کند) را در
+متریک‌ها و trace جاری ثبت می‌کند.
+"""
+import time
+from typing import Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+from bot.utils.metrics import API_RESPONSES, API_RETRY_AFTER, API_SECONDS
+from bot.utils.tracing import current_trace
+
+
+class InstrumentedRequest(BaseRequest):
+    def __init__(self, inner: BaseRequest):
+        self.inner = inner
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.inner.read_timeout
+
+    async def initialize(self) -> None:
+        await self.inner.initialize()
+
+    async def shutdown(self) -> None:
+        await self.inner.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        status = "error"
+        try:
+            code, payload = await self.inner.do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )
+            status = str(code)
+            if code == 429:
+                API_RETRY_AFTER.inc(method=api_method)
+            return code, payload
+        finally:
+            ended = time.perf_counter()
+            API_SECONDS.observe(ended - started, method=api_method)
+            API_RESPONSES.inc(method=api_method, status=status)
+            trace = current_trace.get()
+            if trace is not None:
+                trace.add_span(f"api:{api_method}", started, ended, status=status)
@@ -1,28 +1,128 @@
+import atexit
+import json
 import logging
 import logging.handlers
 import os
-from datetime import datetime
+import queue
+import random
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from config.settings import LOG_LEVEL, LOG_FORMAT, LOG_DIR, LOG_SAMPLE_RATES, SHARD_INDEX
+
+# فیلدهای استاندارد LogRecord؛ بقیه (extra=...) در خروجی JSON می‌آیند
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """هر رکورد یک خط JSON: زمان، سطح، logger، پیام، محل و فیلدهای extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "module": record.module,
+            "func": record.funcName,
+            "line": record.lineno,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    فقط بخشی از لاگ‌های زیر WARNING هر ماژول را نگه می‌دارد (LOG_SAMPLE_RATES).
+    نرخ ماژول با طولانی‌ترین پیشوند نام logger پیدا و برای هر logger کش می‌شود.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._cache: Dict[str, float] = {}
+
+    def rate_for(self, name: str) -> float:
+        rate = self._cache.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._cache[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    مثل QueueHandler، ولی traceback را جدا در exc_text نگه می‌دارد تا formatter طرف
+    listener (متنی یا JSON) آن را خودش قالب‌بندی کند.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def stop_logging() -> None:
+    """رکوردهای باقی‌مانده صف را می‌نویسد و thread نویسنده را متوقف می‌کند."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
 
 def setup_logging():
+    """
+    لاگ‌ها در thread جدای QueueListener نوشته می‌شوند؛ handler های پروسه اصلی فقط رکورد را
+    در صف می‌گذارند و event loop برای نوشتن فایل یا کنسول معطل نمی‌شود.
+    """
+    global _listener
+    if _listener is not None:
+        return None
+
     # Create logs directory if it doesn't exist
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
+    if not os.path.exists(LOG_DIR):
+        os.makedirs(LOG_DIR)
 
     # Generate log filename with timestamp
+    # ورکرهای شارد در یک ثانیه شروع می‌شوند؛ بدون شماره شارد همه در یک فایل rotate می‌کردند
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    log_file = f'logs/khatm_bot_{timestamp}.log'
-
-    # Configure root logger
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)
+    shard = f'_shard{SHARD_INDEX}' if SHARD_INDEX is not None else ''
+    log_file = os.path.join(LOG_DIR, f'khatm_bot_{timestamp}{shard}.log')
 
     # Create formatters
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    console_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s'
-    )
+    if LOG_FORMAT == "json":
+        file_formatter = console_formatter = JsonFormatter()
+    else:
+        file_formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
+        console_formatter = logging.Formatter(
+            '%(asctime)s - %(levelname)s - %(message)s'
+        )
 
     # File handler with rotation
     file_handler = logging.handlers.RotatingFileHandler(
@@ -39,17 +139,26 @@ def setup_logging():
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(console_formatter)
 
-    # Add handlers to root logger
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    # Configure root logger: فقط QueueHandler؛ نوشتن در thread listener
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    if LOG_SAMPLE_RATES:
+        queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES))
+    root_logger = logging.getLogger()
+    root_logger.setLevel(LOG_LEVEL)
+    root_logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
 
     # Set specific log levels for different modules
     logging.getLogger('telegram').setLevel(logging.WARNING)
     logging.getLogger('apscheduler').setLevel(logging.WARNING)
     logging.getLogger('aiosqlite').setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
 
     # Log startup message
     logging.info("Logging system initialized")
     logging.info("Log file: %s", log_file)
 
-    return log_file
\ No newline at end of file
+    return log_file
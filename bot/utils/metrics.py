@@ -0,0 +1,414 @@
+"""
+رجیستری ساده متریک‌ها (Counter، Gauge، Histogram) با خروجی متنی سازگار با Prometheus.
+
+بدون وابستگی خارجی؛ متریک‌ها در حافظه پروسه نگه داشته می‌شوند و با start_metrics_server روی
+یک پورت HTTP محلی (METRICS_PORT) یا با render_summary در داشبورد نمایش داده می‌شوند.
+Gauge ها می‌توانند callback داشته باشند که هنگام خواندن متریک‌ها صدا زده می‌شود.
+"""
+import asyncio
+import bisect
+import logging
+import math
+import re
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# بازه‌های پیش‌فرض هیستوگرام (ثانیه)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# حداکثر تعداد سری (ترکیب برچسب) هر متریک؛ بقیه در سری "other" جمع می‌شوند
+MAX_SERIES = 500
+OTHER = "other"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, object], series: Dict) -> LabelValues:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        if key not in series and len(series) >= MAX_SERIES:
+            return tuple(OTHER for _ in self.labelnames)
+        return key
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels, self._values)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0)
+
+    def items(self) -> List[Tuple[LabelValues, float]]:
+        return list(self._values.items())
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Optional[Callable] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        # callback: عدد (بدون برچسب) یا dict از مقدار برچسب‌ها به عدد برمی‌گرداند
+        self.callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels, self._values)] = value
+
+    def items(self) -> List[Tuple[LabelValues, float]]:
+        if self.callback is None:
+            return list(self._values.items())
+        try:
+            result = self.callback()
+        except Exception as e:
+            logger.error("Error reading gauge %s: %s", self.name, e)
+            return []
+        if isinstance(result, dict):
+            return [((key,) if not isinstance(key, tuple) else key, value) for key, value in result.items()]
+        return [((), result)]
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self.items())
+        ]
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: Dict[str, object]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[LabelValues, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels, self._series)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _HistogramSeries(len(self.buckets))
+        # شمارش غیرتجمعی؛ هنگام خروجی تجمعی می‌شود
+        series.counts[bisect.bisect_left(self.buckets, value)] += 1
+        series.sum += value
+        series.count += 1
+
+    def time(self, **labels) -> _Timer:
+        return _Timer(self, labels)
+
+    def series(self) -> Dict[LabelValues, _HistogramSeries]:
+        return dict(self._series)
+
+    def quantile(self, q: float, key: LabelValues) -> float:
+        """تخمین صدک با درون‌یابی خطی در بازه‌ها (مثل histogram_quantile در Prometheus)."""
+        series = self._series.get(key)
+        if not series or not series.count:
+            return 0.0
+        rank = q * series.count
+        cumulative = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, series.counts):
+            if count and cumulative + count >= rank:
+                if bound == math.inf:
+                    return lower
+                return lower + (bound - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = bound if bound != math.inf else lower
+        return lower
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series.counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series.sum)}")
+            lines.append(f"{self.name}_count{labels} {series.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric):
+                raise ValueError(f"Metric {metric.name} already registered as {existing.kind}")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+              callback: Optional[Callable] = None) -> Gauge:
+        gauge = self._register(Gauge(name, documentation, labelnames))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- متریک‌های مسیرهای داغ ---
+KHATM_STAGE_SECONDS = REGISTRY.histogram(
+    "bot_khatm_message_stage_seconds", "Time spent in each stage of handle_khatm_message", ("stage",))
+IS_ADMIN_SECONDS = REGISTRY.histogram(
+    "bot_is_admin_seconds", "Latency of is_admin checks that call getChatAdministrators")
+SQL_SECONDS = REGISTRY.histogram(
+    "bot_sql_query_seconds", "Read query latency per SQL statement", ("op", "statement"))
+QUEUE_REQUEST_SECONDS = REGISTRY.histogram(
+    "bot_write_queue_request_seconds", "process_queue_request latency per request type", ("type",))
+QUEUE_REQUEST_RETRIES = REGISTRY.counter(
+    "bot_write_queue_retries_total", "Retries of write queue requests after 'database is locked'", ("type",))
+QUEUE_REQUEST_FAILURES = REGISTRY.counter(
+    "bot_write_queue_failures_total", "Write queue requests that failed", ("type",))
+API_SECONDS = REGISTRY.histogram(
+    "bot_telegram_api_seconds", "Telegram Bot API call latency per method", ("method",))
+API_RESPONSES = REGISTRY.counter(
+    "bot_telegram_api_responses_total", "Telegram Bot API responses per method and HTTP status", ("method", "status"))
+API_RETRY_AFTER = REGISTRY.counter(
+    "bot_telegram_retry_after_total", "Telegram Bot API 429 (RetryAfter) responses per method", ("method",))
+LOOP_BLOCK_SECONDS = REGISTRY.histogram(
+    "bot_event_loop_block_seconds", "Event loop stalls over LOOP_BLOCK_MS per blocking call site", ("site",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+INVITE_LINK_CHECKS = REGISTRY.counter(
+    "bot_invite_link_checks_total", "Invite link checks by refresh_invite_links per result", ("result",))
+BROADCAST_MESSAGES = REGISTRY.counter(
+    "bot_broadcast_messages_total", "Messages sent by rate-limited broadcasts per broadcast and result", ("name", "result"))
+STARTUP_PHASE_SECONDS = REGISTRY.gauge(
+    "bot_startup_phase_seconds", "Duration of each phase of the last startup", ("phase",))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def sql_label(query: str) -> str:
+    """برچسب کوتاه و ثابت یک دستور SQL (فاصله‌ها یکی و طول محدود)."""
+    label = _WHITESPACE.sub(" ", query).strip()
+    return label if len(label) <= 120 else label[:117] + "..."
+
+
+class StageTimer:
+    """
+    زمان مراحل پشت سر هم یک تابع: هر mark(stage) فاصله از mark قبلی را در هیستوگرام با
+    برچسب stage ثبت می‌کند، بدون نیاز به تورفتگی کد در بلوک‌های with.
+    """
+    __slots__ = ("histogram", "last")
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self.last = time.perf_counter()
+
+    def mark(self, stage: str) -> None:
+        now = time.perf_counter()
+        self.histogram.observe(now - self.last, stage=stage)
+        self.last = now
+
+
+class StartupReport:
+    """
+    زمان مراحل راه‌اندازی: مثل StageTimer، ولی هر مرحله یک بار اتفاق می‌افتد و مقدارش در
+    STARTUP_PHASE_SECONDS می‌ماند؛ summary() خلاصه یک‌خطی برای لاگ است.
+    """
+    __slots__ = ("started", "last", "phases")
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = self.last = started if started is not None else time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        STARTUP_PHASE_SECONDS.set(now - self.last, phase=phase)
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def summary(self) -> str:
+        phases = ", ".join(f"{phase}={seconds * 1000:.1f}" for phase, seconds in self.phases)
+        return f"{(self.last - self.started) * 1000:.1f} ms ({phases})"
+
+
+# ---------------------------------------------------------------------------
+# خلاصه برای داشبورد
+# ---------------------------------------------------------------------------
+
+def _top_series(histogram: Histogram, limit: int, by_total: bool = False) -> List[Tuple[LabelValues, _HistogramSeries]]:
+    ranked = sorted(histogram.series().items(),
+                    key=lambda item: item[1].sum if by_total else item[1].count, reverse=True)
+    return ranked[:limit]
+
+
+def _histogram_lines(histogram: Histogram, limit: int = 5, by_total: bool = False,
+                     label_width: int = 40) -> List[str]:
+    lines = []
+    for key, series in _top_series(histogram, limit, by_total):
+        label = " ".join(key)[:label_width] or histogram.name
+        lines.append(
+            f"• {label}: n={series.count} avg={series.sum / series.count * 1000:.1f}ms "
+            f"p95≈{histogram.quantile(0.95, key) * 1000:.1f}ms"
+        )
+    return lines or ["—"]
+
+
+def render_summary() -> str:
+    """خلاصه متنی (HTML) متریک‌های اصلی برای نمای داشبورد."""
+    from html import escape
+
+    sections = []
+    gauges = [REGISTRY.get(name) for name in (
+        "bot_write_queue_depth", "bot_write_queue_oldest_age_seconds",
+        "bot_update_processor_waiting_updates", "bot_update_processor_active_keys",
+    )]
+    gauge_lines = []
+    for gauge in gauges:
+        if gauge is None:
+            continue
+        for key, value in gauge.items():
+            gauge_lines.append(f"• {gauge.name}{'/' + '/'.join(key) if key else ''}: {value:.6g}")
+    sections.append(("صف‌ها", gauge_lines or ["—"]))
+    sections.append(("مراحل پیام ختم", _histogram_lines(KHATM_STAGE_SECONDS, limit=10, by_total=True)))
+    sections.append(("is_admin", _histogram_lines(IS_ADMIN_SECONDS)))
+    sections.append(("کندترین کوئری‌ها (زمان کل)", _histogram_lines(SQL_SECONDS, by_total=True)))
+    sections.append(("درخواست‌های write_queue", _histogram_lines(QUEUE_REQUEST_SECONDS, by_total=True)))
+    sections.append(("Bot API", _histogram_lines(API_SECONDS, by_total=True)))
+    startup = STARTUP_PHASE_SECONDS.items()
+    if startup:
+        sections.append(("راه‌اندازی", [f"• {key[0]}: {value * 1000:.1f} ms" for key, value in startup]))
+    if LOOP_BLOCK_SECONDS.series():
+        sections.append(("مسدود شدن event loop", _histogram_lines(LOOP_BLOCK_SECONDS, by_total=True, label_width=60)))
+
+    retries = sum(value for _, value in QUEUE_REQUEST_RETRIES.items())
+    failures = sum(value for _, value in QUEUE_REQUEST_FAILURES.items())
+    retry_after = sum(value for _, value in API_RETRY_AFTER.items())
+    sections.append(("خطاها", [
+        f"• write_queue retries: {int(retries)} | failures: {int(failures)}",
+        f"• Telegram RetryAfter (429): {int(retry_after)}",
+    ]))
+
+    parts = ["<b>📈 متریک‌ها</b>"]
+    for title, lines in sections:
+        parts.append(f"\n<b>{title}</b>")
+        parts.extend(escape(line) for line in lines)
+    return "\n".join(parts)
+
+
+# ---------------------------------------------------------------------------
+# سرور HTTP متریک‌ها
+# ---------------------------------------------------------------------------
+
+async def _handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, path: str) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # بقیه هدرها خوانده و نادیده گرفته می‌شوند
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?", 1)[0] == path:
+            status, content_type, body = "200 OK", CONTENT_TYPE, REGISTRY.render().encode("utf-8")
+        else:
+            status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug("Metrics request aborted: %s", e)
+    except Exception as e:
+        logger.error("Error serving metrics: %s", e, exc_info=True)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int, path: str = "/metrics") -> asyncio.AbstractServer:
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_metrics_request(reader, writer, path), host, port)
+    logger.info("Metrics endpoint listening on http://%s:%s%s", host, port, path)
+    return server
@@ -0,0 +1,149 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from bot.database.db import fetch_all, write_queue
+from config.settings import PENDING_SELECTION_MAX, PENDING_SELECTION_PERSIST, PENDING_SELECTION_TTL
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, message_id) پیام عددی کاربر که کیبورد انتخاب به آن ریپلای شده است
+PendingKey = Tuple[int, int]
+
+
+class PendingSelectionStore:
+    """
+    انتخاب‌های در انتظار کیبوردهای شیشه‌ای (ذکر/دعا) با سقف اندازه و انقضای TTL.
+
+    جایگزین context.chat_data['pending_zekr'] / ['pending_doa'] که هیچ‌وقت خالی نمی‌شدند.
+    ورودی‌ها به ترتیب درج نگه داشته می‌شوند؛ منقضی‌ها هنگام خواندن و در prune حذف
+    می‌شوند و با رسیدن به max_entries قدیمی‌ترین ورودی کنار گذاشته می‌شود.
+    اگر persist فعال باشد هر تغییر از طریق write_queue در جدول pending_selections
+    نوشته می‌شود و load() بعد از ری‌استارت ورودی‌های منقضی‌نشده را برمی‌گرداند.
+    """
+
+    def __init__(self, kind: str, ttl: float = PENDING_SELECTION_TTL,
+                 max_entries: int = PENDING_SELECTION_MAX, persist: bool = PENDING_SELECTION_PERSIST):
+        self.kind = kind
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries: "OrderedDict[PendingKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.expired_total = 0
+        self.evicted_total = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def put(self, chat_id: int, message_id: int, data: Dict[str, Any]) -> None:
+        key = (chat_id, message_id)
+        expires_at = time.time() + self.ttl
+        self._entries.pop(key, None)
+        self._entries[key] = (expires_at, data)
+        while len(self._entries) > self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            self.evicted_total += 1
+            await self._delete_persisted(old_key)
+        if self.persist:
+            await write_queue.put({
+                "type": "save_pending_selection",
+                "kind": self.kind,
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "payload": json.dumps(data, ensure_ascii=False),
+                "expires_at": expires_at,
+            })
+
+    def get(self, chat_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+        key = (chat_id, message_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        if expires_at <= time.time():
+            # ردیف دیتابیس در prune بعدی حذف می‌شود
+            del self._entries[key]
+            self.expired_total += 1
+            return None
+        return data
+
+    async def pop(self, chat_id: int, message_id: int) -> Optional[Dict[str, Any]]:
+        data = self.get(chat_id, message_id)
+        key = (chat_id, message_id)
+        if key in self._entries:
+            del self._entries[key]
+        await self._delete_persisted(key)
+        return data
+
+    def prune(self) -> int:
+        """حذف ورودی‌های منقضی از حافظه؛ تعداد حذف‌شده‌ها را برمی‌گرداند."""
+        now = time.time()
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        self.expired_total += len(expired)
+        return len(expired)
+
+    async def load(self) -> int:
+        """بازیابی ورودی‌های منقضی‌نشده از دیتابیس بعد از ری‌استارت."""
+        if not self.persist:
+            return 0
+        rows = await fetch_all(
+            """
+            SELECT chat_id, message_id, payload, expires_at
+            FROM pending_selections
+            WHERE kind = ? AND expires_at > ?
+            ORDER BY expires_at
+            """,
+            (self.kind, time.time())
+        )
+        # فقط جدیدترین max_entries ردیف (ردیف‌ها به ترتیب انقضا هستند)
+        kept = rows[len(rows) - self.max_entries:] if self.max_entries > 0 else []
+        for row in kept:
+            self._entries[(row["chat_id"], row["message_id"])] = (row["expires_at"], json.loads(row["payload"]))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        # تعداد ورودی‌هایی که واقعاً در حافظه مانده‌اند، نه تعداد ردیف‌های دیتابیس
+        return sum(1 for row in kept if (row["chat_id"], row["message_id"]) in self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "expired_total": self.expired_total,
+            "evicted_total": self.evicted_total,
+        }
+
+    async def _delete_persisted(self, key: PendingKey) -> None:
+        if self.persist:
+            await write_queue.put({
+                "type": "delete_pending_selection",
+                "kind": self.kind,
+                "chat_id": key[0],
+                "message_id": key[1],
+            })
+
+
+pending_zekr = PendingSelectionStore("zekr")
+pending_doa = PendingSelectionStore("doa")
+PENDING_STORES = (pending_zekr, pending_doa)
+
+
+async def load_pending_selections() -> None:
+    for store in PENDING_STORES:
+        restored = await store.load()
+        if restored:
+            logger.info("Restored %s pending %s selections", restored, store.kind)
+
+
+async def prune_pending_selections(context) -> None:
+    """جاب دوره‌ای: حذف انتخاب‌های منقضی از حافظه و دیتابیس."""
+    try:
+        for store in PENDING_STORES:
+            expired = store.prune()
+            logger.debug("Pending %s selections: %s (expired now: %s)", store.kind, store.stats(), expired)
+        if any(store.persist for store in PENDING_STORES):
+            await write_queue.put({"type": "prune_pending_selections", "now": time.time()})
+    except Exception as e:
+        logger.error("Error pruning pending selections: %s", e, exc_info=True)
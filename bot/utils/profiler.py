@@ -0,0 +1,320 @@
+"""
+پروفایلر نمونه‌بردار درون‌پروسه‌ای و مانیتور تأخیر event loop.
+
+SamplingProfiler در یک thread جدا هر چند میلی‌ثانیه با sys._current_frames پشته همه thread ها
+(event loop، thread های aiosqlite و بقیه) را می‌خواند و پشته‌ها را به فرمت collapsed
+(ورودی flamegraph.pl یا speedscope) می‌شمارد. LoopWatchdog با یک heartbeat در loop و یک
+thread ناظر، توقف‌های بیشتر از آستانه را همراه پشته loop و تسکی که آن را نگه داشته ثبت
+می‌کند. profile() هر دو را برای N ثانیه اجرا و نتیجه را در PROFILE_DIR ذخیره می‌کند.
+BlockingDetector همان ناظر را در تمام عمر پروسه (LOOP_BLOCK_MS > 0) اجرا می‌کند و توقف‌ها را به
+تفکیک محل فراخوانی در متریک‌ها می‌شمارد.
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import aiosqlite
+
+from config.settings import PROFILE_DIR, LOOP_STALL_MS, LOOP_BLOCK_MS
+from bot.utils.metrics import LOOP_BLOCK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# حداکثر عمق پشته در هر نمونه
+MAX_DEPTH = 64
+_SITE_PACKAGES = os.sep + "site-packages" + os.sep
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) + os.sep
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(_ROOT):
+        return filename[len(_ROOT):]
+    index = filename.find(_SITE_PACKAGES)
+    if index >= 0:
+        return filename[index + len(_SITE_PACKAGES):]
+    return os.path.basename(filename)
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{_short_path(code.co_filename)}:{code.co_qualname}"
+
+
+def collapse(frame, limit: int = MAX_DEPTH) -> List[str]:
+    """برچسب فریم‌ها از ریشه تا برگ."""
+    labels = []
+    while frame is not None and len(labels) < limit:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def thread_label(thread: Optional[threading.Thread], loop_thread_id: Optional[int]) -> str:
+    if thread is None:
+        return "unknown"
+    if thread.ident == loop_thread_id:
+        return "event-loop"
+    if isinstance(thread, aiosqlite.Connection):
+        return "aiosqlite"
+    return thread.name.split(" ", 1)[0]
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.01, loop_thread_id: Optional[int] = None):
+        self.interval = interval
+        self.loop_thread_id = loop_thread_id
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                label = thread_label(threads.get(thread_id), self.loop_thread_id)
+                if label == "loop-watchdog":
+                    continue
+                self.stacks[";".join([label] + collapse(frame))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top_frames(self, thread: str = "event-loop", limit: int = 10) -> List[tuple]:
+        """پرتکرارترین فریم‌های برگ (self time) یک دسته thread."""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            if frames[0] == thread and len(frames) > 1:
+                leaves[frames[-1]] += count
+        return leaves.most_common(limit)
+
+
+def describe_task(task: Optional[asyncio.Task]) -> Optional[str]:
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+
+class LoopWatchdog:
+    """
+    loop هر interval یک heartbeat ثبت می‌کند. thread ناظر وقتی heartbeat بیشتر از threshold عقب
+    بماند پشته thread loop و تسک جاری را برمی‌دارد؛ خود loop پس از آزاد شدن مدت توقف را
+    اندازه می‌گیرد و توقف را با همان پشته در stalls ثبت می‌کند و listener ها را صدا می‌زند.
+    """
+
+    def __init__(self, threshold: float, interval: Optional[float] = None, max_stalls: int = 200):
+        self.threshold = threshold
+        self.interval = interval or max(threshold / 4, 0.005)
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=max_stalls)
+        self.stall_count = 0
+        self.listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._beat = 0.0
+        self._captured: Optional[tuple] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._heartbeat(), name="loop-watchdog")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - self._beat - self.interval
+            if lag >= self.threshold:
+                self._record(lag)
+
+    def _record(self, lag: float) -> None:
+        captured, self._captured = self._captured, None
+        stall = {
+            "at": datetime.now().isoformat(timespec="milliseconds"),
+            "lag_ms": round(lag * 1000, 1),
+            "task": None,
+            "stack": [],
+        }
+        # پشته فقط وقتی معتبر است که ناظر همین توقف را دیده باشد
+        if captured is not None and captured[0] == self._beat:
+            stall["task"], stall["stack"] = captured[1], captured[2]
+        self.stalls.append(stall)
+        self.stall_count += 1
+        for listener in self.listeners:
+            try:
+                listener(stall)
+            except Exception as e:
+                logger.error("Error in loop stall listener: %s", e, exc_info=True)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if time.perf_counter() - beat - self.interval < self.threshold:
+                continue
+            if self._captured is not None and self._captured[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            task = asyncio.current_task(self._loop)
+            self._captured = (beat, describe_task(task), collapse(frame))
+
+
+_profiling = asyncio.Lock()
+
+
+def is_profiling() -> bool:
+    return _profiling.locked()
+
+
+async def profile(seconds: float, interval: float = 0.01, stall_ms: float = LOOP_STALL_MS) -> Dict[str, Any]:
+    """
+    پروفایلر و مانیتور تأخیر loop را seconds ثانیه اجرا می‌کند و خروجی را در PROFILE_DIR
+    می‌نویسد: profile_<time>.collapsed و profile_<time>_stalls.jsonl.
+    """
+    async with _profiling:
+        profiler = SamplingProfiler(interval, loop_thread_id=threading.get_ident())
+        watchdog = LoopWatchdog(stall_ms / 1000)
+        started = time.perf_counter()
+        profiler.start()
+        watchdog.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await watchdog.stop()
+            await asyncio.to_thread(profiler.stop)
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        collapsed_path = f"{base}.collapsed"
+        stalls_path = f"{base}_stalls.jsonl"
+
+        def write() -> None:
+            profiler.write_collapsed(collapsed_path)
+            with open(stalls_path, "w", encoding="utf-8") as f:
+                for stall in watchdog.stalls:
+                    f.write(json.dumps(stall, ensure_ascii=False) + "\n")
+
+        await asyncio.to_thread(write)
+        logger.info("Profile written to %s (%s samples, %s loop stalls)",
+                    collapsed_path, profiler.samples, watchdog.stall_count)
+        return {
+            "seconds": round(time.perf_counter() - started, 1),
+            "samples": profiler.samples,
+            "collapsed_path": collapsed_path,
+            "stalls_path": stalls_path,
+            "top_loop_frames": profiler.top_frames("event-loop"),
+            "top_db_frames": profiler.top_frames("aiosqlite", limit=5),
+            "stalls": list(watchdog.stalls),
+        }
+
+
+# ---------------------------------------------------------------------------
+# تشخیص کد همگام که event loop را مسدود می‌کند
+# ---------------------------------------------------------------------------
+
+# پیشوند مسیر کدهای خود ربات در برچسب فریم‌ها (نسبت به ریشه پروژه)
+PROJECT_PREFIXES = ("bot/", "config/", "main.py", "benchmarks/", "scripts/")
+# پشته کامل یک محل حداکثر هر چند ثانیه یک بار در لاگ نوشته می‌شود
+BLOCK_LOG_INTERVAL = 300
+
+
+def call_site(stack: List[str]) -> str:
+    """درونی‌ترین فریم کد ربات در پشته؛ اگر نبود، خود برگ."""
+    for label in reversed(stack):
+        if label.startswith(PROJECT_PREFIXES):
+            return label
+    return stack[-1] if stack else "unknown"
+
+
+class BlockingDetector:
+    def __init__(self, threshold: float):
+        self.watchdog = LoopWatchdog(threshold)
+        self.watchdog.listeners.append(self._on_stall)
+        self.sites: Dict[str, Dict[str, Any]] = {}
+
+    def _on_stall(self, stall: Dict[str, Any]) -> None:
+        site = call_site(stall["stack"])
+        LOOP_BLOCK_SECONDS.observe(stall["lag_ms"] / 1000, site=site)
+        info = self.sites.get(site)
+        if info is None:
+            info = self.sites[site] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "logged_at": 0.0}
+        info["count"] += 1
+        info["total_ms"] += stall["lag_ms"]
+        info["max_ms"] = max(info["max_ms"], stall["lag_ms"])
+        info["task"], info["stack"] = stall["task"], stall["stack"]
+        now = time.monotonic()
+        if now - info["logged_at"] >= BLOCK_LOG_INTERVAL:
+            info["logged_at"] = now
+            logger.warning("Event loop blocked for %.0f ms at %s (task %s, %d times so far)\n  %s",
+                           stall["lag_ms"], site, stall["task"], info["count"],
+                           "\n  ".join(stall["stack"][-20:]))
+
+
+_detector: Optional[BlockingDetector] = None
+
+
+def start_blocking_detector(threshold_ms: float = LOOP_BLOCK_MS) -> Optional[BlockingDetector]:
+    """باید داخل event loop صدا زده شود؛ threshold_ms <= 0 یعنی خاموش."""
+    global _detector
+    if threshold_ms <= 0 or _detector is not None:
+        return _detector
+    _detector = BlockingDetector(threshold_ms / 1000)
+    _detector.watchdog.start()
+    logger.info("Event loop blocking detector started (threshold %.0f ms)", threshold_ms)
+    return _detector
+
+
+async def stop_blocking_detector() -> None:
+    global _detector
+    if _detector is not None:
+        await _detector.watchdog.stop()
+        _detector = None
@@ -0,0 +1,223 @@
+"""
+ردیابی سبک هر آپدیت: handler → write_queue → دیتابیس → Bot API.
+
+TracingApplication برای هر آپدیت یک Trace در context var می‌گذارد. span ها (is_admin، کوئری‌ها،
+فراخوانی‌های Bot API) از همان context خوانده می‌شوند. درخواستی که در write_queue گذاشته
+می‌شود trace را با خود می‌برد (کلیدهای trace و trace_id)، پس انتظار در صف و تراکنش
+process_queue_request هم در همان trace ثبت می‌شوند. trace وقتی تمام می‌شود که handler و همه
+درخواست‌های صفش تمام شده باشند. اگر کل زمان از TRACE_SLOW_MS بیشتر باشد، یک خط JSON در
+TRACE_LOG_PATH نوشته می‌شود.
+
+    python -m bot.utils.tracing logs/slow_traces.jsonl   # خلاصه trace های کند
+"""
+import argparse
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+from config.settings import TRACE_SLOW_MS, TRACE_LOG_PATH
+from bot.utils.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SLOW_TRACES = REGISTRY.counter("bot_slow_traces_total", "Updates slower than TRACE_SLOW_MS", ("name",))
+
+# span ها بیشتر از این در یک trace ثبت نمی‌شوند (مثلاً /tag با هزاران sendMessage)
+MAX_SPANS = 200
+
+
+class Trace:
+    __slots__ = ("trace_id", "name", "attrs", "started", "started_wall", "spans", "dropped", "finished", "_pending")
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.started_wall = time.time()
+        self.spans: List[Tuple[str, float, float, Dict[str, Any]]] = []
+        self.dropped = 0
+        self.finished = False
+        # handler خودش + هر درخواست صف که هنوز پردازش نشده
+        self._pending = 1
+
+    def add_span(self, name: str, start: float, end: float, **attrs) -> None:
+        if len(self.spans) < MAX_SPANS:
+            self.spans.append((name, start, end, attrs))
+        else:
+            self.dropped += 1
+
+    def hold(self) -> None:
+        self._pending += 1
+
+    def release(self) -> None:
+        self._pending -= 1
+        if self._pending == 0:
+            self.finished = True
+            _finish(self)
+
+    def to_dict(self, end: float) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_wall,
+            "total_ms": round((end - self.started) * 1000, 3),
+            **self.attrs,
+            "spans": [
+                {"name": name, "start_ms": round((start - self.started) * 1000, 3),
+                 "duration_ms": round((end_ - start) * 1000, 3), **attrs}
+                for name, start, end_, attrs in self.spans
+            ],
+            "dropped_spans": self.dropped,
+        }
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+
+
+class span:
+    """زمان یک بخش در trace جاری؛ بدون trace هیچ کاری نمی‌کند."""
+    __slots__ = ("name", "attrs", "trace", "started")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.trace = current_trace.get()
+        if self.trace is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            if exc_type is not None:
+                self.attrs["error"] = exc_type.__name__
+            self.trace.add_span(self.name, self.started, time.perf_counter(), **self.attrs)
+        return False
+
+
+def attach_to_request(request: Dict[str, Any]) -> None:
+    """trace جاری را به درخواست write_queue می‌چسباند (هنگام put)."""
+    trace = current_trace.get()
+    # تسک‌هایی که handler ساخته ممکن است بعد از پایان trace هنوز در صف بنویسند
+    if trace is not None and not trace.finished and "trace" not in request:
+        trace.hold()
+        request["trace"] = trace
+        request["trace_id"] = trace.trace_id
+        request["trace_enqueued_at"] = time.perf_counter()
+
+
+_dump_listener: Optional[logging.handlers.QueueListener] = None
+_dump_logger = logging.getLogger("bot.slow_traces")
+_dump_logger.propagate = False
+
+
+def _dump(data: Dict[str, Any]) -> None:
+    # نوشتن فایل در thread جدا، مثل بقیه لاگ‌ها (bot/utils/logging_config.py)
+    global _dump_listener
+    if _dump_listener is None:
+        os.makedirs(os.path.dirname(TRACE_LOG_PATH) or ".", exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            TRACE_LOG_PATH, maxBytes=10*1024*1024, backupCount=3, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        dump_queue = queue.SimpleQueue()
+        _dump_logger.addHandler(logging.handlers.QueueHandler(dump_queue))
+        _dump_logger.setLevel(logging.INFO)
+        _dump_listener = logging.handlers.QueueListener(dump_queue, file_handler)
+        _dump_listener.start()
+        atexit.register(stop_trace_dump)
+    _dump_logger.info(json.dumps(data, ensure_ascii=False, default=str))
+
+
+def stop_trace_dump() -> None:
+    global _dump_listener
+    if _dump_listener is not None:
+        _dump_listener.stop()
+        _dump_listener = None
+
+
+def _finish(trace: Trace) -> None:
+    end = time.perf_counter()
+    if (end - trace.started) * 1000 < TRACE_SLOW_MS:
+        return
+    SLOW_TRACES.inc(name=trace.name)
+    try:
+        _dump(trace.to_dict(end))
+    except Exception as e:
+        logger.error("Error writing slow trace %s: %s", trace.trace_id, e, exc_info=True)
+
+
+class TracingApplication(Application):
+    """Application که هر آپدیت را در یک trace پردازش می‌کند (TRACE_SLOW_MS=0 یعنی خاموش)."""
+    __slots__ = ()
+
+    async def process_update(self, update: object) -> None:
+        if TRACE_SLOW_MS <= 0:
+            return await super().process_update(update)
+        attrs = {}
+        if isinstance(update, Update):
+            attrs["update_id"] = update.update_id
+            if update.effective_chat:
+                attrs["chat_id"] = update.effective_chat.id
+            if update.effective_message and update.effective_message.message_thread_id:
+                attrs["thread_id"] = update.effective_message.message_thread_id
+        trace = Trace("callback_query" if isinstance(update, Update) and update.callback_query else "update", **attrs)
+        token = current_trace.set(trace)
+        try:
+            with span("handlers"):
+                await super().process_update(update)
+        finally:
+            current_trace.reset(token)
+            trace.release()
+
+
+# ---------------------------------------------------------------------------
+# خلاصه فایل trace های کند
+# ---------------------------------------------------------------------------
+
+def summarize(path: str, top: int = 15) -> None:
+    totals: Dict[str, List[float]] = defaultdict(list)
+    traces = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                traces.append(json.loads(line))
+    for trace in traces:
+        for item in trace["spans"]:
+            totals[item["name"]].append(item["duration_ms"])
+    print(f"{len(traces)} slow traces in {path}")
+    if not traces:
+        return
+    print(f"{'span':<40} {'count':>7} {'total ms':>11} {'avg ms':>9} {'max ms':>9}")
+    ranked = sorted(totals.items(), key=lambda item: sum(item[1]), reverse=True)
+    for name, durations in ranked[:top]:
+        print(f"{name[:40]:<40} {len(durations):>7} {sum(durations):>11.1f} "
+              f"{sum(durations) / len(durations):>9.1f} {max(durations):>9.1f}")
+    print("\nslowest:")
+    for trace in sorted(traces, key=lambda t: t["total_ms"], reverse=True)[:5]:
+        print(f"  {trace['trace_id']} {trace['name']} chat={trace.get('chat_id')} {trace['total_ms']:.1f} ms")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Summarize slow traces written by the bot.")
+    parser.add_argument("path", nargs="?", default=TRACE_LOG_PATH)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+    summarize(args.path, args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+from typing import Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# هر چند آپدیت منتظر به ازای هر آپدیت در حال اجرا (سقف سمافور BaseUpdateProcessor)
+PENDING_PER_RUNNING = 8
+
+# دستورهایی که ترتیبشان با بقیه پیام‌های تاپیک مهم نیست و نباید پشت قفل کلید منتظر بمانند:
+# /tag کارش را در تسک پس‌زمینه انجام می‌دهد و /cancel_tag باید فوراً به آن برسد
+UNORDERED_COMMANDS = frozenset({"tag", "cancel_tag"})
+
+
+def update_key(update: object) -> Optional[Hashable]:
+    """
+    کلید ترتیب یک آپدیت: (group_id, topic_id) مثل بقیه ربات؛ در گروه‌های بدون تاپیک
+    topic_id همان group_id است. آپدیت‌های بدون چت کلید ندارند و بدون قفل اجرا می‌شوند.
+    """
+    if not isinstance(update, Update):
+        return None
+    message = update.effective_message
+    chat = update.effective_chat
+    if chat is None:
+        return None
+    if message is not None and message.is_topic_message and message.message_thread_id:
+        return chat.id, message.message_thread_id
+    return chat.id, chat.id
+
+
+def is_unordered(update: object) -> bool:
+    """آیا آپدیت یکی از UNORDERED_COMMANDS است (با یا بدون @username ربات)."""
+    if not isinstance(update, Update) or update.message is None or not update.message.text:
+        return False
+    text = update.message.text
+    if not text.startswith("/"):
+        return False
+    command = text[1:].split(maxsplit=1)[0].split("@", 1)[0].lower() if len(text) > 1 else ""
+    return command in UNORDERED_COMMANDS
+
+
+class _KeyLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    پردازش هم‌زمان آپدیت‌ها با حفظ ترتیب در هر (group_id, topic_id).
+
+    آپدیت‌های یک تاپیک پشت یک asyncio.Lock (که منتظرها را به ترتیب ورود بیدار می‌کند)
+    پشت سر هم اجرا می‌شوند و تاپیک‌های مختلف موازی. سقف max_concurrent_updates روی
+    هندلرهای در حال اجراست و بعد از گرفتن قفل کلید اعمال می‌شود، تا آپدیت‌های منتظرِ یک
+    تاپیک شلوغ ظرفیت بقیه گروه‌ها را اشغال نکنند. سمافور خود PTB فقط تعداد کل آپدیت‌های
+    در جریان (منتظر + در حال اجرا) را محدود می‌کند.
+
+    هندلرهای طولانی هم قفل تاپیک و هم یک جای سمافور را تا پایان نگه می‌دارند، پس کار
+    طولانی (مثل ارسال تگ‌ها) باید با application.create_task در پس‌زمینه اجرا شود و
+    دستورهای UNORDERED_COMMANDS بدون قفل کلید اجرا می‌شوند.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: Optional[int] = None):
+        super().__init__(max_pending_updates or max_concurrent_updates * PENDING_PER_RUNNING)
+        self.max_running_updates = max_concurrent_updates
+        self._running: Optional[asyncio.Semaphore] = None
+        self._locks: Dict[Hashable, _KeyLock] = {}
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self.max_running_updates)
+
+    async def shutdown(self) -> None:
+        self._locks.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_keys": len(self._locks),
+            "waiting_updates": sum(entry.users for entry in self._locks.values()),
+        }
+
+    def busiest_keys(self, limit: int = 5) -> List[tuple]:
+        """کلیدهایی که بیشترین آپدیت منتظر/در حال اجرا را دارند."""
+        ranked = sorted(self._locks.items(), key=lambda item: item[1].users, reverse=True)
+        return [(key, entry.users) for key, entry in ranked[:limit]]
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self._running is None:
+            await self.initialize()
+        key = None if is_unordered(update) else update_key(update)
+        if key is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _KeyLock()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._locks[key]
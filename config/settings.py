@@ -1,17 +1,119 @@
 import os
+import re
 from dotenv import load_dotenv
 import logging
 
 logger = logging.getLogger(__name__)
 
+def shard_path(path: str, index: int, count: int) -> str:
+    if count <= 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}_shard{index}{ext}"
+
+def parse_sample_rates(value: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, rate = item.partition("=")
+        rate = float(rate)
+        if not name or not 0 <= rate <= 1:
+            raise ValueError(f"Invalid LOG_SAMPLE_RATES entry: {item}")
+        rates[name.strip()] = rate
+    return rates
+
 def load_settings():
     load_dotenv()
     try:
         settings = {
             "TELEGRAM_TOKEN": os.getenv("TELEGRAM_TOKEN"),
             "DATABASE_PATH": os.getenv("DATABASE_PATH", "khatm_bot.db"),
-            "HADITH_CHANNEL": os.getenv("HADITH_CHANNEL", "@HadithChannel")
+            "HADITH_CHANNEL": os.getenv("HADITH_CHANNEL", "@HadithChannel"),
+            "ARCHIVE_DATABASE_PATH": os.getenv("ARCHIVE_DATABASE_PATH", ""),
+            "CONTRIBUTION_RETENTION_DAYS": int(os.getenv("CONTRIBUTION_RETENTION_DAYS", "30")),
+            "MEMBERS_DATABASE_PATH": os.getenv("MEMBERS_DATABASE_PATH", "members.sqlite"),
+            "LEGACY_USER_STORE_PATH": os.getenv("LEGACY_USER_STORE_PATH", "data/users.db"),
+            "PENDING_SELECTION_TTL": int(os.getenv("PENDING_SELECTION_TTL", "1800")),
+            "PENDING_SELECTION_MAX": int(os.getenv("PENDING_SELECTION_MAX", "5000")),
+            "PENDING_SELECTION_PERSIST": os.getenv("PENDING_SELECTION_PERSIST", "1").lower() in ("1", "true", "yes"),
+            "PERSISTENCE_ENABLED": os.getenv("PERSISTENCE_ENABLED", "1").lower() in ("1", "true", "yes"),
+            "PERSISTENCE_UPDATE_INTERVAL": float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "30")),
+            "UPDATE_MODE": os.getenv("UPDATE_MODE", "polling").lower(),
+            "WEBHOOK_URL": os.getenv("WEBHOOK_URL", ""),
+            "WEBHOOK_LISTEN": os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            "WEBHOOK_PORT": int(os.getenv("WEBHOOK_PORT", "8443")),
+            "WEBHOOK_PATH": os.getenv("WEBHOOK_PATH", "telegram").strip("/"),
+            "WEBHOOK_SECRET_TOKEN": os.getenv("WEBHOOK_SECRET_TOKEN", ""),
+            "WEBHOOK_MAX_CONNECTIONS": int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+            "CONCURRENT_UPDATES": int(os.getenv("CONCURRENT_UPDATES", "8")),
+            "DROP_PENDING_UPDATES": os.getenv("DROP_PENDING_UPDATES", ""),
+            "SHARD_COUNT": int(os.getenv("SHARD_COUNT", "1")),
+            "SHARD_INDEX": os.getenv("SHARD_INDEX", ""),
+            "SHARD_SIMULATE": os.getenv("SHARD_SIMULATE", "").lower() in ("1", "true", "yes"),
+            "METRICS_LISTEN": os.getenv("METRICS_LISTEN", "127.0.0.1"),
+            "METRICS_PORT": int(os.getenv("METRICS_PORT", "0")),
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "INFO").upper(),
+            "LOG_FORMAT": os.getenv("LOG_FORMAT", "text").lower(),
+            "LOG_DIR": os.getenv("LOG_DIR", "logs"),
+            # نمونه‌برداری لاگ‌های INFO/DEBUG هر ماژول: "bot.handlers.khatm_handlers=0.1,bot.database=0.5"
+            "LOG_SAMPLE_RATES": parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")),
+            # آپدیت‌هایی که (با نوشتن‌های صفشان) بیشتر از این طول بکشند در TRACE_LOG_PATH ثبت می‌شوند؛ 0 = خاموش
+            "TRACE_SLOW_MS": float(os.getenv("TRACE_SLOW_MS", "1000")),
+            "TRACE_LOG_PATH": os.getenv("TRACE_LOG_PATH", ""),
+            "PROFILE_DIR": os.getenv("PROFILE_DIR", ""),
+            # توقف‌های event loop بیشتر از این (میلی‌ثانیه) هنگام پروفایل ثبت می‌شوند
+            "LOOP_STALL_MS": float(os.getenv("LOOP_STALL_MS", "100")),
+            # تشخیص دائمی مسدود شدن event loop بیشتر از این (میلی‌ثانیه)؛ 0 = خاموش
+            "LOOP_BLOCK_MS": float(os.getenv("LOOP_BLOCK_MS", "0")),
+            # بررسی تدریجی لینک‌های دعوت: هر INVITE_LINK_BATCH_INTERVAL ثانیه حداکثر INVITE_LINK_BATCH_SIZE گروه
+            "INVITE_LINK_VERIFY_DAYS": float(os.getenv("INVITE_LINK_VERIFY_DAYS", "7")),
+            "INVITE_LINK_BATCH_SIZE": int(os.getenv("INVITE_LINK_BATCH_SIZE", "20")),
+            "INVITE_LINK_BATCH_INTERVAL": float(os.getenv("INVITE_LINK_BATCH_INTERVAL", "300")),
+            # سقف پیام در ثانیه برای اطلاع‌رسانی‌های گروهی (bot/utils/broadcast.py)
+            "BROADCAST_RATE": float(os.getenv("BROADCAST_RATE", "20")),
         }
+        if not settings["TRACE_LOG_PATH"]:
+            settings["TRACE_LOG_PATH"] = os.path.join(settings["LOG_DIR"], "slow_traces.jsonl")
+        if not settings["PROFILE_DIR"]:
+            settings["PROFILE_DIR"] = os.path.join(settings["LOG_DIR"], "profiles")
+        # هر شارد فایل‌های دیتابیس خودش را دارد: <base>_shard<i>.db
+        settings["SHARD_DATABASE_PATHS"] = [
+            shard_path(settings["DATABASE_PATH"], index, settings["SHARD_COUNT"])
+            for index in range(max(settings["SHARD_COUNT"], 1))
+        ]
+        if settings["SHARD_INDEX"] != "":
+            index = int(settings["SHARD_INDEX"])
+            if not 0 <= index < settings["SHARD_COUNT"]:
+                raise ValueError("SHARD_INDEX must be between 0 and SHARD_COUNT - 1")
+            settings["SHARD_INDEX"] = index
+            # هر ورکر endpoint متریک خودش را روی METRICS_PORT + index دارد
+            if settings["METRICS_PORT"]:
+                settings["METRICS_PORT"] += index
+            settings["DATABASE_PATH"] = settings["SHARD_DATABASE_PATHS"][index]
+            settings["MEMBERS_DATABASE_PATH"] = shard_path(settings["MEMBERS_DATABASE_PATH"], index, settings["SHARD_COUNT"])
+            settings["TRACE_LOG_PATH"] = shard_path(settings["TRACE_LOG_PATH"], index, settings["SHARD_COUNT"])
+            if settings["ARCHIVE_DATABASE_PATH"]:
+                settings["ARCHIVE_DATABASE_PATH"] = shard_path(settings["ARCHIVE_DATABASE_PATH"], index, settings["SHARD_COUNT"])
+        else:
+            settings["SHARD_INDEX"] = None
+        if settings["LOG_LEVEL"] not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+            raise ValueError("LOG_LEVEL must be DEBUG, INFO, WARNING, ERROR or CRITICAL")
+        if settings["LOG_FORMAT"] not in ("text", "json"):
+            raise ValueError("LOG_FORMAT must be 'text' or 'json'")
+        if settings["UPDATE_MODE"] not in ("polling", "webhook"):
+            raise ValueError("UPDATE_MODE must be 'polling' or 'webhook'")
+        if settings["UPDATE_MODE"] == "webhook":
+            if not settings["WEBHOOK_URL"]:
+                raise ValueError("WEBHOOK_URL is required in webhook mode")
+            if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", settings["WEBHOOK_SECRET_TOKEN"]):
+                raise ValueError("WEBHOOK_SECRET_TOKEN (1-256 chars of A-Z, a-z, 0-9, _ and -) is required in webhook mode")
+        # پیش‌فرض: در polling مثل قبل آپدیت‌های معوق دور ریخته می‌شوند، در webhook نگه داشته می‌شوند
+        if settings["DROP_PENDING_UPDATES"]:
+            settings["DROP_PENDING_UPDATES"] = settings["DROP_PENDING_UPDATES"].lower() in ("1", "true", "yes")
+        else:
+            settings["DROP_PENDING_UPDATES"] = settings["UPDATE_MODE"] == "polling"
+        if not settings["ARCHIVE_DATABASE_PATH"]:
+            base, _ = os.path.splitext(settings["DATABASE_PATH"])
+            settings["ARCHIVE_DATABASE_PATH"] = f"{base}_archive.db"
         if not settings["TELEGRAM_TOKEN"]:
             raise ValueError("TELEGRAM_TOKEN is required")
         if not os.path.isdir(os.path.dirname(settings["DATABASE_PATH"]) or "."):
@@ -24,4 +126,41 @@ def load_settings():
 SETTINGS = load_settings()
 TELEGRAM_TOKEN = SETTINGS["TELEGRAM_TOKEN"]
 DATABASE_PATH = SETTINGS["DATABASE_PATH"]
-HADITH_CHANNEL = SETTINGS["HADITH_CHANNEL"]
\ No newline at end of file
+HADITH_CHANNEL = SETTINGS["HADITH_CHANNEL"]
+ARCHIVE_DATABASE_PATH = SETTINGS["ARCHIVE_DATABASE_PATH"]
+CONTRIBUTION_RETENTION_DAYS = SETTINGS["CONTRIBUTION_RETENTION_DAYS"]
+MEMBERS_DATABASE_PATH = SETTINGS["MEMBERS_DATABASE_PATH"]
+LEGACY_USER_STORE_PATH = SETTINGS["LEGACY_USER_STORE_PATH"]
+PENDING_SELECTION_TTL = SETTINGS["PENDING_SELECTION_TTL"]
+PENDING_SELECTION_MAX = SETTINGS["PENDING_SELECTION_MAX"]
+PENDING_SELECTION_PERSIST = SETTINGS["PENDING_SELECTION_PERSIST"]
+PERSISTENCE_ENABLED = SETTINGS["PERSISTENCE_ENABLED"]
+PERSISTENCE_UPDATE_INTERVAL = SETTINGS["PERSISTENCE_UPDATE_INTERVAL"]
+UPDATE_MODE = SETTINGS["UPDATE_MODE"]
+WEBHOOK_URL = SETTINGS["WEBHOOK_URL"]
+WEBHOOK_LISTEN = SETTINGS["WEBHOOK_LISTEN"]
+WEBHOOK_PORT = SETTINGS["WEBHOOK_PORT"]
+WEBHOOK_PATH = SETTINGS["WEBHOOK_PATH"]
+WEBHOOK_SECRET_TOKEN = SETTINGS["WEBHOOK_SECRET_TOKEN"]
+WEBHOOK_MAX_CONNECTIONS = SETTINGS["WEBHOOK_MAX_CONNECTIONS"]
+CONCURRENT_UPDATES = SETTINGS["CONCURRENT_UPDATES"]
+DROP_PENDING_UPDATES = SETTINGS["DROP_PENDING_UPDATES"]
+SHARD_COUNT = SETTINGS["SHARD_COUNT"]
+SHARD_INDEX = SETTINGS["SHARD_INDEX"]
+SHARD_SIMULATE = SETTINGS["SHARD_SIMULATE"]
+SHARD_DATABASE_PATHS = SETTINGS["SHARD_DATABASE_PATHS"]
+METRICS_LISTEN = SETTINGS["METRICS_LISTEN"]
+METRICS_PORT = SETTINGS["METRICS_PORT"]
+LOG_LEVEL = SETTINGS["LOG_LEVEL"]
+LOG_FORMAT = SETTINGS["LOG_FORMAT"]
+LOG_DIR = SETTINGS["LOG_DIR"]
+LOG_SAMPLE_RATES = SETTINGS["LOG_SAMPLE_RATES"]
+TRACE_SLOW_MS = SETTINGS["TRACE_SLOW_MS"]
+TRACE_LOG_PATH = SETTINGS["TRACE_LOG_PATH"]
+PROFILE_DIR = SETTINGS["PROFILE_DIR"]
+LOOP_STALL_MS = SETTINGS["LOOP_STALL_MS"]
+LOOP_BLOCK_MS = SETTINGS["LOOP_BLOCK_MS"]
+INVITE_LINK_VERIFY_DAYS = SETTINGS["INVITE_LINK_VERIFY_DAYS"]
+INVITE_LINK_BATCH_SIZE = SETTINGS["INVITE_LINK_BATCH_SIZE"]
+INVITE_LINK_BATCH_INTERVAL = SETTINGS["INVITE_LINK_BATCH_INTERVAL"]
+BROADCAST_RATE = SETTINGS["BROADCAST_RATE"]
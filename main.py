@@ -1,9 +1,14 @@
+import time as time_module
+# شروع ایمپورت‌ها؛ مرحله imports در گزارش زمان راه‌اندازی
+_IMPORTS_STARTED = time_module.perf_counter()
 import asyncio
 import logging
 import backoff
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ChatMemberHandler
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
 from telegram.ext import ContextTypes
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.request import BaseRequest, HTTPXRequest
 from typing import Optional
 
 
@@ -29,18 +34,28 @@ from bot.handlers.settings_handlers import (
 )
 from bot.handlers.stats_handlers import show_total_stats, show_ranking
 from bot.handlers.hadith_handlers import hadis_on, hadis_off, send_daily_hadith
-from bot.handlers.tag_handlers import setup_handlers, TagManager
-from bot.handlers.user_handlers import chat_member_handler as user_chat_member_handler, message_handler as user_message_handler
+from bot.handlers.tag_handlers import setup_handlers, TagManager, resume_tag_jobs
+from bot.handlers.user_handlers import chat_member_handler as user_chat_member_handler, message_handler as user_message_handler, flush_member_registry
 from bot.handlers.error_handlers import error_handler
-from bot.database.db import init_db, process_queue_request, execute, write_queue, close_db_connection, is_group_banned, set_group_invite_link, fetch_one, generate_invite_links_for_all_groups, fetch_all
-from bot.database.members_db import execute as members_execute
-from bot.utils.constants import DEFAULT_SEPAS_TEXTS, DAILY_HADITH_TIME, DAILY_RESET_TIME, DAILY_PERIOD_RESET_TIME, MONITOR_CHANNEL_ID, MAIN_GROUP_ID
-from config.settings import TELEGRAM_TOKEN
+from bot.database.db import init_db, process_queue_request, execute, write_queue, close_db_connection, is_group_banned, load_ban_registry, seed_all_reference_data, set_group_invite_link, fetch_one, compact_contributions, DatabaseError, get_invite_links_due, mark_invite_link_checked
+from bot.database.members_db import member_registry, init_members_db, close_members_db
+from bot.utils.constants import DAILY_HADITH_TIME, DAILY_RESET_TIME, DAILY_PERIOD_RESET_TIME, DAILY_COMPACTION_TIME, MONITOR_CHANNEL_ID
+from config.settings import (
+    TELEGRAM_TOKEN, PERSISTENCE_ENABLED, PERSISTENCE_UPDATE_INTERVAL, UPDATE_MODE, WEBHOOK_URL, WEBHOOK_LISTEN,
+    WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, WEBHOOK_MAX_CONNECTIONS, CONCURRENT_UPDATES,
+    DROP_PENDING_UPDATES, SHARD_SIMULATE, SHARD_INDEX, DATABASE_PATH, METRICS_LISTEN, METRICS_PORT,
+    INVITE_LINK_VERIFY_DAYS, INVITE_LINK_BATCH_SIZE, INVITE_LINK_BATCH_INTERVAL,
+)
+from bot.utils.instrumented_request import InstrumentedRequest
+from bot.utils.metrics import INVITE_LINK_CHECKS, REGISTRY, StartupReport, start_metrics_server
+from bot.utils.tracing import TracingApplication
+from bot.utils.profiler import start_blocking_detector, stop_blocking_detector
+from bot.database.persistence import SQLitePersistence
 from bot.utils.logging_config import setup_logging
 from bot.utils.helpers import ignore_old_messages
+from bot.utils.pending_store import load_pending_selections, prune_pending_selections, pending_zekr, pending_doa
+from bot.utils.update_processor import KeyedUpdateProcessor
 from bot.handlers.dashboard import setup_dashboard_handlers
-from datetime import time
-import time as time_module
 
 logger = logging.getLogger(__name__)
 logging.getLogger("apscheduler").setLevel(logging.WARNING)
@@ -177,56 +192,76 @@ async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
                     )
             return
 
-        if chat.id == MAIN_GROUP_ID:
-            status = chat_member.new_chat_member.status
-            current_timestamp = int(time_module.time())
-            if status in ["member", "administrator", "creator"]:
-                username = user.username or None
-                first_name = user.first_name or "User"
-                last_name = user.last_name or None
-                is_bot = 1 if user.is_bot else 0
-                await members_execute(
-                    """
-                    INSERT OR REPLACE INTO members (
-                        user_id, group_id, username, first_name, last_name,
-                        is_bot, is_deleted, scraped_timestamp
-                    )
-                    VALUES (?, ?, ?, ?, ?, ?, 0, ?)
-                    """,
-                    (user_id, chat.id, username, first_name, last_name, is_bot, current_timestamp)
-                )
-                logger.info("User %s (%s) added/updated as active in main group %s", user.id, username or first_name, chat.id)
-            elif status in ["left", "kicked"]:
-                await members_execute(
-                    """
-                    UPDATE members
-                    SET is_deleted = 1, scraped_timestamp = ?
-                    WHERE user_id = ? AND group_id = ?
-                    """,
-                    (current_timestamp, user.id, chat.id)
-                )
-                logger.info("User %s marked as deleted in main group %s", user.id, chat.id)
+        # ثبت عضویت/خروج در رجیستری اعضا برای همه گروه‌ها
+        status = chat_member.new_chat_member.status
+        if status in ["member", "administrator", "creator"]:
+            member_registry.add_user(chat.id, user)
+            logger.info("User %s added/updated as active in group %s", user_id, chat.id)
+        elif status in ["left", "kicked"]:
+            member_registry.mark_left(chat.id, user_id)
+            logger.info("User %s marked as deleted in group %s", user_id, chat.id)
     except Exception as e:
         logger.error("Error in chat_member_handler: %s", str(e), exc_info=True)
 
+# فاصله فراخوانی‌های Bot API در هر دسته و فاصله پایه تلاش دوباره برای گروه‌های ناموفق
+INVITE_LINK_CALL_DELAY = 1.0
+INVITE_LINK_RETRY_HOURS = 1.0
+
+async def _refresh_invite_link(bot, group_id: int, invite_link: str) -> str:
+    if invite_link:
+        try:
+            # editChatInviteLink بدون تغییر، وضعیت فعلی لینکی را که ربات ساخته برمی‌گرداند
+            link = await bot.edit_chat_invite_link(group_id, invite_link)
+            if not link.is_revoked:
+                await mark_invite_link_checked(group_id, ok=True)
+                return "verified"
+        except BadRequest as e:
+            # لینک باطل یا منقضی شده، یا توسط ربات ساخته نشده است
+            logger.debug("Invite link of group %s is no longer valid: %s", group_id, e)
+    new_link = await bot.create_chat_invite_link(group_id, member_limit=None)
+    await set_group_invite_link(group_id, new_link.invite_link)
+    return "recreated" if invite_link else "created"
+
 async def refresh_invite_links(context: ContextTypes.DEFAULT_TYPE):
+    """
+    یک دسته از لینک‌های دعوت کهنه، ناموفق یا ساخته‌نشده را بررسی می‌کند (get_invite_links_due)،
+    تا به جای ساختن لینک همه گروه‌ها یک‌جا، کار در طول روز پخش شود.
+    """
     try:
-        groups = await fetch_all("SELECT group_id, invite_link FROM groups")
-        for group in groups:
-            group_id = group["group_id"]
+        groups = await get_invite_links_due(INVITE_LINK_BATCH_SIZE, INVITE_LINK_VERIFY_DAYS, INVITE_LINK_RETRY_HOURS)
+    except DatabaseError:
+        return
+    results = {}
+    for index, group in enumerate(groups):
+        if index:
+            await asyncio.sleep(INVITE_LINK_CALL_DELAY)
+        group_id = group["group_id"]
+        try:
+            result = await _refresh_invite_link(context.bot, group_id, group["invite_link"])
+        except RetryAfter as e:
+            # بقیه دسته به اجرای بعدی می‌ماند
+            logger.warning("Invite link refresh stopped by flood control, retry after %s s", e.retry_after)
+            INVITE_LINK_CHECKS.inc(result="retry_after")
+            break
+        except (TelegramError, DatabaseError) as e:
+            result = "failed"
+            logger.warning("Invite link refresh failed for group %s (failures=%s): %s",
+                           group_id, group["invite_link_failures"] + 1, e)
             try:
-                chat = await context.bot.get_chat(group_id)
-                if group["invite_link"]:
-                    try:
-                        await context.bot.get_chat_invite_link(group_id, group["invite_link"])
-                    except Exception:
-                        new_link = await context.bot.create_chat_invite_link(group_id, member_limit=None)
-                        await set_group_invite_link(group_id, new_link.invite_link)
-                        logger.info("Refreshed invite link for group: group_id=%s", group_id)
-            except Exception as e:
-                logger.error("Error refreshing link for group %s: %s", group_id, str(e), exc_info=True)
+                await mark_invite_link_checked(group_id, ok=False)
+            except DatabaseError:
+                pass
+        INVITE_LINK_CHECKS.inc(result=result)
+        results[result] = results.get(result, 0) + 1
+    if results:
+        logger.info("Invite link refresh: %s", ", ".join(f"{name}={count}" for name, count in sorted(results.items())))
+
+async def compact_contributions_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        compacted = await compact_contributions()
+        logger.info("Contribution compaction finished: rows=%s", compacted)
     except Exception as e:
-        logger.error("Error in refresh_invite_links: %s", str(e), exc_info=True)
+        logger.error("Error in compact_contributions_job: %s", str(e), exc_info=True)
 
 async def handle_new_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle new messages in groups."""
@@ -257,42 +292,25 @@ async def ignore_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat:
         await context.bot.send_message(update.effective_chat.id, "دستور ناشناخته! از /help استفاده کنید.")
 
-async def initialize_app():
+async def initialize_app(report: Optional[StartupReport] = None):
     if not TELEGRAM_TOKEN:
         raise ValueError("TELEGRAM_TOKEN is required")
 
-    # پاک‌سازی متن‌های سپاس تکراری (یک‌بار اجرا)
-    logger.info("Attempting to clean up duplicate default sepas texts...")
-    try:
-        from bot.database.db import execute, init_db_connection
-        await init_db_connection()
-        await execute(
-            """
-            DELETE FROM sepas_texts
-            WHERE is_default = 1 AND rowid NOT IN (
-                SELECT MIN(rowid)
-                FROM sepas_texts
-                WHERE is_default = 1
-                GROUP BY text
-            )
-            """
-        )
-        logger.info("Database cleanup successful. Duplicate default texts removed.")
-    except Exception as e:
-        logger.error(f"An error occurred during the one-time cleanup, but we will proceed: {e}")
-
+    # اسکیما، مهاجرت‌ها، حذف تکراری‌ها و متن‌های پیش‌فرض سپاس توسط موتور مهاجرت
+    # نسخه‌دار انجام می‌شوند و وقتی دیتابیس به‌روز است کاملاً رد می‌شوند.
+    started = time_module.perf_counter()
+    report = report or StartupReport(started)
     await init_db()
-
-    import aiosqlite
-    from bot.database.db import execute
-    for text in DEFAULT_SEPAS_TEXTS:
-        try:
-            await execute(
-                "INSERT INTO sepas_texts (text, is_default, group_id) VALUES (?, 1, NULL)",
-                (text,)
-            )
-        except aiosqlite.IntegrityError:
-            pass
+    report.mark("init_db")
+    await seed_all_reference_data()
+    report.mark("reference_data")
+    await init_members_db()
+    report.mark("members_db")
+    await load_ban_registry()
+    report.mark("ban_registry")
+    await load_pending_selections()
+    report.mark("pending_selections")
+    logger.info("Application initialized in %.1f ms", (time_module.perf_counter() - started) * 1000)
 
 def register_handlers(app: Application):
     # --- هندلرهای دکمه (Callback Query) - اولویت بالا ---
@@ -410,7 +428,88 @@ def register_jobs(app: Application):
     job_queue.run_daily(reset_daily_groups, DAILY_RESET_TIME, days=(0, 1, 2, 3, 4, 5, 6), name="job_daily_reset")
     job_queue.run_daily(reset_periodic_topics, DAILY_PERIOD_RESET_TIME, days=(0, 1, 2, 3, 4, 5, 6), name="job_period_reset")
     job_queue.run_repeating(process_queue_periodically, interval=1.0, first=1.0, name="job_queue_worker")
-    job_queue.run_daily(refresh_invite_links, time(hour=0, minute=0), name="refresh_invite_links")
+    job_queue.run_repeating(flush_member_registry, interval=5.0, first=5.0, name="job_member_registry_flush")
+    job_queue.run_repeating(prune_pending_selections, interval=300.0, first=300.0, name="job_prune_pending_selections")
+    job_queue.run_repeating(refresh_invite_links, interval=INVITE_LINK_BATCH_INTERVAL, first=60.0, name="refresh_invite_links")
+    job_queue.run_daily(compact_contributions_job, DAILY_COMPACTION_TIME, name="job_compact_contributions")
+
+ALLOWED_UPDATES = ["message", "chat_member", "callback_query"]
+
+def build_application(with_updater: bool = True, request: Optional[BaseRequest] = None) -> Application:
+    """request: جایگزین HTTPXRequest (مثلاً FakeBotRequest در شبیه‌سازی و بنچمارک)."""
+    builder = Application.builder().token(TELEGRAM_TOKEN).application_class(TracingApplication)
+    if PERSISTENCE_ENABLED:
+        # chat_data/user_data/bot_data فقط برای کلیدهای تغییرکرده در دیتابیس نوشته می‌شوند
+        builder = builder.persistence(SQLitePersistence(update_interval=PERSISTENCE_UPDATE_INTERVAL))
+    if CONCURRENT_UPDATES > 1:
+        # تاپیک‌های مختلف موازی، آپدیت‌های هر (group_id, topic_id) به ترتیب؛
+        # نوشتن‌ها همچنان از write_queue عبور می‌کنند
+        builder = builder.concurrent_updates(KeyedUpdateProcessor(CONCURRENT_UPDATES))
+    if not with_updater:
+        # ورکر شارد: آپدیت‌ها از پروسه جلویی می‌رسند
+        builder = builder.updater(None)
+    if request is not None or SHARD_SIMULATE:
+        # Bot API جعلی فقط در شبیه‌سازی و بنچمارک لازم است
+        from bot.utils.fake_bot_api import FakeBotRequest
+    if request is None and SHARD_SIMULATE:
+        # شبیه‌سازی محلی بدون شبکه
+        request = FakeBotRequest()
+    if request is not None:
+        builder = builder.request(InstrumentedRequest(request)).get_updates_request(FakeBotRequest())
+    else:
+        # همان request پیش‌فرض ApplicationBuilder، با ثبت زمان هر متد در متریک‌ها
+        builder = builder.request(InstrumentedRequest(HTTPXRequest(connection_pool_size=256)))
+    app = builder.build()
+    register_metrics(app)
+    return app
+
+_metrics_server: Optional[asyncio.AbstractServer] = None
+
+def register_metrics(app: Application) -> None:
+    """Gauge های وضعیت صف‌ها که هنگام خواندن /metrics محاسبه می‌شوند."""
+    processor = app.update_processor
+    if isinstance(processor, KeyedUpdateProcessor):
+        REGISTRY.gauge("bot_update_processor_waiting_updates", "Updates waiting behind another update of the same topic",
+                       callback=lambda: processor.stats()["waiting_updates"])
+        REGISTRY.gauge("bot_update_processor_active_keys", "Topics with an update in progress",
+                       callback=lambda: processor.stats()["active_keys"])
+    REGISTRY.gauge("bot_update_queue_depth", "Updates waiting in the application update queue",
+                   callback=app.update_queue.qsize)
+    REGISTRY.gauge("bot_pending_selections", "Pending zekr/doa selections in memory", ("store",),
+                   callback=lambda: {"zekr": pending_zekr.stats()["size"], "doa": pending_doa.stats()["size"]})
+
+async def start_metrics_endpoint() -> Optional[asyncio.AbstractServer]:
+    """endpoint متنی Prometheus روی METRICS_LISTEN:METRICS_PORT؛ METRICS_PORT=0 یعنی غیرفعال."""
+    if not METRICS_PORT:
+        return None
+    try:
+        return await start_metrics_server(METRICS_LISTEN, METRICS_PORT)
+    except OSError as e:
+        logger.error("Could not start metrics endpoint on %s:%s: %s", METRICS_LISTEN, METRICS_PORT, e)
+        return None
+
+async def start_updates(app: Application):
+    """دریافت آپدیت‌ها با long polling یا webhook (UPDATE_MODE در config/settings.py)."""
+    if UPDATE_MODE == "webhook":
+        # سرور webhook خود PTB (tornado)؛ درخواست‌های بدون هدر X-Telegram-Bot-Api-Secret-Token
+        # درست با 403 رد می‌شوند. آپدیت‌های زمان ری‌استارت در تلگرام می‌مانند و بعداً تحویل می‌شوند.
+        await app.updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=DROP_PENDING_UPDATES
+        )
+        logger.info("Webhook server listening on %s:%s/%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+    else:
+        await app.updater.start_polling(
+            allowed_updates=ALLOWED_UPDATES,
+            timeout=30,
+            drop_pending_updates=DROP_PENDING_UPDATES
+        )
 
 async def shutdown(app: Application):
     await app.stop()
@@ -427,41 +526,121 @@ async def main():
     
     # ۱. تمام کارهای راه‌اندازی async را انجام بده
     # (فرض می‌کنم initialize_app تابع init_db() را صدا می‌زند که مهاجرت‌ها را اجرا می‌کند)
-    await initialize_app() 
-    
+    report = StartupReport(_IMPORTS_STARTED)
+    report.mark("imports")
     setup_logging()
+    # از همین ابتدا تا کارهای همگام راه‌اندازی (schema، فایل قرآن و ...) هم دیده شوند
+    start_blocking_detector()
+    report.mark("logging")
+    await initialize_app(report)
+    
     map_handlers()
 
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    app = build_application()
+    report.mark("build_application")
     
     # ۲. کارهای مربوط به app را انجام بده
-    await generate_invite_links_for_all_groups(app.bot)
     register_handlers(app)
     register_jobs(app)
+    report.mark("handlers")
     
     # ۳. ربات را راه‌اندازی و شروع کن
     await app.initialize()
-    await app.updater.start_polling(
-        allowed_updates=["message", "chat_member", "callback_query"], 
-        timeout=30, 
-        drop_pending_updates=True
-    )
+    report.mark("app_initialize")
+    await start_updates(app)
+    report.mark("start_updates")
     await app.start()
+    report.mark("app_start")
+
+    # ادامه عملیات /tag که با ری‌استارت قطع شده‌اند
+    await resume_tag_jobs(app)
+    report.mark("resume_tag_jobs")
+    global _metrics_server
+    _metrics_server = await start_metrics_endpoint()
+    report.mark("metrics_endpoint")
     
+    logger.info("Startup finished in %s", report.summary())
     logger.info("ربات با موفقیت شروع به کار کرد...")
     
     # ۴. خود اپلیکیشن را برگردان تا در بخش main قابل دسترس باشد
     return app
 
+async def run_shard_worker(inbox) -> None:
+    """
+    ورکر یک شارد (bot/sharding.py): دیتابیس و write_queue خودش را دارد و آپدیت‌هایی را که
+    پروسه جلویی بر اساس group_id به آن فرستاده از inbox (multiprocessing.Queue) می‌خواند.
+    None در inbox یعنی پایان و پیام‌های دارای SHARD_COMMAND دستورهای ورکرهای دیگر (مثل بن از داشبورد) هستند.
+    """
+    from bot.sharding import SHARD_COMMAND, reply_to_command, run_shard_command
+
+    report = StartupReport(_IMPORTS_STARTED)
+    report.mark("imports")
+    setup_logging()
+    start_blocking_detector()
+    report.mark("logging")
+    await initialize_app(report)
+    map_handlers()
+
+    app = build_application(with_updater=False)
+    report.mark("build_application")
+    register_handlers(app)
+    register_jobs(app)
+    report.mark("handlers")
+    await app.initialize()
+    report.mark("app_initialize")
+    await app.start()
+    report.mark("app_start")
+    await resume_tag_jobs(app)
+    report.mark("resume_tag_jobs")
+    metrics_server = await start_metrics_endpoint()
+    report.mark("metrics_endpoint")
+    logger.info("Shard worker %s started in %s (database: %s)", SHARD_INDEX, report.summary(), DATABASE_PATH)
+
+    loop = asyncio.get_running_loop()
+    processed = 0
+    try:
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:
+                break
+            if SHARD_COMMAND in data:
+                # ورکر فرستنده (مثلاً داشبورد) تا رسیدن این پاسخ منتظر می‌ماند
+                try:
+                    await run_shard_command(data[SHARD_COMMAND], data["args"])
+                except Exception as e:
+                    logger.error("Shard command %s failed: %s", data[SHARD_COMMAND], e, exc_info=True)
+                    reply_to_command(data, error=str(e) or type(e).__name__)
+                else:
+                    reply_to_command(data)
+                continue
+            await app.update_queue.put(Update.de_json(data, app.bot))
+            processed += 1
+    finally:
+        logger.info("Shard worker %s stopping after %s updates", SHARD_INDEX, processed)
+        # stop() آپدیت‌های باقی‌مانده را پردازش می‌کند؛ بعد از آن جاب صف دیگر اجرا نمی‌شود
+        await app.stop()
+        await process_queue_periodically(None)
+        await member_registry.flush()
+        if metrics_server:
+            metrics_server.close()
+        await stop_blocking_detector()
+        await app.shutdown()
+        await close_members_db()
+        await close_db_connection()
+
 async def shutdown(app: Application):
     """
     توابع مورد نیاز برای خاموش کردن ربات را اجرا می‌کند.
     """
     # (این بخش را مطابق نیاز خودتان تغییر دهید)
     logger.info("در حال اجرای توابع خاموش شدن...")
+    if _metrics_server:
+        _metrics_server.close()
+    await stop_blocking_detector()
     await app.stop()
     await app.updater.stop()
     await app.shutdown()
+    await close_members_db()
     logger.info("خاموش شدن با موفقیت انجام شد.")
 
 
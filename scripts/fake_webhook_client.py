@@ -0,0 +1,176 @@
+"""
+کلاینت جعلی تلگرام برای آزمایش حالت webhook به صورت محلی و بدون شبکه.
+
+بدون --url، اسکریپت خودش سرور webhook ربات (main.start_updates با تنظیمات UPDATE_MODE=webhook)
+را روی یک پورت آزاد محلی بالا می‌آورد؛ Bot API با FakeBotRequest جعل می‌شود، پس setWebhook
+به تلگرام نمی‌رود. آپدیت‌های ساختگی پیام هم‌زمان به سرور فرستاده می‌شوند و بررسی می‌شود که:
+  - درخواست با توکن اشتباه رد شود (403)
+  - درخواست‌ها با secret token درست پذیرفته شوند (200)
+  - همه آپدیت‌های پذیرفته‌شده به هندلرهای Application برسند
+سپس سرور متوقف می‌شود. با --url همان آزمایش (بدون شمارش تحویل) روی ربات در حال اجرا انجام می‌شود.
+
+Usage:
+    python scripts/fake_webhook_client.py --count 200
+    python scripts/fake_webhook_client.py --url http://127.0.0.1:8443/telegram \\
+        --secret "$WEBHOOK_SECRET_TOKEN" --chat-id -1001234567890 --count 200
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import secrets
+import socket
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+_update_ids = itertools.count(int(time.time()))
+
+
+def make_message_update(chat_id: int, user_id: int, text: str, thread_id: int = None) -> Dict:
+    update_id = next(_update_ids)
+    message = {
+        "message_id": update_id % 2_000_000_000,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup", "title": "fake group"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if thread_id:
+        message["message_thread_id"] = thread_id
+        message["is_topic_message"] = True
+    return {"update_id": update_id, "message": message}
+
+
+async def post_updates(client: httpx.AsyncClient, url: str, secret: str, updates: List[Dict],
+                       concurrency: int) -> List[int]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(update):
+        async with semaphore:
+            response = await client.post(url, json=update, headers={SECRET_HEADER: secret})
+            return response.status_code
+
+    return await asyncio.gather(*(post(update) for update in updates))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalWebhookServer:
+    """
+    سرور webhook ربات با Bot API جعلی. تنظیمات هنگام import خوانده می‌شوند، پس محیط
+    قبل از import main آماده می‌شود؛ هندلر TypeHandler فقط آپدیت‌های رسیده را می‌شمارد.
+    """
+
+    def __init__(self, secret: str, path: str = "telegram"):
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}/{path}"
+        os.environ.setdefault("TELEGRAM_TOKEN", "123456:fake-webhook-token")
+        os.environ.update({
+            "UPDATE_MODE": "webhook",
+            "WEBHOOK_URL": f"http://127.0.0.1:{self.port}",
+            "WEBHOOK_LISTEN": "127.0.0.1",
+            "WEBHOOK_PORT": str(self.port),
+            "WEBHOOK_PATH": path,
+            "WEBHOOK_SECRET_TOKEN": secret,
+        })
+        self.delivered = 0
+        self.app = None
+
+    async def start(self) -> None:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from telegram import Update
+        from telegram.ext import Application, TypeHandler
+        from bot.utils.fake_bot_api import FakeBotRequest
+        from main import start_updates
+
+        async def count(update: Update, context) -> None:
+            self.delivered += 1
+
+        self.app = (
+            Application.builder().token(os.environ["TELEGRAM_TOKEN"])
+            .request(FakeBotRequest()).get_updates_request(FakeBotRequest()).build()
+        )
+        self.app.add_handler(TypeHandler(Update, count))
+        await self.app.initialize()
+        await start_updates(self.app)
+        await self.app.start()
+
+    async def wait_delivered(self, expected: int, timeout: float = 10) -> int:
+        deadline = time.monotonic() + timeout
+        while self.delivered < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return self.delivered
+
+    async def stop(self) -> None:
+        if self.app is None:
+            return
+        await self.app.updater.stop()
+        await self.app.stop()
+        await self.app.shutdown()
+
+
+async def run(args) -> int:
+    server: Optional[LocalWebhookServer] = None
+    url, secret = args.url, args.secret
+    if url is None:
+        secret = secret or secrets.token_urlsafe(32)
+        server = LocalWebhookServer(secret)
+        await server.start()
+        url = server.url
+        print(f"local webhook server started on {url}")
+    updates = [
+        make_message_update(args.chat_id, args.user_id + i % args.users, args.text, args.thread_id)
+        for i in range(args.count)
+    ]
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            rejected = await post_updates(client, url, "wrong-token", updates[:1], 1)
+            started = time.perf_counter()
+            statuses = await post_updates(client, url, secret, updates, args.concurrency)
+            elapsed = time.perf_counter() - started
+        delivered = await server.wait_delivered(statuses.count(200)) if server else None
+    finally:
+        if server:
+            await server.stop()
+            print("local webhook server stopped")
+
+    accepted = statuses.count(200)
+    print(f"wrong secret -> HTTP {rejected[0]} (expected 403)")
+    print(f"{accepted}/{len(statuses)} updates accepted in {elapsed:.2f}s "
+          f"({len(statuses) / elapsed:.0f} updates/s)")
+    ok = rejected[0] == 403 and accepted == len(statuses)
+    if delivered is not None:
+        # آپدیت با توکن اشتباه نباید به هندلرها برسد
+        print(f"{delivered}/{accepted} accepted updates delivered to handlers")
+        ok = ok and delivered == accepted
+    return 0 if ok else 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Send fake Telegram updates to the local webhook server.")
+    parser.add_argument("--url", default=None,
+                        help="webhook of a running bot; without it a local server with a fake Bot API is started")
+    parser.add_argument("--secret", default=None, help="WEBHOOK_SECRET_TOKEN of the bot (required with --url)")
+    parser.add_argument("--chat-id", type=int, default=-1001234567890)
+    parser.add_argument("--thread-id", type=int, default=None)
+    parser.add_argument("--user-id", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=50, help="number of distinct fake senders")
+    parser.add_argument("--text", default="1")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+    if args.url and not args.secret:
+        parser.error("--secret is required with --url")
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())